@@ -0,0 +1,16 @@
+from browsy import BaseJob, Page
+
+
+class NoopJob(BaseJob):
+    """Returns right away without touching the page.
+
+    Measures the overhead of the queue itself - submitting, claiming and
+    saving jobs - without any browser work.
+    """
+
+    NAME = "noop"
+
+    output_size: int = 1024
+
+    async def execute(self, page: Page) -> bytes:
+        return b"x" * self.output_size
@@ -0,0 +1,657 @@
+"""Throughput and latency benchmarks of browsy.
+
+Every scenario starts a server and workers on a fresh database, submits
+jobs through `AsyncBrowsyClient` and waits until all of them are finished.
+Results are saved as JSON, so that runs (e.g. of two releases) can be
+compared with the `compare` command. The `queue` command measures only
+the queue of each storage backend, in-process and without browsers.
+
+    python benchmarks/run.py run --workers 2 --concurrency 4 --jobs 500
+    python benchmarks/run.py queue --workers 8 --jobs 10000
+    python benchmarks/run.py compare before.json after.json
+"""
+
+import asyncio
+import json
+import logging
+import os
+import platform
+import shutil
+import signal
+import socket
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from contextlib import asynccontextmanager
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import AsyncIterator, Dict, List, Optional
+
+import click
+import httpx
+
+from browsy import AsyncBrowsyClient, JobStatus, __version__
+from browsy._backend import Backend, NewJob
+from browsy._memory import MemoryBackend
+from browsy._sqlite import SQLiteBackend
+
+_BENCHMARKS_DIR = Path(__file__).parent
+_JOBS_DIRS = (
+    _BENCHMARKS_DIR / "jobs",
+    _BENCHMARKS_DIR.parent / "quickstart" / "jobs",
+)
+
+_SCENARIOS = ("noop", "screenshot", "pdf")
+_BACKENDS = ("sqlite", "memory")
+
+_STARTUP_TIMEOUT = 60
+_JOB_TIMEOUT = 600
+# Long-polling requests waiting for jobs at once
+_MAX_WAITING = 100
+_LOCK_PROBE_INTERVAL = 0.05
+
+_FIXTURE_PAGE = b"""<!DOCTYPE html>
+<html>
+<head><title>browsy benchmark</title></head>
+<body>
+<h1>browsy benchmark</h1>
+%s
+</body>
+</html>
+""" % (
+    b"<p>Lorem ipsum dolor sit amet, consectetur adipiscing elit.</p>" * 200
+)
+
+
+@click.group()
+def cli():
+    pass
+
+
+@cli.command()
+@click.option(
+    "--workers", default=1, show_default=True, type=click.IntRange(min=1)
+)
+@click.option(
+    "--concurrency",
+    default=1,
+    show_default=True,
+    type=click.IntRange(min=1),
+    help="Concurrency of every worker",
+)
+@click.option(
+    "--jobs",
+    "jobs_count",
+    default=200,
+    show_default=True,
+    type=click.IntRange(min=1),
+    help="Jobs submitted in every scenario",
+)
+@click.option(
+    "--clients",
+    default=32,
+    show_default=True,
+    type=click.IntRange(min=1),
+    help="Jobs submitted at once",
+)
+@click.option(
+    "--scenario",
+    "scenarios",
+    multiple=True,
+    type=click.Choice(_SCENARIOS),
+    help="Scenarios to run  [default: all]",
+)
+@click.option(
+    "--output",
+    default=None,
+    type=click.Path(dir_okay=False),
+    help="Results file  [default: benchmark-<time>.json]",
+)
+def run(
+    workers: int,
+    concurrency: int,
+    jobs_count: int,
+    clients: int,
+    scenarios: List[str],
+    output: Optional[str],
+):
+    """Run the benchmarks and save their results."""
+    # Every request would be logged otherwise
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+
+    started_at = datetime.now(timezone.utc)
+    output = output or f"benchmark-{started_at:%Y%m%d-%H%M%S}.json"
+
+    results = {
+        "browsy_version": __version__,
+        "git_commit": _get_git_commit(),
+        "started_at": started_at.isoformat(),
+        "python": platform.python_version(),
+        "sqlite": sqlite3.sqlite_version,
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "parameters": {
+            "workers": workers,
+            "concurrency": concurrency,
+            "jobs": jobs_count,
+            "clients": clients,
+        },
+        "scenarios": {},
+    }
+
+    with _FixtureServer() as fixture:
+        for scenario in scenarios or _SCENARIOS:
+            click.echo(f"==> {scenario}")
+            parameters = {} if scenario == "noop" else {"url": fixture.url}
+            result = _run_scenario(
+                scenario, parameters, workers, concurrency, jobs_count, clients
+            )
+            results["scenarios"][scenario] = result
+            _print_result(result)
+
+    Path(output).write_text(json.dumps(results, indent=2))
+    click.echo(f"Results saved to {output}")
+
+
+@cli.command()
+@click.option(
+    "--workers",
+    default=4,
+    show_default=True,
+    type=click.IntRange(min=1),
+    help="Workers claiming jobs at once",
+)
+@click.option(
+    "--batch",
+    default=1,
+    show_default=True,
+    type=click.IntRange(min=1),
+    help="Jobs claimed at once by every worker",
+)
+@click.option(
+    "--jobs",
+    "jobs_count",
+    default=5000,
+    show_default=True,
+    type=click.IntRange(min=1),
+)
+@click.option(
+    "--backend",
+    "backends",
+    multiple=True,
+    type=click.Choice(_BACKENDS),
+    help="Backends to measure  [default: all]",
+)
+@click.option(
+    "--output",
+    default=None,
+    type=click.Path(dir_okay=False),
+    help="Results file  [default: benchmark-queue-<time>.json]",
+)
+def queue(
+    workers: int,
+    batch: int,
+    jobs_count: int,
+    backends: List[str],
+    output: Optional[str],
+):
+    """Measure the queue of each backend, without a server or browsers."""
+    started_at = datetime.now(timezone.utc)
+    output = output or f"benchmark-queue-{started_at:%Y%m%d-%H%M%S}.json"
+
+    results = {
+        "browsy_version": __version__,
+        "git_commit": _get_git_commit(),
+        "started_at": started_at.isoformat(),
+        "python": platform.python_version(),
+        "sqlite": sqlite3.sqlite_version,
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "parameters": {
+            "workers": workers,
+            "batch": batch,
+            "jobs": jobs_count,
+        },
+        "scenarios": {},
+    }
+
+    for backend_name in backends or _BACKENDS:
+        click.echo(f"==> queue-{backend_name}")
+        result = asyncio.run(
+            _drive_queue(backend_name, workers, batch, jobs_count)
+        )
+        results["scenarios"][f"queue-{backend_name}"] = result
+        click.echo(
+            f"  submitted {result['submit_throughput']:.1f} jobs/s,"
+            f" processed {result['processing_throughput']:.1f} jobs/s"
+        )
+        for key in ("submit_ms", "claim_ms", "complete_ms"):
+            summary = result[key]
+            click.echo(
+                f"  {key:<16} p50 {summary['p50']:.2f}"
+                f"  p95 {summary['p95']:.2f}  p99 {summary['p99']:.2f}"
+            )
+
+    Path(output).write_text(json.dumps(results, indent=2))
+    click.echo(f"Results saved to {output}")
+
+
+@cli.command()
+@click.argument("baseline", type=click.Path(exists=True, dir_okay=False))
+@click.argument("current", type=click.Path(exists=True, dir_okay=False))
+def compare(baseline: str, current: str):
+    """Compare results of two runs."""
+    before = json.loads(Path(baseline).read_text())
+    after = json.loads(Path(current).read_text())
+
+    for scenario, result in after["scenarios"].items():
+        if scenario not in before["scenarios"]:
+            continue
+        click.echo(f"==> {scenario}")
+        old = _flatten(before["scenarios"][scenario])
+        for key, value in _flatten(result).items():
+            if key.endswith(".count") or key not in old or not old[key]:
+                continue
+            change = (value - old[key]) / old[key] * 100
+            click.echo(
+                f"  {key:<32} {old[key]:>12.2f} {value:>12.2f} {change:>+8.1f}%"
+            )
+
+
+def _run_scenario(
+    scenario: str,
+    parameters: dict,
+    workers: int,
+    concurrency: int,
+    jobs_count: int,
+    clients: int,
+) -> dict:
+    with tempfile.TemporaryDirectory(prefix="browsy-bench-") as tmp:
+        tmp_path = Path(tmp)
+        db_path = tmp_path / "browsy.db"
+        jobs_path = tmp_path / "jobs"
+        jobs_path.mkdir()
+        for jobs_dir in _JOBS_DIRS:
+            for file in jobs_dir.glob("*.py"):
+                shutil.copy(file, jobs_path)
+
+        env = {
+            **os.environ,
+            "BROWSY_DB_PATH": str(db_path),
+            "BROWSY_JOBS_PATH": str(jobs_path),
+        }
+        port = _get_free_port()
+        base_url = f"http://127.0.0.1:{port}"
+        logs_path = tmp_path / "logs"
+        logs_path.mkdir()
+
+        processes = [
+            _start(
+                ["server", "--host", "127.0.0.1", "--port", str(port)],
+                env,
+                logs_path / "server.log",
+            )
+        ]
+        try:
+            asyncio.run(_wait_for_server(base_url, processes[0]))
+            for i in range(workers):
+                processes.append(
+                    _start(
+                        [
+                            "worker",
+                            "--name",
+                            f"bench-{i}",
+                            "--concurrency",
+                            str(concurrency),
+                        ],
+                        env,
+                        logs_path / f"worker-{i}.log",
+                    )
+                )
+
+            probe = _LockProbe(db_path)
+            result = asyncio.run(
+                _drive_load(
+                    base_url,
+                    scenario,
+                    parameters,
+                    warmup=workers * concurrency,
+                    jobs_count=jobs_count,
+                    clients=clients,
+                    probe=probe,
+                )
+            )
+        finally:
+            for process in processes:
+                _stop(process)
+
+        locked_errors = sum(
+            log.read_text(errors="replace").count("database is locked")
+            for log in logs_path.iterdir()
+        )
+        result["sqlite"]["locked_errors"] = locked_errors
+        return result
+
+
+async def _drive_load(
+    base_url: str,
+    scenario: str,
+    parameters: dict,
+    warmup: int,
+    jobs_count: int,
+    clients: int,
+    probe: "_LockProbe",
+) -> dict:
+    limits = httpx.Limits(max_connections=clients + _MAX_WAITING)
+    async with httpx.AsyncClient(limits=limits, timeout=60) as http_client:
+        client = AsyncBrowsyClient(base_url=base_url, http_client=http_client)
+
+        # Browsers are launched and contexts created before measuring
+        warmup_jobs = await asyncio.gather(
+            *(client.create_job(scenario, parameters) for _ in range(warmup))
+        )
+        await _wait_for_jobs(client, [j.id for j in warmup_jobs])
+
+        probe.start()
+        try:
+            submitting = asyncio.Semaphore(clients)
+
+            async def submit():
+                async with submitting:
+                    return await client.create_job(scenario, parameters)
+
+            start = time.perf_counter()
+            jobs = await asyncio.gather(*(submit() for _ in range(jobs_count)))
+            submit_time = time.perf_counter() - start
+
+            await _wait_for_jobs(client, [j.id for j in jobs])
+            total_time = time.perf_counter() - start
+        finally:
+            probe.stop()
+
+        finished = await asyncio.gather(*(client.get_job(j.id) for j in jobs))
+
+    done = [j for j in finished if j.status == JobStatus.DONE]
+    end_to_end = [
+        (j.updated_at - j.created_at).total_seconds() * 1000 for j in done
+    ]
+    queue_wait = [e2e - j.processing_time for e2e, j in zip(end_to_end, done)]
+    timings: Dict[str, List[float]] = {}
+    for job in done:
+        for phase, ms in (job.timings or {}).items():
+            timings.setdefault(phase, []).append(ms)
+
+    return {
+        "jobs": jobs_count,
+        "done": len(done),
+        "failed": len(finished) - len(done),
+        "submit_throughput": jobs_count / submit_time,  # jobs per second
+        "processing_throughput": len(done) / total_time,  # jobs per second
+        "end_to_end_ms": _summarize(end_to_end),
+        "queue_wait_ms": _summarize(queue_wait),
+        "claim_ms": _summarize(timings.get("claim", [])),
+        "phases_ms": {
+            phase: _summarize(values)
+            for phase, values in sorted(timings.items())
+        },
+        "sqlite": {"write_lock_wait_ms": probe.summary()},
+    }
+
+
+async def _drive_queue(
+    backend_name: str, workers: int, batch: int, jobs_count: int
+) -> dict:
+    submit_ms: List[float] = []
+    claim_ms: List[float] = []
+    complete_ms: List[float] = []
+
+    async def work(backend: Backend, name: str):
+        while True:
+            start = time.perf_counter()
+            jobs = await backend.claim_jobs(name, batch)
+            if not jobs:
+                return
+            claim_ms.append((time.perf_counter() - start) * 1000)
+            for job in jobs:
+                start = time.perf_counter()
+                await backend.complete_job(
+                    name,
+                    job.id,
+                    JobStatus.DONE,
+                    processing_time=0,
+                    output=b"{}",
+                )
+                complete_ms.append((time.perf_counter() - start) * 1000)
+
+    async with _open_backend(backend_name, workers) as backend:
+        start = time.perf_counter()
+        for _ in range(jobs_count):
+            job_start = time.perf_counter()
+            await backend.create_job(NewJob("noop", "{}"))
+            submit_ms.append((time.perf_counter() - job_start) * 1000)
+        submit_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        await asyncio.gather(
+            *(work(backend, f"bench-{i}") for i in range(workers))
+        )
+        processing_time = time.perf_counter() - start
+
+    return {
+        "jobs": jobs_count,
+        "submit_throughput": jobs_count / submit_time,  # jobs per second
+        "processing_throughput": jobs_count / processing_time,
+        "submit_ms": _summarize(submit_ms),
+        "claim_ms": _summarize(claim_ms),
+        "complete_ms": _summarize(complete_ms),
+    }
+
+
+@asynccontextmanager
+async def _open_backend(name: str, workers: int) -> AsyncIterator[Backend]:
+    if name == "memory":
+        async with MemoryBackend() as backend:
+            yield backend
+        return
+
+    with tempfile.TemporaryDirectory(prefix="browsy-bench-") as tmp:
+        backend = SQLiteBackend(
+            str(Path(tmp) / "browsy.db"), pool_size=workers + 1
+        )
+        await backend.init()
+        async with backend:
+            yield backend
+
+
+async def _wait_for_jobs(
+    client: AsyncBrowsyClient, job_ids: List[int]
+) -> None:
+    waiting = asyncio.Semaphore(_MAX_WAITING)
+
+    async def wait(job_id: int):
+        async with waiting:
+            job = await client.wait_for_job(job_id, timeout=_JOB_TIMEOUT)
+        if not job or not job.status.is_finished:
+            raise RuntimeError(f"Job {job_id} wasn't finished in time")
+
+    await asyncio.gather(*(wait(job_id) for job_id in job_ids))
+
+
+async def _wait_for_server(base_url: str, process: subprocess.Popen) -> None:
+    deadline = time.monotonic() + _STARTUP_TIMEOUT
+    async with httpx.AsyncClient() as client:
+        while time.monotonic() < deadline:
+            if process.poll() is not None:
+                raise RuntimeError("Server exited, see its log for details")
+            try:
+                response = await client.get(f"{base_url}/health")
+                if response.status_code == 200:
+                    return
+            except httpx.TransportError:
+                pass
+            await asyncio.sleep(0.2)
+    raise RuntimeError("Server didn't start in time")
+
+
+class _LockProbe:
+    """Measures how long it takes to get the database's write lock.
+
+    The probe takes the lock periodically, for as short as possible, so
+    the wait time tells how contended the lock is.
+    """
+
+    def __init__(self, db_path: Path) -> None:
+        self._db_path = db_path
+        self._waits: List[float] = []
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stopped.set()
+        self._thread.join()
+
+    def summary(self) -> dict:
+        return _summarize(self._waits)
+
+    def _run(self) -> None:
+        conn = sqlite3.connect(self._db_path, timeout=60, isolation_level=None)
+        try:
+            while not self._stopped.wait(_LOCK_PROBE_INTERVAL):
+                start = time.perf_counter()
+                conn.execute("BEGIN IMMEDIATE")
+                self._waits.append((time.perf_counter() - start) * 1000)
+                conn.execute("ROLLBACK")
+        finally:
+            conn.close()
+
+
+class _FixtureServer:
+    """Serves a static page for the browser jobs, in a background thread."""
+
+    def __init__(self) -> None:
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), _FixtureHandler)
+        self.url = f"http://127.0.0.1:{self._server.server_port}/"
+        self._thread = threading.Thread(
+            target=self._server.serve_forever, daemon=True
+        )
+
+    def __enter__(self) -> "_FixtureServer":
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+
+class _FixtureHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html")
+        self.send_header("Content-Length", str(len(_FIXTURE_PAGE)))
+        self.end_headers()
+        self.wfile.write(_FIXTURE_PAGE)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def _start(args: List[str], env: dict, log_path: Path) -> subprocess.Popen:
+    with open(log_path, "wb") as log:
+        return subprocess.Popen(
+            [sys.executable, "-m", "browsy", *args],
+            env=env,
+            stdout=log,
+            stderr=subprocess.STDOUT,
+        )
+
+
+def _stop(process: subprocess.Popen) -> None:
+    if process.poll() is None:
+        process.send_signal(signal.SIGINT)
+    try:
+        process.wait(timeout=30)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+
+
+def _get_free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _get_git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            cwd=_BENCHMARKS_DIR,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _summarize(values: List[float]) -> dict:
+    if not values:
+        return {}
+    values = sorted(values)
+    return {
+        "count": len(values),
+        "mean": sum(values) / len(values),
+        "p50": _percentile(values, 50),
+        "p95": _percentile(values, 95),
+        "p99": _percentile(values, 99),
+        "max": values[-1],
+    }
+
+
+def _percentile(sorted_values: List[float], p: float) -> float:
+    # Nearest-rank method
+    rank = max(round(p / 100 * len(sorted_values) + 0.5) - 1, 0)
+    return sorted_values[min(rank, len(sorted_values) - 1)]
+
+
+def _flatten(result: dict, prefix: str = "") -> Dict[str, float]:
+    flat = {}
+    for key, value in result.items():
+        if isinstance(value, dict):
+            flat.update(_flatten(value, f"{prefix}{key}."))
+        elif isinstance(value, (int, float)):
+            flat[f"{prefix}{key}"] = value
+    return flat
+
+
+def _print_result(result: dict) -> None:
+    click.echo(
+        f"  done {result['done']}/{result['jobs']},"
+        f" submitted {result['submit_throughput']:.1f} jobs/s,"
+        f" processed {result['processing_throughput']:.1f} jobs/s"
+    )
+    for key in ("end_to_end_ms", "queue_wait_ms", "claim_ms"):
+        summary = result[key]
+        if summary:
+            click.echo(
+                f"  {key:<16} p50 {summary['p50']:.1f}"
+                f"  p95 {summary['p95']:.1f}  p99 {summary['p99']:.1f}"
+            )
+    lock_wait = result["sqlite"]["write_lock_wait_ms"]
+    if lock_wait:
+        click.echo(
+            f"  write lock wait  p50 {lock_wait['p50']:.1f}"
+            f"  p99 {lock_wait['p99']:.1f}  max {lock_wait['max']:.1f}"
+        )
+
+
+if __name__ == "__main__":
+    cli()
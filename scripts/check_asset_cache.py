@@ -0,0 +1,405 @@
+"""Behavior checks of the worker's asset cache.
+
+Requests are routed through the cache the way Playwright routes them, and
+fetched from a local HTTP server, so no browser is needed.
+
+    python scripts/check_asset_cache.py
+    python scripts/check_asset_cache.py --check evict
+"""
+
+import argparse
+import asyncio
+import sqlite3
+import sys
+import tempfile
+import threading
+import traceback
+import urllib.error
+import urllib.request
+from contextlib import asynccontextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import (
+    AsyncIterator,
+    Awaitable,
+    Callable,
+    Dict,
+    List,
+    Optional,
+    Tuple,
+)
+
+from browsy import _assets
+from browsy._assets import AssetCache, AssetCacheSettings
+
+_ETAG = '"v1"'
+_SHARED_BODY = b"s" * 900
+
+
+def _get_resource(path: str) -> Tuple[Dict[str, str], bytes]:
+    """Returns headers and body the fixture server responds with."""
+    name = path.rsplit("/", 1)[-1]
+    if name.startswith("fresh"):
+        return {"Cache-Control": "max-age=3600"}, b"fresh " + path.encode()
+    if name.startswith("no-store"):
+        return {"Cache-Control": "no-store, max-age=3600"}, b"no-store"
+    if name.startswith("etag"):
+        return {"Cache-Control": "no-cache", "ETag": _ETAG}, b"etag"
+    if name.startswith("shared"):
+        return {"Cache-Control": "max-age=3600"}, _SHARED_BODY
+    # Numbered assets of 900 bytes each, e.g. /asset-07.css
+    return {"Cache-Control": "max-age=3600"}, path.encode().ljust(900, b".")
+
+
+class _Origin:
+    """Local HTTP server that counts requests by path."""
+
+    def __init__(self) -> None:
+        self.requests: Dict[str, int] = {}
+        self.conditional: Dict[str, Optional[str]] = {}
+        origin = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args) -> None:
+                pass
+
+            def do_GET(self) -> None:
+                origin.requests[self.path] = (
+                    origin.requests.get(self.path, 0) + 1
+                )
+                if_none_match = self.headers.get("If-None-Match")
+                origin.conditional[self.path] = if_none_match
+                headers, body = _get_resource(self.path)
+                if if_none_match and if_none_match == headers.get("ETag"):
+                    self.send_response(304)
+                    body = b""
+                else:
+                    self.send_response(200)
+                    headers["Content-Type"] = "text/css"
+                headers["Content-Length"] = str(len(body))
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(body)
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.base_url = f"http://127.0.0.1:{self._server.server_port}"
+
+    def __enter__(self) -> "_Origin":
+        threading.Thread(
+            target=self._server.serve_forever, daemon=True
+        ).start()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+
+class _Request:
+    def __init__(self, url: str) -> None:
+        self.url = url
+        self.method = "GET"
+        self.resource_type = "stylesheet"
+        self.headers: Dict[str, str] = {}
+
+
+class _Response:
+    def __init__(self, status: int, headers: Dict[str, str], body: bytes):
+        self.status = status
+        self.headers = {name.lower(): value for name, value in headers}
+        self._body = body
+
+    async def body(self) -> bytes:
+        return self._body
+
+
+class _Route:
+    """Stands in for Playwright's `Route`, records how it was handled."""
+
+    def __init__(self, url: str) -> None:
+        self.request = _Request(url)
+        self.served_from: Optional[str] = None
+        self.status: Optional[int] = None
+        self.body: Optional[bytes] = None
+
+    async def fallback(self) -> None:
+        self.served_from = "browser"
+
+    async def fetch(self, headers: Optional[Dict[str, str]] = None):
+        request = urllib.request.Request(
+            self.request.url, headers=headers or {}
+        )
+
+        def send() -> _Response:
+            try:
+                with urllib.request.urlopen(request) as response:
+                    return _Response(
+                        response.status,
+                        response.headers.items(),
+                        response.read(),
+                    )
+            except urllib.error.HTTPError as e:
+                return _Response(e.code, e.headers.items(), b"")
+
+        return await asyncio.to_thread(send)
+
+    async def fulfill(
+        self, status=None, headers=None, body=None, response=None
+    ):
+        if response is not None:
+            self.served_from = "network"
+            self.status = response.status
+            self.body = await response.body()
+        else:
+            self.served_from = "cache"
+            self.status = status
+            self.body = body
+
+
+class _Fixture:
+    def __init__(self, origin: _Origin, cache_dir: Path) -> None:
+        self.origin = origin
+        self.cache_dir = cache_dir
+
+    @asynccontextmanager
+    async def cache(self, max_size: int = 2**20) -> AsyncIterator[AssetCache]:
+        """Opens a cache in the fixture's directory, shared like workers do."""
+        cache = AssetCache(
+            AssetCacheSettings(path=str(self.cache_dir), max_size=max_size)
+        )
+        await cache.open()
+        try:
+            yield cache
+        finally:
+            await cache.close()
+
+    async def get(self, cache: AssetCache, path: str) -> _Route:
+        route = _Route(self.origin.base_url + path)
+        await cache._handle(route)
+        return route
+
+    def index(self) -> Dict[str, Tuple[str, int]]:
+        """Returns stored paths and sizes of assets, by URL path."""
+        with sqlite3.connect(self.cache_dir / "index.db") as conn:
+            rows = conn.execute("SELECT url, path, size FROM assets")
+            return {
+                url[len(self.origin.base_url) :]: (path, size)
+                for url, path, size in rows
+            }
+
+    def file_exists(self, path: str) -> bool:
+        return (self.cache_dir / "files" / path).is_file()
+
+
+Check = Callable[[_Fixture], Awaitable[None]]
+
+_CHECKS: List[Check] = []
+
+
+def check(fn: Check) -> Check:
+    _CHECKS.append(fn)
+    return fn
+
+
+@check
+async def fresh_hit(fixture: _Fixture):
+    async with fixture.cache() as cache:
+        first = await fixture.get(cache, "/fresh.css")
+        assert first.served_from == "network", first.served_from
+        second = await fixture.get(cache, "/fresh.css")
+        assert second.served_from == "cache", second.served_from
+        assert (second.status, second.body) == (200, first.body)
+        assert cache.hits == 1 and cache.misses == 1
+
+    # Another worker on the host shares the stored asset
+    async with fixture.cache() as other:
+        route = await fixture.get(other, "/fresh.css")
+        assert route.served_from == "cache", route.served_from
+    assert fixture.origin.requests["/fresh.css"] == 1
+
+
+@check
+async def revalidation(fixture: _Fixture):
+    async with fixture.cache() as cache:
+        first = await fixture.get(cache, "/etag.css")
+        assert first.served_from == "network", first.served_from
+        assert fixture.origin.conditional["/etag.css"] is None
+
+        # Stale right away, so the origin is asked whether it changed
+        second = await fixture.get(cache, "/etag.css")
+        assert fixture.origin.conditional["/etag.css"] == _ETAG
+        assert second.served_from == "cache", second.served_from
+        assert (second.status, second.body) == (200, b"etag")
+        assert cache.revalidations == 1
+    assert fixture.origin.requests["/etag.css"] == 2
+
+
+@check
+async def no_store_bypass(fixture: _Fixture):
+    async with fixture.cache() as cache:
+        for _ in range(2):
+            route = await fixture.get(cache, "/no-store.css")
+            assert route.served_from == "network", route.served_from
+            assert route.body == b"no-store"
+        assert cache.hits == 0
+    assert fixture.origin.requests["/no-store.css"] == 2
+    assert fixture.index() == {}
+
+
+@check
+async def evict_least_recently_used(fixture: _Fixture):
+    max_size = 10_000
+    async with fixture.cache(max_size) as cache:
+        for i in range(10):
+            await fixture.get(cache, f"/asset-{i:02d}.css")
+        # Used again, so it's no longer the least recently used one
+        await fixture.get(cache, "/asset-00.css")
+        evicted_paths = [
+            fixture.index()[f"/asset-{i:02d}.css"][0] for i in (1, 2)
+        ]
+        # Over the maximum, down to the target
+        for i in range(10, 12):
+            await fixture.get(cache, f"/asset-{i:02d}.css")
+
+    index = fixture.index()
+    assert sorted(index) == [
+        f"/asset-{i:02d}.css" for i in (0, *range(3, 12))
+    ], sorted(index)
+    assert sum(size for _, size in index.values()) <= (
+        max_size * _assets._EVICTION_TARGET
+    )
+    assert all(fixture.file_exists(path) for path, _ in index.values())
+    assert not any(fixture.file_exists(path) for path in evicted_paths)
+
+
+@check
+async def throttled_touch(fixture: _Fixture):
+    def last_used() -> float:
+        with sqlite3.connect(fixture.cache_dir / "index.db") as conn:
+            row = conn.execute("SELECT last_used FROM assets").fetchone()
+            return row[0]
+
+    interval = _assets._TOUCH_INTERVAL
+    _assets._TOUCH_INTERVAL = 60
+    try:
+        async with fixture.cache() as cache:
+            await fixture.get(cache, "/fresh.css")
+            stored = last_used()
+            route = await fixture.get(cache, "/fresh.css")
+            assert route.served_from == "cache", route.served_from
+            # Used again within the interval, so the index isn't written
+            assert last_used() == stored
+
+            _assets._TOUCH_INTERVAL = 0
+            await fixture.get(cache, "/fresh.css")
+            assert last_used() > stored
+    finally:
+        _assets._TOUCH_INTERVAL = interval
+
+
+@check
+async def shared_file(fixture: _Fixture):
+    async with fixture.cache(10_000) as cache:
+        await fixture.get(cache, "/shared-a.css")
+        await fixture.get(cache, "/shared-b.css")
+        index = fixture.index()
+        path = index["/shared-a.css"][0]
+        assert index["/shared-b.css"][0] == path
+        assert len(list((fixture.cache_dir / "files").glob("*/*/*"))) == 1
+
+        # Evicts shared-a, while shared-b (used since) still needs the file
+        for i in range(10):
+            if i == 5:
+                await fixture.get(cache, "/shared-b.css")
+            await fixture.get(cache, f"/asset-{i:02d}.css")
+        index = fixture.index()
+        assert "/shared-a.css" not in index and "/shared-b.css" in index
+        assert fixture.file_exists(path)
+
+        route = await fixture.get(cache, "/shared-b.css")
+        assert route.served_from == "cache", route.served_from
+        assert route.body == _SHARED_BODY
+
+
+@check
+async def concurrent_writes(fixture: _Fixture):
+    max_size = 10_000
+    async with fixture.cache(max_size) as cache:
+        # Hits and stores run while evictions are in progress
+        await asyncio.gather(
+            *(
+                fixture.get(cache, f"/asset-{i % 30:02d}.css")
+                for i in range(120)
+            )
+        )
+
+    index = fixture.index()
+    assert sum(size for _, size in index.values()) <= max_size
+    assert all(fixture.file_exists(path) for path, _ in index.values())
+
+
+@check
+async def write_during_failed_eviction(fixture: _Fixture):
+    async with fixture.cache(10_000) as cache:
+        for i in range(11):
+            await fixture.get(cache, f"/asset-{i:02d}.css")
+
+        executemany = cache._conn.executemany
+        stores = []
+
+        async def fail_once(*args):
+            cache._conn.executemany = executemany
+            # Another page stores an asset while the eviction is in progress
+            stores.append(
+                asyncio.ensure_future(fixture.get(cache, "/fresh.css"))
+            )
+            await asyncio.sleep(0.2)
+            raise sqlite3.OperationalError("disk I/O error")
+
+        cache._conn.executemany = fail_once
+        # Over the maximum, so it's evicting. The failure is only logged.
+        route = await fixture.get(cache, "/asset-11.css")
+        assert route.served_from == "network", route.served_from
+        await stores[0]
+
+    # The store isn't rolled back along with the failed eviction
+    assert "/fresh.css" in fixture.index()
+
+
+async def _run(checks: List[Check]) -> int:
+    # Evicted files are deleted right away, instead of after a grace period
+    # for other processes
+    _assets._UNREFERENCED_FILE_MIN_AGE = 0
+    # Every hit changes the eviction order, so checks can rely on it
+    _assets._TOUCH_INTERVAL = 0
+    failed = 0
+    for fn in checks:
+        try:
+            with _Origin() as origin, tempfile.TemporaryDirectory() as tmp:
+                await fn(_Fixture(origin, Path(tmp)))
+        except Exception:
+            failed += 1
+            print(f"FAIL {fn.__name__}")
+            traceback.print_exc()
+        else:
+            print(f"ok   {fn.__name__}")
+    return failed
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument(
+        "--check", help="Run only checks with this in their name"
+    )
+    args = parser.parse_args()
+
+    checks = [c for c in _CHECKS if not args.check or args.check in c.__name__]
+
+    failed = asyncio.run(_run(checks))
+    print(f"{len(checks) - failed} passed, {failed} failed")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,544 @@
+"""Conformance checks of storage backends.
+
+Every check runs against a fresh instance of every backend, so that all of
+them behave the same way towards the server and workers. A new backend only
+has to be added to `_BACKENDS`.
+
+    python scripts/check_backends.py
+    python scripts/check_backends.py --backend memory --check claim
+"""
+
+import argparse
+import asyncio
+import sys
+import tempfile
+import traceback
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import AsyncIterator, Awaitable, Callable, Dict, List
+
+from browsy import JobStatus
+from browsy._backend import Backend, NewJob
+from browsy._memory import MemoryBackend
+from browsy._sqlite import SQLiteBackend
+from browsy._storage import StoredOutput
+
+Check = Callable[[Backend], Awaitable[None]]
+
+_CHECKS: List[Check] = []
+
+
+def check(fn: Check) -> Check:
+    _CHECKS.append(fn)
+    return fn
+
+
+@asynccontextmanager
+async def _sqlite_backend() -> AsyncIterator[Backend]:
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        backend = SQLiteBackend(
+            str(Path(tmp_dir) / "browsy.db"), pool_size=2, read_pool_size=2
+        )
+        await backend.init()
+        async with backend:
+            yield backend
+
+
+@asynccontextmanager
+async def _memory_backend() -> AsyncIterator[Backend]:
+    async with MemoryBackend() as backend:
+        yield backend
+
+
+_BACKENDS = {
+    "sqlite": _sqlite_backend,
+    "memory": _memory_backend,
+}
+
+
+def _job(name: str = "test", **kwargs) -> NewJob:
+    return NewJob(name, '{"url": "https://example.com"}', **kwargs)
+
+
+async def _claim_one(backend: Backend, worker: str = "w1", **kwargs):
+    jobs = await backend.claim_jobs(worker, 1, **kwargs)
+    assert len(jobs) == 1, jobs
+    return jobs[0]
+
+
+@check
+async def create_and_get(backend: Backend):
+    job = await backend.create_job(_job(timeout=2.5, priority=3))
+    assert job.status == JobStatus.PENDING
+    assert job.input == {"url": "https://example.com"}
+    assert (job.timeout, job.priority, job.attempts) == (2.5, 3, 0)
+    assert job.updated_at is None and job.worker is None
+
+    assert await backend.get_job(job.id) == job
+    assert await backend.get_job(job.id + 1000) is None
+    assert await backend.get_jobs_by_ids([job.id, job.id + 1000]) == [job]
+
+
+@check
+async def create_many_in_order(backend: Backend):
+    jobs = await backend.create_jobs([_job(name=f"j{i}") for i in range(5)])
+    assert [j.name for j in jobs] == [f"j{i}" for i in range(5)]
+    assert len({j.id for j in jobs}) == 5
+    assert await backend.create_jobs([]) == []
+
+
+@check
+async def returned_jobs_are_copies(backend: Backend):
+    job = await backend.create_job(_job())
+    job.status = JobStatus.DONE
+    job.input["url"] = "changed"
+    stored = await backend.get_job(job.id)
+    assert stored.status == JobStatus.PENDING
+    assert stored.input["url"] == "https://example.com"
+
+
+@check
+async def claim_by_priority_then_age(backend: Backend):
+    low = await backend.create_job(_job(priority=-1))
+    first = await backend.create_job(_job())
+    high = await backend.create_job(_job(priority=5))
+    second = await backend.create_job(_job())
+
+    claimed = await backend.claim_jobs("w1", 3)
+    assert [j.id for j in claimed] == [high.id, first.id, second.id]
+    for job in claimed:
+        assert job.status == JobStatus.IN_PROGRESS
+        assert job.worker == "w1" and job.attempts == 1
+        assert job.updated_at is not None
+
+    assert [j.id for j in await backend.claim_jobs("w2", 3)] == [low.id]
+    assert await backend.claim_jobs("w2", 3) == []
+    assert not await backend.has_pending_jobs()
+
+
+@check
+async def claim_by_name(backend: Backend):
+    await backend.create_job(_job(name="a"))
+    b = await backend.create_job(_job(name="b", priority=1))
+    c = await backend.create_job(_job(name="c"))
+
+    assert await backend.has_pending_jobs(["a"])
+    assert not await backend.has_pending_jobs(["missing"])
+
+    claimed = await backend.claim_jobs("w1", 5, names=["b", "c"])
+    assert [j.id for j in claimed] == [b.id, c.id]
+    assert not await backend.has_pending_jobs(["b", "c"])
+    assert await backend.has_pending_jobs()
+
+
+@check
+async def queue_stats(backend: Backend):
+    assert await backend.get_queue_stats() == (0, None)
+
+    await backend.create_job(_job(name="a"))
+    await asyncio.sleep(0.05)
+    await backend.create_jobs([_job(name="b"), _job(name="b")])
+    await _claim_one(backend, names=["b"])
+
+    pending, oldest_age = await backend.get_queue_stats()
+    assert pending == 2 and 0.05 <= oldest_age < 5, oldest_age
+    pending, oldest_age = await backend.get_queue_stats(["b", "missing"])
+    assert pending == 1 and oldest_age < 0.05, oldest_age
+    assert await backend.get_queue_stats(["missing"]) == (0, None)
+
+
+@check
+async def complete_with_content(backend: Backend):
+    await backend.check_in_worker("w1")
+    job = await backend.create_job(_job())
+    await _claim_one(backend)
+
+    content = bytes(range(256)) * 10
+    assert await backend.complete_job(
+        "w1",
+        job.id,
+        JobStatus.DONE,
+        processing_time=1200,
+        output=content,
+        timings={"execute": 1000.5},
+        output_size=4096,
+    )
+
+    done = await backend.get_job(job.id)
+    assert done.status == JobStatus.DONE
+    assert done.processing_time == 1200
+    assert done.timings == {"execute": 1000.5}
+    assert done.output_size == 4096
+
+    info = await backend.get_job_output_info(job.id)
+    assert info.job_id == job.id and info.size == len(content)
+    assert info.path is None and info.encoding is None
+    assert await backend.read_output_chunk(info.id, 0, 100) == content[:100]
+    assert (
+        await backend.read_output_chunk(info.id, 2500, 500) == content[2500:]
+    )
+
+    # Finished jobs can't be finished again
+    assert not await backend.complete_job(
+        "w1", job.id, JobStatus.FAILED, processing_time=1, output=None
+    )
+    assert (await backend.get_job(job.id)).status == JobStatus.DONE
+
+
+@check
+async def complete_with_stored_output(backend: Backend):
+    job = await backend.create_job(_job())
+    await _claim_one(backend)
+    output = StoredOutput(path="ab/cd/abcd", hash="abcd", size=10)
+    assert await backend.complete_job(
+        "w1",
+        job.id,
+        JobStatus.DONE,
+        processing_time=5,
+        output=output,
+        output_encoding="gzip",
+    )
+
+    info = await backend.get_job_output_info(job.id)
+    assert (info.path, info.hash, info.size) == ("ab/cd/abcd", "abcd", 10)
+    assert info.encoding == "gzip"
+    assert await backend.is_output_path_used("ab/cd/abcd")
+    assert not await backend.is_output_path_used("other")
+
+
+@check
+async def complete_without_output(backend: Backend):
+    job = await backend.create_job(_job())
+    await _claim_one(backend)
+    assert await backend.complete_job(
+        "w1", job.id, JobStatus.FAILED, processing_time=5, output=None
+    )
+    assert (await backend.get_job(job.id)).status == JobStatus.FAILED
+    assert await backend.get_job_output_info(job.id) is None
+
+
+@check
+async def complete_by_other_worker(backend: Backend):
+    job = await backend.create_job(_job())
+    await _claim_one(backend, "w1")
+    assert not await backend.complete_job(
+        "w2", job.id, JobStatus.DONE, processing_time=5, output=b"x"
+    )
+    assert (await backend.get_job(job.id)).status == JobStatus.IN_PROGRESS
+    assert await backend.get_job_output_info(job.id) is None
+
+
+@check
+async def cancel(backend: Backend):
+    in_progress = await backend.create_job(_job())
+    await _claim_one(backend)
+    pending = await backend.create_job(_job())
+
+    job, cancelled = await backend.cancel_job(pending.id)
+    assert cancelled and job.status == JobStatus.CANCELLED
+    assert await backend.claim_jobs("w1", 1) == []
+    assert not await backend.has_pending_jobs()
+
+    job, cancelled = await backend.cancel_job(in_progress.id)
+    assert cancelled and job.status == JobStatus.CANCELLED
+    assert not await backend.complete_job(
+        "w1", in_progress.id, JobStatus.DONE, processing_time=5, output=b"x"
+    )
+
+    # Finished jobs stay as they are, cancelled ones included
+    job, cancelled = await backend.cancel_job(pending.id)
+    assert not cancelled and job.status == JobStatus.CANCELLED
+    assert await backend.cancel_job(pending.id + 1000) == (None, False)
+
+
+@check
+async def requeue(backend: Backend):
+    job = await backend.create_job(_job())
+    await _claim_one(backend)
+    await backend.requeue_job(job.id)
+
+    requeued = await backend.get_job(job.id)
+    assert requeued.status == JobStatus.PENDING
+    assert requeued.worker is None and requeued.attempts == 0
+
+    claimed = await _claim_one(backend, "w2")
+    assert claimed.id == job.id and claimed.worker == "w2"
+
+
+@check
+async def expired_leases(backend: Backend):
+    job = await backend.create_job(_job())
+    await _claim_one(backend, lease_duration=0.05)
+    await asyncio.sleep(0.1)
+
+    assert await backend.requeue_expired_jobs(max_attempts=2) == (1, 0)
+    assert (await backend.get_job(job.id)).status == JobStatus.PENDING
+
+    await _claim_one(backend, lease_duration=0.05)
+    await asyncio.sleep(0.1)
+    assert await backend.requeue_expired_jobs(max_attempts=2) == (0, 1)
+    failed = await backend.get_job(job.id)
+    assert failed.status == JobStatus.FAILED and failed.attempts == 2
+
+
+@check
+async def heartbeat_extends_leases(backend: Backend):
+    await backend.check_in_worker("w1")
+    job = await backend.create_job(_job())
+    other = await backend.create_job(_job())
+    await backend.claim_jobs("w1", 2, lease_duration=0.05)
+
+    await backend.heartbeat(
+        "w1", [job.id], lease_duration=60, timings={job.id: {"late": 1.5}}
+    )
+    await asyncio.sleep(0.1)
+    assert await backend.requeue_expired_jobs(max_attempts=3) == (1, 0)
+    assert (await backend.get_job(job.id)).status == JobStatus.IN_PROGRESS
+    assert (await backend.get_job(other.id)).status == JobStatus.PENDING
+    assert (await backend.get_job(job.id)).timings == {"late": 1.5}
+
+
+@check
+async def late_timings_are_merged(backend: Backend):
+    job = await backend.create_job(_job())
+    await _claim_one(backend)
+    await backend.complete_job(
+        "w1",
+        job.id,
+        JobStatus.DONE,
+        processing_time=5,
+        output=b"x",
+        timings={"execute": 3.0},
+    )
+    await backend.add_job_timings({job.id: {"db_write": 1.0}})
+    await backend.add_job_timings({job.id: {"teardown": 2.0}})
+    assert (await backend.get_job(job.id)).timings == {
+        "execute": 3.0,
+        "db_write": 1.0,
+        "teardown": 2.0,
+    }
+
+
+@check
+async def cache(backend: Backend):
+    job = await backend.create_job(_job(cache_key="k"))
+    await _claim_one(backend)
+    await backend.complete_job(
+        "w1", job.id, JobStatus.DONE, processing_time=5, output=b"out"
+    )
+    # Not cached without a TTL
+    miss = await backend.create_job(_job(cache_key="k"))
+    assert miss.status == JobStatus.PENDING
+
+    await _claim_one(backend)
+    await backend.complete_job(
+        "w1",
+        miss.id,
+        JobStatus.DONE,
+        processing_time=5,
+        output=b"cached",
+        cache_ttl=1,
+    )
+    hits = await backend.create_jobs(
+        [_job(cache_key="k"), _job(cache_key="other")]
+    )
+    assert hits[0].status == JobStatus.DONE
+    assert hits[0].processing_time == 0
+    assert hits[1].status == JobStatus.PENDING
+    info = await backend.get_job_output_info(hits[0].id)
+    assert await backend.read_output_chunk(info.id, 0, 100) == b"cached"
+
+    assert await backend.evict_cache_entries() == 0
+    await asyncio.sleep(1.1)
+    assert await backend.evict_cache_entries() == 1
+    assert (
+        await backend.create_job(_job(cache_key="k"))
+    ).status == JobStatus.PENDING
+
+
+@check
+async def list_pages(backend: Backend):
+    jobs = []
+    for i in range(5):
+        jobs.extend(await backend.create_jobs([_job(name=f"j{i % 2}")]))
+    ids = [j.id for j in reversed(jobs)]
+
+    first = await backend.list_jobs(limit=2)
+    assert [j.id for j in first.jobs] == ids[:2]
+    assert first.total == 5 and first.prev_cursor is None
+
+    second = await backend.list_jobs(limit=2, cursor=first.next_cursor)
+    assert [j.id for j in second.jobs] == ids[2:4]
+    third = await backend.list_jobs(limit=2, cursor=second.next_cursor)
+    assert [j.id for j in third.jobs] == ids[4:]
+    assert third.next_cursor is None
+
+    back = await backend.list_jobs(limit=2, cursor=third.prev_cursor)
+    assert [j.id for j in back.jobs] == ids[2:4]
+    back = await backend.list_jobs(limit=2, cursor=back.prev_cursor)
+    assert [j.id for j in back.jobs] == ids[:2]
+    assert back.prev_cursor is None
+
+    by_name = await backend.list_jobs(name="j0")
+    assert [j.id for j in by_name.jobs] == [ids[0], ids[2], ids[4]]
+    assert by_name.total == 3
+
+    await _claim_one(backend)
+    in_progress = await backend.list_jobs(status=JobStatus.IN_PROGRESS)
+    assert [j.id for j in in_progress.jobs] == [ids[-1]]
+    assert in_progress.total == 1
+
+    for cursor in ("garbage", "YQ", "!!!"):
+        try:
+            await backend.list_jobs(cursor=cursor)
+        except ValueError:
+            pass
+        else:
+            raise AssertionError(f"Invalid cursor {cursor!r} was accepted")
+
+
+@check
+async def counts(backend: Backend):
+    await backend.create_jobs([_job(name="a"), _job(name="a"), _job("b")])
+    job = await _claim_one(backend)
+    await backend.complete_job(
+        "w1", job.id, JobStatus.DONE, processing_time=5, output=None
+    )
+
+    assert await backend.get_job_counts() == {
+        JobStatus.PENDING: 2,
+        JobStatus.DONE: 1,
+    }
+    assert await backend.get_job_counts("b") == {JobStatus.PENDING: 1}
+    by_name = await backend.get_job_counts_by_name()
+    assert by_name[("a", JobStatus.DONE)] == 1
+    assert by_name[("a", JobStatus.PENDING)] == 1
+    assert by_name[("b", JobStatus.PENDING)] == 1
+
+
+@check
+async def metrics(backend: Backend):
+    await backend.create_jobs([_job(), _job()])
+    job = await _claim_one(backend)
+    await backend.complete_job(
+        "w1", job.id, JobStatus.DONE, processing_time=2000, output=None
+    )
+
+    rows = await backend.get_job_metrics()
+    counters = {
+        metric: count for name, metric, bucket, count, _ in rows if bucket == 0
+    }
+    assert counters == {"submitted": 2, "in_progress": 1, "done": 1}
+
+    histograms = {
+        (metric, bucket): (count, total)
+        for _, metric, bucket, count, total in rows
+        if bucket != 0
+    }
+    assert histograms[("processing_time", 2.5)] == (1, 2.0)
+    assert [k[0] for k in histograms].count("queue_wait") == 1
+
+
+@check
+async def workers(backend: Backend):
+    before = datetime.now(timezone.utc) - timedelta(seconds=1)
+    await backend.check_in_worker("w1")
+    await backend.check_in_worker("w2")
+    await backend.add_worker_event("w1", "memory_sample", browser_memory=100)
+    await backend.add_worker_event("w1", "memory_sample", browser_memory=200)
+    await backend.add_worker_event("w1", "browser_recycle", reason="age")
+    await backend.add_worker_event("w2", "scale", reason="busy", slots=4)
+    await backend.add_worker_event("w2", "scale", reason="idle", slots=1)
+    await asyncio.sleep(0.01)
+    await backend.heartbeat("w1", [])
+
+    workers = await backend.get_workers(last_activity_time_ge=before)
+    assert [w.name for w in workers] == ["w1", "w2"]
+    assert workers[0].browser_memory == 200
+    assert workers[0].browser_recycles == 1
+    assert workers[1].browser_memory is None
+    assert (workers[0].slots, workers[1].slots) == (None, 1)
+
+    later = datetime.now(timezone.utc) + timedelta(seconds=60)
+    assert await backend.get_workers(last_activity_time_ge=later) == []
+    assert await backend.count_live_workers(60) == 2
+
+
+@check
+async def retention(backend: Backend):
+    pending = await backend.create_job(_job())
+    jobs = await backend.create_jobs([_job(), _job(), _job()])
+    await backend.claim_jobs("w1", 4)
+    for i, job in enumerate([pending, *jobs[:2]]):
+        await backend.complete_job(
+            "w1",
+            job.id,
+            JobStatus.DONE,
+            processing_time=5,
+            output=StoredOutput(path=f"p{i % 2}", hash="h", size=1),
+        )
+    in_progress = jobs[2]
+    await asyncio.sleep(0.01)
+
+    expired = await backend.get_expired_job_ids(0, 10)
+    assert expired == [pending.id, jobs[0].id, jobs[1].id]
+    assert await backend.get_expired_job_ids(3600, 10) == []
+    assert (
+        await backend.get_expired_job_ids(0, 10, status=JobStatus.FAILED) == []
+    )
+    assert await backend.get_excess_job_ids(1, 10) == [
+        jobs[0].id,
+        pending.id,
+    ]
+
+    paths = await backend.delete_jobs([pending.id, in_progress.id])
+    assert paths == ["p0"]
+    assert await backend.get_job(pending.id) is None
+    assert await backend.get_job(in_progress.id) is not None
+    # Still used by the third job
+    assert await backend.is_output_path_used("p0")
+    assert await backend.get_job_counts() == {
+        JobStatus.DONE: 2,
+        JobStatus.IN_PROGRESS: 1,
+    }
+    await backend.compact()
+
+
+async def _run(backends: Dict[str, Callable], checks: List[Check]) -> int:
+    failed = 0
+    for backend_name, create_backend in backends.items():
+        for fn in checks:
+            try:
+                async with create_backend() as backend:
+                    await fn(backend)
+            except Exception:
+                failed += 1
+                print(f"FAIL {backend_name} {fn.__name__}")
+                traceback.print_exc()
+            else:
+                print(f"ok   {backend_name} {fn.__name__}")
+    return failed
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--backend", choices=sorted(_BACKENDS))
+    parser.add_argument(
+        "--check", help="Run only checks with this in their name"
+    )
+    args = parser.parse_args()
+
+    backends = (
+        {args.backend: _BACKENDS[args.backend]} if args.backend else _BACKENDS
+    )
+    checks = [c for c in _CHECKS if not args.check or args.check in c.__name__]
+
+    failed = asyncio.run(_run(backends, checks))
+    total = len(backends) * len(checks)
+    print(f"{total - failed} passed, {failed} failed")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,8 @@
 from importlib.metadata import version, PackageNotFoundError
 
+from browsy._contexts import ContextProfile
 from browsy._jobs import BaseJob, Page
-from browsy._models import JobBase, Job, JobStatus
+from browsy._models import JobBase, Job, JobsPage, JobStatus
 from browsy._client import BrowsyClient, AsyncBrowsyClient
 
 try:
@@ -11,9 +12,11 @@ except PackageNotFoundError:
 
 __all__ = [
     "BaseJob",
+    "ContextProfile",
     "Page",
     "JobBase",
     "Job",
+    "JobsPage",
     "JobStatus",
     "BrowsyClient",
     "AsyncBrowsyClient",
@@ -41,20 +41,196 @@ def server(uvicorn_args: Tuple[str, ...]):
 @click.option(
     "--name", default=None, help="Worker name (random if not provided)"
 )
-def worker(name: Optional[str]):
+@click.option(
+    "--concurrency",
+    default=1,
+    show_default=True,
+    type=click.IntRange(min=1),
+    help="Number of jobs executed at once, each in its own browser context",
+)
+@click.option(
+    "--autoscale",
+    default=None,
+    metavar="MIN:MAX",
+    help=(
+        "Grow and shrink the number of jobs executed at once between MIN"
+        " and MAX, following the queue. The browser is closed while there"
+        " are no slots. Replaces --concurrency"
+    ),
+)
+@click.option(
+    "--scale-up-age",
+    default=1.0,
+    show_default=True,
+    type=click.FloatRange(min=0),
+    help="Add slots once a pending job waits this many seconds",
+)
+@click.option(
+    "--scale-down-delay",
+    default=60.0,
+    show_default=True,
+    type=click.FloatRange(min=0),
+    help="Remove slots once they're idle for this many seconds",
+)
+@click.option(
+    "--processes",
+    default=1,
+    show_default=True,
+    type=click.IntRange(min=1),
+    help=(
+        "Number of worker processes, each with its own browser. Processes"
+        " are named after the worker, e.g. worker-0, worker-1"
+    ),
+)
+@click.option(
+    "--context-pool",
+    default=None,
+    type=click.IntRange(min=0),
+    help=(
+        "Number of browser contexts kept ready for upcoming jobs"
+        "  [default: same as concurrency, or the number of slots when"
+        " autoscaling]"
+    ),
+)
+@click.option(
+    "--max-browser-jobs",
+    default=None,
+    type=click.IntRange(min=1),
+    help="Relaunch the browser after this many jobs",
+)
+@click.option(
+    "--max-browser-age",
+    default=None,
+    type=click.FloatRange(min=0, min_open=True),
+    help="Relaunch the browser after this many seconds",
+)
+@click.option(
+    "--max-browser-memory",
+    default=None,
+    type=click.IntRange(min=1),
+    help="Relaunch the browser once its processes use this many MiB",
+)
+@click.option(
+    "--asset-cache",
+    default=None,
+    type=click.Path(file_okay=False),
+    help=(
+        "Directory of an on-disk cache of static assets (stylesheets,"
+        " scripts, fonts and images) fetched by jobs. Workers on the same"
+        " host can share it"
+    ),
+)
+@click.option(
+    "--asset-cache-size",
+    default=1024,
+    show_default=True,
+    type=click.IntRange(min=1),
+    help=(
+        "Evict least recently used assets once the cache exceeds this many"
+        " MiB"
+    ),
+)
+@click.option(
+    "--jobs",
+    default=None,
+    help=(
+        "Comma-separated names of jobs the worker takes, e.g."
+        " screenshot,pdf  [default: all defined jobs]"
+    ),
+)
+def worker(
+    name: Optional[str],
+    concurrency: int,
+    autoscale: Optional[str],
+    scale_up_age: float,
+    scale_down_delay: float,
+    processes: int,
+    context_pool: Optional[int],
+    max_browser_jobs: Optional[int],
+    max_browser_age: Optional[float],
+    max_browser_memory: Optional[int],
+    asset_cache: Optional[str],
+    asset_cache_size: int,
+    jobs: Optional[str],
+):
     """Start a browsy worker process."""
     _validate_env_vars()
 
+    from browsy._assets import AssetCacheSettings
+    from browsy._browser import RecycleLimits
+    from browsy._scaling import ScalingLimits
     from browsy._worker import start_worker
 
+    scaling = None
+    if autoscale:
+        ctx = click.get_current_context()
+        if (
+            ctx.get_parameter_source("concurrency")
+            != click.core.ParameterSource.DEFAULT
+        ):
+            raise click.UsageError(
+                "--autoscale and --concurrency can't be used together"
+            )
+        min_slots, max_slots = _parse_autoscale(autoscale)
+        scaling = ScalingLimits(
+            min_slots=min_slots,
+            max_slots=max_slots,
+            scale_up_age=scale_up_age,
+            scale_down_delay=scale_down_delay,
+        )
+
     worker_name = name or f"worker_{_get_random_chars(8)}"
-    start_worker(
-        worker_name,
+    worker_kwargs = dict(
         db_path=os.environ["BROWSY_DB_PATH"],
         jobs_path=os.environ["BROWSY_JOBS_PATH"],
+        concurrency=concurrency,
+        context_pool_size=context_pool,
+        recycle_limits=RecycleLimits(
+            max_jobs=max_browser_jobs,
+            max_age=max_browser_age,
+            max_memory=(
+                max_browser_memory * 2**20 if max_browser_memory else None
+            ),
+        ),
+        job_names=(
+            [n.strip() for n in jobs.split(",") if n.strip()] if jobs else None
+        ),
+        scaling=scaling,
+        asset_cache=(
+            AssetCacheSettings(
+                path=asset_cache, max_size=asset_cache_size * 2**20
+            )
+            if asset_cache
+            else None
+        ),
+    )
+    if processes == 1:
+        start_worker(worker_name, **worker_kwargs)
+        return
+
+    from browsy._supervisor import supervise
+
+    supervise(
+        [f"{worker_name}-{i}" for i in range(processes)],
+        start_worker,
+        **worker_kwargs,
     )
 
 
+def _parse_autoscale(value: str) -> Tuple[int, int]:
+    try:
+        min_slots, max_slots = (int(v) for v in value.split(":"))
+    except ValueError:
+        raise click.BadParameter(
+            "expected MIN:MAX, e.g. 0:8", param_hint="--autoscale"
+        ) from None
+    if not 0 <= min_slots <= max_slots or max_slots < 1:
+        raise click.BadParameter(
+            "expected 0 <= MIN <= MAX and MAX >= 1", param_hint="--autoscale"
+        )
+    return min_slots, max_slots
+
+
 def _get_random_chars(length: int) -> str:
     chars = string.ascii_letters + string.digits
     return "".join(random.choice(chars) for _ in range(length))
@@ -0,0 +1,464 @@
+import asyncio
+import json
+import logging
+import sqlite3
+import time
+from datetime import timezone
+from email.utils import parsedate_to_datetime
+from pathlib import Path
+from typing import (
+    Any,
+    Awaitable,
+    Dict,
+    List,
+    NamedTuple,
+    Optional,
+    Sequence,
+)
+
+import aiosqlite
+from playwright.async_api import (
+    APIResponse,
+    BrowserContext,
+    Request,
+    Route,
+    Error as PlaywrightError,
+)
+from pydantic import BaseModel
+
+from browsy import _storage
+
+logger = logging.getLogger(__name__)
+
+# Static resources that pages of the same site tend to share. Documents and
+# API calls are always requested from the network.
+_CACHED_RESOURCE_TYPES = frozenset({"stylesheet", "script", "font", "image"})
+# Responses without explicit freshness stay fresh for a fraction of the time
+# since they were last modified, as browsers do
+_HEURISTIC_FRACTION = 0.1
+_MAX_HEURISTIC_LIFETIME = 24 * 60 * 60  # seconds
+# Eviction frees a bit more than needed, so it doesn't run on every store
+_EVICTION_TARGET = 0.9
+# Larger assets aren't stored, so a single one can't push most of the
+# others out
+_MAX_ASSET_SHARE = 0.1
+# Files that were just stored might not be referenced by the index yet when
+# another process evicts them
+_UNREFERENCED_FILE_MIN_AGE = 60  # seconds
+# Eviction order only needs to be roughly right, so hits record their use
+# at most this often instead of waiting for the index on every request
+_TOUCH_INTERVAL = 60  # seconds
+# Headers that describe the transfer rather than the content. Bodies are
+# stored decoded, so their encoding and length don't apply anymore.
+_UNSTORED_HEADERS = frozenset(
+    {
+        "age",
+        "connection",
+        "content-encoding",
+        "content-length",
+        "date",
+        "keep-alive",
+        "set-cookie",
+        "transfer-encoding",
+    }
+)
+
+_SCHEMA = (
+    """
+    CREATE TABLE IF NOT EXISTS assets (
+        url TEXT PRIMARY KEY,
+        path TEXT NOT NULL,
+        size INTEGER NOT NULL,
+        headers TEXT NOT NULL,
+        expires_at REAL NOT NULL,
+        last_used REAL NOT NULL
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_assets_last_used ON assets (last_used)",
+    "CREATE INDEX IF NOT EXISTS idx_assets_path ON assets (path)",
+)
+
+
+class AssetCacheSettings(BaseModel):
+    """Location and size of the worker's HTTP asset cache."""
+
+    path: str
+    max_size: int  # bytes
+
+
+class _Entry(NamedTuple):
+    headers: Dict[str, str]
+    body: bytes
+    expires_at: float
+
+
+class AssetCache:
+    """HTTP cache of static assets shared by all jobs of the worker.
+
+    Every new browser context starts with an empty HTTP cache, so pages of
+    the same site download the same stylesheets, scripts, fonts and images
+    for every job. The cache intercepts these requests and serves responses
+    that `Cache-Control` (or `Expires`) allows a shared cache to store from
+    disk until they go stale. Stale responses with an `ETag` or
+    `Last-Modified` are revalidated with a conditional request, so only
+    changed assets are downloaded again.
+
+    Bodies are stored as files named after their content, with an SQLite
+    index of URLs next to them. Workers on the same host can share the
+    cache by pointing it at the same directory. Once the cache grows over
+    its maximum size, the least recently used assets are evicted.
+    """
+
+    def __init__(self, settings: AssetCacheSettings) -> None:
+        self.settings = settings
+        self.hits = 0
+        self.misses = 0
+        self.revalidations = 0
+        self._root = Path(settings.path)
+        self._files = _storage.OutputStore(self._root / "files")
+        self._conn: Optional[aiosqlite.Connection] = None
+        # Statements run on the connection during an eviction would be a
+        # part of its transaction, so every write of the index waits for it
+        self._write_lock = asyncio.Lock()
+
+    async def open(self) -> None:
+        self._root.mkdir(parents=True, exist_ok=True)
+        conn = await aiosqlite.connect(
+            self._root / "index.db", isolation_level=None
+        )
+        conn.row_factory = aiosqlite.Row
+        await conn.execute("PRAGMA journal_mode = WAL")
+        await conn.execute("PRAGMA synchronous = NORMAL")
+        await conn.execute("PRAGMA busy_timeout = 5000")
+        for statement in _SCHEMA:
+            await conn.execute(statement)
+        self._conn = conn
+        await self._delete_unreferenced_files()
+
+    async def close(self) -> None:
+        if self._conn is None:
+            return
+        await self._conn.close()
+        self._conn = None
+        logger.info(
+            "Asset cache: %d hits, %d revalidations, %d misses",
+            self.hits,
+            self.revalidations,
+            self.misses,
+        )
+
+    async def attach(self, context: BrowserContext) -> None:
+        """Routes the context's requests through the cache.
+
+        Routes set up later take precedence, so requests blocked by other
+        routes never reach the cache.
+        """
+        await context.route("**/*", self._handle)
+
+    async def _handle(self, route: Route) -> None:
+        request = route.request
+        if not _is_cacheable_request(request):
+            await route.fallback()
+            return
+
+        try:
+            entry = await self._get(request.url)
+        except (sqlite3.Error, OSError):
+            logger.warning("Failed to read the asset cache", exc_info=True)
+            await route.fallback()
+            return
+
+        if entry and entry.expires_at > time.time():
+            self.hits += 1
+            await route.fulfill(
+                status=200, headers=entry.headers, body=entry.body
+            )
+            return
+
+        conditional = (
+            _get_conditional_headers(entry.headers) if entry else None
+        )
+        if conditional:
+            headers = {**request.headers, **conditional}
+        else:
+            headers = None
+        try:
+            response = await route.fetch(headers=headers)
+        except PlaywrightError:
+            # The browser requests it again and reports the failure to the
+            # page as usual
+            await route.fallback()
+            return
+
+        if entry and conditional and response.status == 304:
+            self.revalidations += 1
+            await route.fulfill(
+                status=200, headers=entry.headers, body=entry.body
+            )
+            await self._try(self._refresh(request.url, entry, response))
+            return
+
+        self.misses += 1
+        await route.fulfill(response=response)
+        if response.status == 200:
+            await self._try(self._put(request.url, response))
+
+    async def _try(self, write: Awaitable[None]) -> None:
+        # The page has its response already, a failed write only means the
+        # asset isn't cached
+        try:
+            await write
+        except (sqlite3.Error, OSError, PlaywrightError):
+            logger.warning("Failed to write the asset cache", exc_info=True)
+
+    async def _get(self, url: str) -> Optional[_Entry]:
+        async with self._conn.execute(
+            "SELECT path, headers, expires_at, last_used FROM assets"
+            " WHERE url = ?",
+            (url,),
+        ) as cursor:
+            row = await cursor.fetchone()
+        if row is None:
+            return None
+
+        try:
+            body = await asyncio.to_thread(
+                self._files.resolve(row["path"]).read_bytes
+            )
+        except FileNotFoundError:
+            # Evicted by another worker along with its last reference
+            await self._write("DELETE FROM assets WHERE url = ?", (url,))
+            return None
+
+        now = time.time()
+        if now - row["last_used"] >= _TOUCH_INTERVAL:
+            await self._write(
+                "UPDATE assets SET last_used = ? WHERE url = ?", (now, url)
+            )
+        return _Entry(json.loads(row["headers"]), body, row["expires_at"])
+
+    async def _put(self, url: str, response: APIResponse) -> None:
+        now = time.time()
+        expires_at = get_expiry(response.headers, now)
+        if expires_at is None:
+            return
+        body = await response.body()
+        if len(body) > self.settings.max_size * _MAX_ASSET_SHARE:
+            return
+
+        # The file and its reference are saved together, so an eviction can't
+        # delete the file in between
+        async with self._write_lock:
+            stored = await asyncio.to_thread(self._files.put, body)
+            await self._conn.execute(
+                "INSERT OR REPLACE INTO assets"
+                " (url, path, size, headers, expires_at, last_used)"
+                " VALUES (?, ?, ?, ?, ?, ?)",
+                (
+                    url,
+                    stored.path,
+                    stored.size,
+                    json.dumps(_get_stored_headers(response.headers)),
+                    expires_at,
+                    now,
+                ),
+            )
+        await self._evict()
+
+    async def _refresh(
+        self, url: str, entry: _Entry, response: APIResponse
+    ) -> None:
+        # A 304 response carries the new freshness of the stored response
+        expires_at = get_expiry(
+            {**entry.headers, **response.headers}, time.time()
+        )
+        headers = {**entry.headers, **_get_stored_headers(response.headers)}
+        if expires_at is None:
+            await self._write("DELETE FROM assets WHERE url = ?", (url,))
+            return
+        await self._write(
+            "UPDATE assets SET headers = ?, expires_at = ? WHERE url = ?",
+            (json.dumps(headers), expires_at, url),
+        )
+
+    async def _write(self, sql: str, parameters: Sequence[Any]) -> None:
+        async with self._write_lock:
+            await self._conn.execute(sql, parameters)
+
+    async def _evict(self) -> None:
+        async with self._write_lock:
+            async with self._conn.execute(
+                "SELECT COALESCE(SUM(size), 0) FROM assets"
+            ) as cursor:
+                (total,) = await cursor.fetchone()
+            if total <= self.settings.max_size:
+                return
+
+            evicted: List[str] = []
+            paths = set()
+            await self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                async with self._conn.execute(
+                    "SELECT url, path, size FROM assets ORDER BY last_used"
+                ) as cursor:
+                    async for row in cursor:
+                        if total <= self.settings.max_size * _EVICTION_TARGET:
+                            break
+                        evicted.append(row["url"])
+                        paths.add(row["path"])
+                        total -= row["size"]
+                await self._conn.executemany(
+                    "DELETE FROM assets WHERE url = ?",
+                    [(url,) for url in evicted],
+                )
+                # Identical bodies of different URLs share a file
+                async with self._conn.execute(
+                    "SELECT DISTINCT path FROM assets WHERE path IN"
+                    f" ({', '.join('?' * len(paths))})",
+                    list(paths),
+                ) as cursor:
+                    paths -= {row["path"] async for row in cursor}
+                await self._conn.execute("COMMIT")
+            except BaseException:
+                await self._conn.execute("ROLLBACK")
+                raise
+
+            # Other processes might store the same file again meanwhile, but
+            # that makes it too new to be deleted
+            for path in paths:
+                await asyncio.to_thread(
+                    self._files.delete, path, _UNREFERENCED_FILE_MIN_AGE
+                )
+        logger.debug("Evicted %d assets from the cache", len(evicted))
+
+    async def _delete_unreferenced_files(self) -> None:
+        # Files evicted right after they were stored are left behind
+        async with self._conn.execute("SELECT path FROM assets") as cursor:
+            referenced = {row["path"] async for row in cursor}
+        root = self._files.root
+        paths = await asyncio.to_thread(
+            lambda: [
+                path.relative_to(root).as_posix()
+                for path in root.glob("*/*/*")
+                if not path.name.startswith(".")
+            ]
+        )
+        for path in paths:
+            if path not in referenced:
+                await asyncio.to_thread(
+                    self._files.delete, path, _UNREFERENCED_FILE_MIN_AGE
+                )
+
+
+def get_expiry(headers: Dict[str, str], now: float) -> Optional[float]:
+    """Returns until when a response is fresh, as a Unix timestamp.
+
+    Args:
+        headers: Headers of the response, with lowercase names.
+        now: Current time, as a Unix timestamp.
+
+    Returns:
+        None if a shared cache must not store the response at all. A time
+        in the past if the response can be stored, but has to be
+        revalidated before it's used.
+    """
+    directives = _parse_cache_control(headers.get("cache-control", ""))
+    if "no-store" in directives or "private" in directives:
+        return None
+    # Responses that set cookies belong to a single client
+    if "set-cookie" in headers:
+        return None
+    # Bodies are stored decoded, so only the encoding can vary
+    vary = {v.strip().lower() for v in headers.get("vary", "").split(",")}
+    if vary - {"", "accept-encoding"}:
+        return None
+
+    if "no-cache" in directives:
+        lifetime = 0.0
+    else:
+        lifetime = _get_lifetime(directives, headers, now)
+    if lifetime <= 0 and not _get_conditional_headers(headers):
+        # Without validators, a stale response can't be used ever again
+        return None
+
+    age = _parse_seconds(headers.get("age")) or 0
+    return now + lifetime - age
+
+
+def _get_lifetime(
+    directives: Dict[str, str], headers: Dict[str, str], now: float
+) -> float:
+    for name in ("s-maxage", "max-age"):
+        if name in directives:
+            return _parse_seconds(directives[name]) or 0
+
+    date = _parse_date(headers.get("date")) or now
+    if "expires" in headers:
+        # Invalid dates (e.g. "0") mean the response is expired already
+        expires = _parse_date(headers["expires"])
+        return expires - date if expires is not None else 0
+
+    last_modified = _parse_date(headers.get("last-modified"))
+    if last_modified is not None:
+        return min(
+            (date - last_modified) * _HEURISTIC_FRACTION,
+            _MAX_HEURISTIC_LIFETIME,
+        )
+    return 0
+
+
+def _is_cacheable_request(request: Request) -> bool:
+    return (
+        request.method == "GET"
+        and request.resource_type in _CACHED_RESOURCE_TYPES
+        and request.url.startswith(("http://", "https://"))
+        # Responses to authorized requests are meant for a single client
+        and "authorization" not in request.headers
+    )
+
+
+def _get_conditional_headers(headers: Dict[str, str]) -> Dict[str, str]:
+    conditional = {}
+    if "etag" in headers:
+        conditional["if-none-match"] = headers["etag"]
+    if "last-modified" in headers:
+        conditional["if-modified-since"] = headers["last-modified"]
+    return conditional
+
+
+def _get_stored_headers(headers: Dict[str, str]) -> Dict[str, str]:
+    return {
+        name: value
+        for name, value in headers.items()
+        if name.lower() not in _UNSTORED_HEADERS
+    }
+
+
+def _parse_cache_control(value: str) -> Dict[str, str]:
+    directives = {}
+    for directive in value.split(","):
+        name, _, argument = directive.partition("=")
+        name = name.strip().lower()
+        if name:
+            directives[name] = argument.strip().strip('"')
+    return directives
+
+
+def _parse_seconds(value: Optional[str]) -> Optional[int]:
+    try:
+        return int(value) if value is not None else None
+    except ValueError:
+        return None
+
+
+def _parse_date(value: Optional[str]) -> Optional[float]:
+    if not value:
+        return None
+    try:
+        parsed = parsedate_to_datetime(value)
+    except (TypeError, ValueError, IndexError):
+        return None
+    # HTTP dates are always in UTC, even if they don't say so
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.timestamp()
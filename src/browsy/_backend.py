@@ -0,0 +1,425 @@
+"""Storage of jobs, their outputs and workers.
+
+The server and workers only talk to the queue through a `Backend`, so the
+storage engine can be swapped without touching them. `_sqlite.SQLiteBackend`
+is shared by all processes using the same database file,
+`_memory.MemoryBackend` lives in a single process.
+"""
+
+import base64
+from abc import ABC, abstractmethod
+from datetime import datetime
+from typing import (
+    ClassVar,
+    Collection,
+    Dict,
+    Iterable,
+    List,
+    Literal,
+    NamedTuple,
+    Optional,
+    Tuple,
+    Type,
+    Union,
+)
+
+from pydantic import BaseModel
+
+from browsy import _models, _storage
+
+# Number of seconds a worker holds a claimed job without extending the lease
+DEFAULT_LEASE_DURATION = 60
+
+# Upper bounds (seconds) of the buckets of job histograms
+HISTOGRAM_BUCKETS = (
+    0.1,
+    0.25,
+    0.5,
+    1,
+    2.5,
+    5,
+    10,
+    30,
+    60,
+    120,
+    300,
+    900,
+    3600,
+)
+
+FinalStatus = Literal[
+    _models.JobStatus.DONE,
+    _models.JobStatus.FAILED,
+    _models.JobStatus.TIMED_OUT,
+]
+
+WorkerEventType = Literal["memory_sample", "browser_recycle", "scale"]
+
+
+class NewJob(NamedTuple):
+    name: str
+    input_json: str
+    cache_key: Optional[str] = None
+    timeout: Optional[float] = None  # seconds
+    priority: int = 0
+
+
+class QueueStats(NamedTuple):
+    pending: int
+    oldest_age: Optional[float]  # seconds the oldest pending job waits
+
+
+class CancelResult(NamedTuple):
+    job: Optional[_models.Job]  # None if the job doesn't exist
+    cancelled: bool  # False if the job was finished already
+
+
+class DBOutputInfo(BaseModel):
+    id: int
+    job_id: int
+    size: int
+    path: Optional[str]  # relative to the output store, if stored there
+    hash: Optional[str]
+    encoding: Optional[str]  # content encoding, if compressed
+
+
+class DBWorker(BaseModel):
+    id: int
+    name: str
+    last_check_in_time: datetime
+    last_activity_time: datetime
+    browser_memory: Optional[int] = None  # bytes, last sample
+    browser_recycles: int = 0
+    slots: Optional[int] = None  # job slots, if the worker autoscales
+
+    @property
+    def uptime(self) -> datetime:
+        return datetime.now()
+
+
+class Backend(ABC):
+    """Queue of jobs along with their outputs and the workers serving them.
+
+    Every method is atomic - concurrent calls, even from other processes
+    sharing the storage, never see a half-done change. Jobs are returned
+    as copies, changing them doesn't change the stored jobs.
+    """
+
+    # Errors that are expected from time to time (e.g. the storage being
+    # busy), and are worth a retry rather than a crash
+    TRANSIENT_ERRORS: ClassVar[Tuple[Type[Exception], ...]] = ()
+
+    async def open(self) -> None:
+        """Connects to the storage."""
+
+    async def close(self) -> None:
+        """Releases connections to the storage."""
+
+    async def init(self) -> None:
+        """Creates or migrates the storage, called by the server on startup."""
+
+    async def __aenter__(self) -> "Backend":
+        await self.open()
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self.close()
+
+    # Jobs
+
+    async def create_job(self, job: NewJob) -> _models.Job:
+        """Queues a new job, see `create_jobs`."""
+        return (await self.create_jobs([job]))[0]
+
+    @abstractmethod
+    async def create_jobs(self, jobs: List[NewJob]) -> List[_models.Job]:
+        """Queues new jobs, either all of them or none.
+
+        A job whose cache key matches a fresh cache entry is finished right
+        away instead, and reuses the output of the cached job. Jobs are
+        returned in the same order as they were given.
+        """
+
+    @abstractmethod
+    async def get_job(self, job_id: int) -> Optional[_models.Job]: ...
+
+    @abstractmethod
+    async def get_jobs_by_ids(
+        self, ids: Iterable[int]
+    ) -> List[_models.Job]: ...
+
+    @abstractmethod
+    async def list_jobs(
+        self,
+        status: Optional[_models.JobStatus] = None,
+        name: Optional[str] = None,
+        limit: Optional[int] = None,
+        cursor: Optional[str] = None,
+    ) -> _models.JobsPage:
+        """Returns a page of jobs, from the newest ones.
+
+        Args:
+            cursor: `next_cursor` or `prev_cursor` of another page, None for
+                the first page.
+
+        Raises:
+            ValueError: If the cursor is invalid.
+        """
+
+    @abstractmethod
+    async def get_job_counts(
+        self, name: Optional[str] = None
+    ) -> Dict[_models.JobStatus, int]:
+        """Returns the number of jobs by status, optionally of a single name."""
+
+    @abstractmethod
+    async def cancel_job(self, job_id: int) -> CancelResult:
+        """Cancels the job unless it's finished already.
+
+        Returns:
+            The job after the change, and whether it was cancelled by this
+            call.
+        """
+
+    # Queue
+
+    @abstractmethod
+    async def has_pending_jobs(
+        self, names: Optional[Collection[str]] = None
+    ) -> bool:
+        """Cheaply checks for pending jobs, optionally of the given types."""
+
+    @abstractmethod
+    async def get_queue_stats(
+        self, names: Optional[Collection[str]] = None
+    ) -> QueueStats:
+        """Returns the number of pending jobs and how long the oldest waits.
+
+        If `names` are given, only jobs of these types are considered.
+        """
+
+    @abstractmethod
+    async def claim_jobs(
+        self,
+        worker: str,
+        limit: int,
+        lease_duration: float = DEFAULT_LEASE_DURATION,
+        names: Optional[Collection[str]] = None,
+    ) -> List[_models.Job]:
+        """Assigns up to `limit` next pending jobs to the worker.
+
+        Jobs with the highest priority are claimed first, oldest first among
+        jobs with the same priority. If `names` are given, only jobs of these
+        types are claimed. The worker holds a lease on the jobs for
+        `lease_duration` seconds, see `heartbeat`.
+        """
+
+    @abstractmethod
+    async def complete_job(
+        self,
+        worker: str,
+        job_id: int,
+        status: FinalStatus,
+        processing_time: int,
+        output: Union[bytes, _storage.StoredOutput, None],
+        output_encoding: Optional[str] = None,
+        cache_ttl: Optional[int] = None,
+        timings: Optional[Dict[str, float]] = None,
+        output_size: Optional[int] = None,
+    ) -> bool:
+        """Finishes the job and saves its output.
+
+        The output is either the content, or a reference to a file already
+        saved in the output store. `output_encoding` tells how the content
+        was compressed, if it was, and `output_size` is its size before
+        compression. If `cache_ttl` (seconds) is given, a done job becomes
+        a cache entry for jobs with the same cache key. `timings` are
+        milliseconds spent in each phase of processing.
+
+        Returns:
+            False if the job isn't in progress by the worker anymore (e.g.
+            it was cancelled), in which case nothing is saved.
+        """
+
+    @abstractmethod
+    async def add_job_timings(
+        self, timings: Dict[int, Dict[str, float]]
+    ) -> None:
+        """Adds timings of phases measured after the jobs were finished."""
+
+    @abstractmethod
+    async def requeue_job(self, job_id: int) -> None:
+        """Puts a claimed job that hasn't been started back to the queue."""
+
+    @abstractmethod
+    async def requeue_expired_jobs(self, max_attempts: int) -> Tuple[int, int]:
+        """Takes back jobs whose workers stopped extending their leases.
+
+        Jobs are queued again, unless they were attempted `max_attempts`
+        times already - then they're marked as failed.
+
+        Returns:
+            Number of requeued jobs and number of failed jobs.
+        """
+
+    @abstractmethod
+    async def evict_cache_entries(self) -> int:
+        """Removes expired cache entries. Returns the number of removed ones."""
+
+    # Outputs
+
+    @abstractmethod
+    async def get_job_output_info(self, job_id: int) -> Optional[DBOutputInfo]:
+        """Returns job's output metadata without reading the output itself."""
+
+    @abstractmethod
+    async def read_output_chunk(
+        self, output_id: int, offset: int, size: int
+    ) -> bytes:
+        """Reads a part of the output without loading the whole of it."""
+
+    # Workers
+
+    @abstractmethod
+    async def check_in_worker(self, worker: str) -> None:
+        """Registers a starting worker."""
+
+    @abstractmethod
+    async def heartbeat(
+        self,
+        worker: str,
+        job_ids: Iterable[int],
+        lease_duration: float = DEFAULT_LEASE_DURATION,
+        timings: Optional[Dict[int, Dict[str, float]]] = None,
+    ) -> None:
+        """Reports the worker is alive and extends its leases on the jobs.
+
+        `timings` are added to the jobs like by `add_job_timings`, in the
+        same write.
+        """
+
+    @abstractmethod
+    async def add_worker_event(
+        self,
+        worker: str,
+        event: WorkerEventType,
+        browser_memory: Optional[int] = None,
+        browser_jobs: Optional[int] = None,
+        browser_age: Optional[float] = None,
+        reason: Optional[str] = None,
+        slots: Optional[int] = None,
+    ) -> None:
+        """Records an event in worker's browser lifecycle or scaling.
+
+        Args:
+            worker: Name of the worker.
+            event: Type of the event.
+            browser_memory: Memory used by the browser, in bytes.
+            browser_jobs: Number of jobs processed by the browser.
+            browser_age: Number of seconds since the browser was launched.
+            reason: Why the event happened (e.g. why the browser was
+                recycled).
+            slots: Number of job slots the worker scaled to.
+        """
+
+    @abstractmethod
+    async def get_workers(
+        self, last_activity_time_ge: Optional[datetime] = None
+    ) -> List[DBWorker]:
+        """Returns workers, the most recently active first."""
+
+    @abstractmethod
+    async def count_live_workers(self, max_idle: float) -> int:
+        """Counts workers active within the last `max_idle` seconds."""
+
+    # Metrics
+
+    @abstractmethod
+    async def get_job_counts_by_name(
+        self,
+    ) -> Dict[Tuple[str, _models.JobStatus], int]:
+        """Returns the number of jobs by name and status."""
+
+    @abstractmethod
+    async def get_job_metrics(
+        self,
+    ) -> List[Tuple[str, str, float, int, float]]:
+        """Returns all job counters and histogram buckets.
+
+        Rows are (name, metric, bucket, count, sum), ordered by name, metric
+        and bucket. Counters count job events - 'submitted', or the status
+        a job got - and have bucket 0. Histograms ('queue_wait' and
+        'processing_time', in seconds) have a row for each non-empty,
+        non-cumulative bucket of `HISTOGRAM_BUCKETS`, or infinity. Unlike
+        job counts, they aren't decreased when jobs are deleted.
+        """
+
+    async def get_storage_metrics(self) -> List[Tuple[str, str, float]]:
+        """Returns gauges specific to the storage.
+
+        Gauges are (name, documentation, value).
+        """
+        return []
+
+    # Retention
+
+    @abstractmethod
+    async def get_expired_job_ids(
+        self,
+        max_age: float,
+        limit: int,
+        name: Optional[str] = None,
+        status: Optional[_models.JobStatus] = None,
+    ) -> List[int]:
+        """Returns IDs of finished jobs older than `max_age` seconds.
+
+        Jobs can be narrowed down to the ones with the given name and status.
+        """
+
+    @abstractmethod
+    async def get_excess_job_ids(
+        self,
+        max_count: int,
+        limit: int,
+        name: Optional[str] = None,
+        status: Optional[_models.JobStatus] = None,
+    ) -> List[int]:
+        """Returns IDs of finished jobs beyond the `max_count` newest ones.
+
+        Jobs can be narrowed down to the ones with the given name and status.
+        """
+
+    @abstractmethod
+    async def delete_jobs(self, ids: List[int]) -> List[str]:
+        """Deletes finished jobs along with their outputs and cache entries.
+
+        Returns:
+            Paths of the deleted outputs in the output store. The files might
+            still be used by other jobs, see `is_output_path_used`.
+        """
+
+    @abstractmethod
+    async def is_output_path_used(self, path: str) -> bool: ...
+
+    async def compact(self) -> None:
+        """Returns space no longer used by the storage."""
+
+
+def encode_cursor(direction: Literal["<", ">"], created_at: str, id_: int):
+    value = f"{direction}{created_at}|{id_}"
+    return base64.urlsafe_b64encode(value.encode()).decode()
+
+
+def decode_cursor(cursor: str) -> Tuple[str, str, int]:
+    try:
+        value = base64.urlsafe_b64decode(cursor.encode()).decode()
+        # Characters outside of the alphabet are dropped, so anything else
+        # decodes to nothing
+        if not value:
+            raise ValueError
+        direction, (created_at, id_) = value[0], value[1:].split("|")
+        if direction not in ("<", ">"):
+            raise ValueError
+        return direction, created_at, int(id_)
+    except (ValueError, UnicodeDecodeError) as e:
+        raise ValueError("Invalid cursor") from e
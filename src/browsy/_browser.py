@@ -0,0 +1,171 @@
+import logging
+import os
+import time
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional
+
+from playwright.async_api import PlaywrightContextManager
+from pydantic import BaseModel
+
+from browsy import _assets, _contexts
+
+logger = logging.getLogger(__name__)
+
+_PROC_PATH = Path("/proc")
+
+
+class RecycleLimits(BaseModel):
+    """Limits after which the worker relaunches its browser."""
+
+    max_jobs: Optional[int] = None
+    max_age: Optional[float] = None  # seconds
+    max_memory: Optional[int] = None  # bytes
+
+
+class BrowserManager:
+    """Owns the worker's browser and relaunches it when it gets worn out.
+
+    Long-running browsers tend to grow in memory, so the browser is replaced
+    after a number of jobs, after some time or once its processes use too
+    much memory. The manager only tells when it's time - the caller has to
+    make sure no job is using the browser while it's being recycled.
+    """
+
+    def __init__(
+        self,
+        limits: RecycleLimits,
+        context_pool_size: int,
+        profiles: Iterable[_contexts.ContextProfile] = (
+            _contexts.DEFAULT_PROFILE,
+        ),
+        asset_cache: Optional[_assets.AssetCache] = None,
+    ) -> None:
+        self.limits = limits
+        self.jobs = 0
+        # Last measured memory of the browser's processes, in bytes
+        self.memory: Optional[int] = None
+        self._context_pool_size = context_pool_size
+        self._profiles = list(profiles)
+        self._asset_cache = asset_cache
+        self._playwright = None
+        self._contexts: Optional[_contexts.ContextPool] = None
+        self._launch_time = 0.0
+
+    @property
+    def contexts(self) -> _contexts.ContextPool:
+        if self._contexts is None:
+            raise RuntimeError("Browser isn't launched")
+        return self._contexts
+
+    @property
+    def is_launched(self) -> bool:
+        return self._contexts is not None
+
+    @property
+    def age(self) -> float:
+        return time.monotonic() - self._launch_time
+
+    async def launch(self) -> None:
+        self._playwright = await PlaywrightContextManager().start()
+        browser = await self._playwright.chromium.launch(headless=True)
+        self._contexts = _contexts.ContextPool(
+            browser,
+            self._context_pool_size,
+            self._profiles,
+            self._asset_cache,
+        )
+        await self._contexts.start()
+
+        self.jobs = 0
+        self.memory = None
+        self._launch_time = time.monotonic()
+
+    async def close(self) -> None:
+        if self._contexts:
+            await self._contexts.close()
+            self._contexts = None
+        if self._playwright:
+            # Stopping Playwright kills the browser along with its driver
+            await self._playwright.stop()
+            self._playwright = None
+
+    async def resize_context_pool(self, size: int) -> None:
+        self._context_pool_size = size
+        if self._contexts:
+            await self._contexts.resize(size)
+
+    async def recycle(self) -> None:
+        await self.close()
+        await self.launch()
+
+    def get_recycle_reason(self) -> Optional[str]:
+        """Returns why the browser should be recycled, if it should."""
+        limits = self.limits
+        if limits.max_jobs and self.jobs >= limits.max_jobs:
+            return f"processed {self.jobs} jobs"
+        if limits.max_age and self.age >= limits.max_age:
+            return f"running for {round(self.age)}s"
+        if (
+            limits.max_memory
+            and self.memory is not None
+            and self.memory >= limits.max_memory
+        ):
+            return f"using {self.memory // 2**20} MiB of memory"
+        return None
+
+
+def can_measure_memory() -> bool:
+    return _PROC_PATH.is_dir()
+
+
+def get_child_processes_memory() -> Optional[int]:
+    """Measures memory used by all descendants of the current process.
+
+    The browser and Playwright's driver are the only processes started by
+    the worker. Memory of each process is its proportional set size (so
+    memory shared by the browser's processes isn't counted many times), or
+    resident set size on older kernels.
+
+    Returns:
+        Memory in bytes, or None if it can't be measured on this system.
+    """
+    if not can_measure_memory():
+        return None
+
+    children: Dict[int, List[int]] = {}
+    for entry in _PROC_PATH.iterdir():
+        if not entry.name.isdigit():
+            continue
+        try:
+            stat = (entry / "stat").read_text()
+        except OSError:
+            continue  # the process is gone already
+        # Process name might contain spaces, so fields are counted from the
+        # closing parenthesis after it
+        ppid = int(stat[stat.rindex(")") + 2 :].split()[1])
+        children.setdefault(ppid, []).append(int(entry.name))
+
+    total = 0
+    pending = list(children.get(os.getpid(), []))
+    while pending:
+        pid = pending.pop()
+        pending.extend(children.get(pid, []))
+        total += _get_process_memory(pid)
+
+    return total
+
+
+def _get_process_memory(pid: int) -> int:
+    try:
+        with open(_PROC_PATH / str(pid) / "smaps_rollup") as f:
+            for line in f:
+                if line.startswith("Pss:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+
+    try:
+        statm = (_PROC_PATH / str(pid) / "statm").read_text()
+    except OSError:
+        return 0
+    return int(statm.split()[1]) * os.sysconf("SC_PAGE_SIZE")
@@ -1,8 +1,23 @@
-from typing import Optional, Dict, Any
+import os
+import time
+from typing import (
+    Optional,
+    Dict,
+    Any,
+    List,
+    Iterator,
+    AsyncIterator,
+    Union,
+)
 
 import httpx
 
-from browsy._models import Job
+from browsy._models import Job, JobsPage, JobStatus
+
+# Server caps a single long-poll, so longer waits are split into many requests
+_LONG_POLL_WAIT = 30
+# Extra time given to the server to respond after the wait is over
+_LONG_POLL_MARGIN = 10
 
 
 class BaseClient:
@@ -14,6 +29,16 @@ class BaseClient:
             endpoint = f"/{endpoint}"
         return f"{self.base_url}{endpoint}"
 
+    @staticmethod
+    def _next_wait(deadline: Optional[float]) -> float:
+        if deadline is None:
+            return _LONG_POLL_WAIT
+        return max(0, min(_LONG_POLL_WAIT, deadline - time.monotonic()))
+
+    @staticmethod
+    def _get_deadline(timeout: Optional[float]) -> Optional[float]:
+        return None if timeout is None else time.monotonic() + timeout
+
 
 class BrowsyClient(BaseClient):
     def __init__(
@@ -22,15 +47,63 @@ class BrowsyClient(BaseClient):
         self._http_client = http_client or httpx.Client()
         super().__init__(base_url)
 
-    def create_job(self, name: str, parameters: Dict[str, Any]) -> Job:
+    def create_job(
+        self,
+        name: str,
+        parameters: Dict[str, Any],
+        priority: Optional[int] = None,
+    ) -> Job:
+        """Creates a job.
+
+        Pending jobs with higher `priority` are picked up first. If it's not
+        given, the priority defined by the job type is used.
+        """
+        request = {"name": name, "parameters": parameters}
+        if priority is not None:
+            request["priority"] = priority
         response = self._http_client.post(
-            self._build_url("/api/v1/jobs"),
-            json={"name": name, "parameters": parameters},
+            self._build_url("/api/v1/jobs"), json=request
         )
         response.raise_for_status()
 
         return Job(**response.json())
 
+    def create_jobs(self, jobs: List[Dict[str, Any]]) -> List[Job]:
+        """Creates many jobs at once.
+
+        Each job is a dict with `name` and `parameters` keys, and optionally
+        `priority`. Jobs are created atomically - if any of them is invalid, none is queued.
+        """
+        response = self._http_client.post(
+            self._build_url("/api/v1/jobs/batch"), json=jobs
+        )
+        response.raise_for_status()
+
+        return [Job(**j) for j in response.json()]
+
+    def list_jobs(
+        self,
+        status: Optional[JobStatus] = None,
+        name: Optional[str] = None,
+        limit: Optional[int] = None,
+        cursor: Optional[str] = None,
+    ) -> JobsPage:
+        """Lists jobs from the newest ones, a page at a time.
+
+        Pass `next_cursor` (or `prev_cursor`) of a page as `cursor` to get
+        the next (or previous) one.
+        """
+        params = {"status": status, "name": name, "limit": limit}
+        if cursor:
+            params["cursor"] = cursor
+        response = self._http_client.get(
+            self._build_url("/api/v1/jobs"),
+            params={k: v for k, v in params.items() if v is not None},
+        )
+        response.raise_for_status()
+
+        return JobsPage(**response.json())
+
     def get_job(self, job_id: str) -> Optional[Job]:
         response = self._http_client.get(
             self._build_url(f"/api/v1/jobs/{job_id}")
@@ -42,6 +115,24 @@ class BrowsyClient(BaseClient):
 
         return Job(**response.json())
 
+    def cancel_job(self, job_id: int) -> Optional[Job]:
+        """Cancels a pending job or interrupts a job in progress.
+
+        Returns:
+            The cancelled job, or None if it doesn't exist.
+
+        Raises:
+            httpx.HTTPStatusError: If the job is finished already.
+        """
+        response = self._http_client.post(
+            self._build_url(f"/api/v1/jobs/{job_id}/cancel")
+        )
+        if response.status_code == 404:
+            return None
+        response.raise_for_status()
+
+        return Job(**response.json())
+
     def get_job_output(self, job_id: int) -> Optional[bytes]:
         response = self._http_client.get(
             self._build_url(f"/api/v1/jobs/{job_id}/result")
@@ -53,6 +144,93 @@ class BrowsyClient(BaseClient):
 
         return response.content
 
+    def iter_job_output(
+        self, job_id: int, chunk_size: Optional[int] = None
+    ) -> Iterator[bytes]:
+        """Streams job's output in chunks without buffering it in memory.
+
+        Yields nothing if the output isn't available.
+        """
+        with self._http_client.stream(
+            "GET", self._build_url(f"/api/v1/jobs/{job_id}/result")
+        ) as response:
+            response.raise_for_status()
+
+            if response.status_code != 200:
+                return
+
+            yield from response.iter_bytes(chunk_size)
+
+    def wait_for_job(
+        self, job_id: int, timeout: Optional[float] = None
+    ) -> Optional[Job]:
+        """Waits until the job is finished.
+
+        The server holds each request until the job's status changes, so
+        this doesn't poll.
+
+        Args:
+            job_id: ID of the job.
+            timeout: Maximum number of seconds to wait, None to wait
+                indefinitely.
+
+        Returns:
+            The job in its last known state (which is unfinished if the
+            timeout passed), or None if it doesn't exist.
+        """
+        deadline = self._get_deadline(timeout)
+        while True:
+            wait = self._next_wait(deadline)
+            response = self._http_client.get(
+                self._build_url(f"/api/v1/jobs/{job_id}"),
+                params={"wait": wait},
+                timeout=wait + _LONG_POLL_MARGIN,
+            )
+            if response.status_code == 404:
+                return None
+            response.raise_for_status()
+
+            job = Job(**response.json())
+            if job.status.is_finished or wait == 0:
+                return job
+
+    def wait_for_result(
+        self, job_id: int, timeout: Optional[float] = None
+    ) -> Optional[bytes]:
+        """Waits until the job is finished and returns its output.
+
+        Returns:
+            Job's output, or None if it failed, doesn't exist or the timeout
+            passed.
+        """
+        job = self.wait_for_job(job_id, timeout)
+        if not job or not job.status.is_finished:
+            return None
+
+        return self.get_job_output(job_id)
+
+    def download_job_output(
+        self, job_id: int, path: Union[str, os.PathLike]
+    ) -> bool:
+        """Streams job's output into a file.
+
+        Returns:
+            True if the output was written, False if it isn't available.
+        """
+        with self._http_client.stream(
+            "GET", self._build_url(f"/api/v1/jobs/{job_id}/result")
+        ) as response:
+            response.raise_for_status()
+
+            if response.status_code != 200:
+                return False
+
+            with open(path, "wb") as f:
+                for chunk in response.iter_bytes():
+                    f.write(chunk)
+
+        return True
+
 
 class AsyncBrowsyClient(BaseClient):
     def __init__(
@@ -61,15 +239,63 @@ class AsyncBrowsyClient(BaseClient):
         self._http_client = http_client or httpx.AsyncClient()
         super().__init__(base_url)
 
-    async def create_job(self, name: str, parameters: Dict[str, Any]) -> Job:
+    async def create_job(
+        self,
+        name: str,
+        parameters: Dict[str, Any],
+        priority: Optional[int] = None,
+    ) -> Job:
+        """Creates a job.
+
+        Pending jobs with higher `priority` are picked up first. If it's not
+        given, the priority defined by the job type is used.
+        """
+        request = {"name": name, "parameters": parameters}
+        if priority is not None:
+            request["priority"] = priority
         response = await self._http_client.post(
-            self._build_url("/api/v1/jobs"),
-            json={"name": name, "parameters": parameters},
+            self._build_url("/api/v1/jobs"), json=request
         )
         response.raise_for_status()
 
         return Job(**response.json())
 
+    async def create_jobs(self, jobs: List[Dict[str, Any]]) -> List[Job]:
+        """Creates many jobs at once.
+
+        Each job is a dict with `name` and `parameters` keys, and optionally
+        `priority`. Jobs are created atomically - if any of them is invalid, none is queued.
+        """
+        response = await self._http_client.post(
+            self._build_url("/api/v1/jobs/batch"), json=jobs
+        )
+        response.raise_for_status()
+
+        return [Job(**j) for j in response.json()]
+
+    async def list_jobs(
+        self,
+        status: Optional[JobStatus] = None,
+        name: Optional[str] = None,
+        limit: Optional[int] = None,
+        cursor: Optional[str] = None,
+    ) -> JobsPage:
+        """Lists jobs from the newest ones, a page at a time.
+
+        Pass `next_cursor` (or `prev_cursor`) of a page as `cursor` to get
+        the next (or previous) one.
+        """
+        params = {"status": status, "name": name, "limit": limit}
+        if cursor:
+            params["cursor"] = cursor
+        response = await self._http_client.get(
+            self._build_url("/api/v1/jobs"),
+            params={k: v for k, v in params.items() if v is not None},
+        )
+        response.raise_for_status()
+
+        return JobsPage(**response.json())
+
     async def get_job(self, job_id: str) -> Optional[Job]:
         response = await self._http_client.get(
             self._build_url(f"/api/v1/jobs/{job_id}")
@@ -81,6 +307,24 @@ class AsyncBrowsyClient(BaseClient):
 
         return Job(**response.json())
 
+    async def cancel_job(self, job_id: int) -> Optional[Job]:
+        """Cancels a pending job or interrupts a job in progress.
+
+        Returns:
+            The cancelled job, or None if it doesn't exist.
+
+        Raises:
+            httpx.HTTPStatusError: If the job is finished already.
+        """
+        response = await self._http_client.post(
+            self._build_url(f"/api/v1/jobs/{job_id}/cancel")
+        )
+        if response.status_code == 404:
+            return None
+        response.raise_for_status()
+
+        return Job(**response.json())
+
     async def get_job_output(self, job_id: int) -> Optional[bytes]:
         response = await self._http_client.get(
             self._build_url(f"/api/v1/jobs/{job_id}/result")
@@ -91,3 +335,91 @@ class AsyncBrowsyClient(BaseClient):
             return None
 
         return response.content
+
+    async def iter_job_output(
+        self, job_id: int, chunk_size: Optional[int] = None
+    ) -> AsyncIterator[bytes]:
+        """Streams job's output in chunks without buffering it in memory.
+
+        Yields nothing if the output isn't available.
+        """
+        async with self._http_client.stream(
+            "GET", self._build_url(f"/api/v1/jobs/{job_id}/result")
+        ) as response:
+            response.raise_for_status()
+
+            if response.status_code != 200:
+                return
+
+            async for chunk in response.aiter_bytes(chunk_size):
+                yield chunk
+
+    async def wait_for_job(
+        self, job_id: int, timeout: Optional[float] = None
+    ) -> Optional[Job]:
+        """Waits until the job is finished.
+
+        The server holds each request until the job's status changes, so
+        this doesn't poll.
+
+        Args:
+            job_id: ID of the job.
+            timeout: Maximum number of seconds to wait, None to wait
+                indefinitely.
+
+        Returns:
+            The job in its last known state (which is unfinished if the
+            timeout passed), or None if it doesn't exist.
+        """
+        deadline = self._get_deadline(timeout)
+        while True:
+            wait = self._next_wait(deadline)
+            response = await self._http_client.get(
+                self._build_url(f"/api/v1/jobs/{job_id}"),
+                params={"wait": wait},
+                timeout=wait + _LONG_POLL_MARGIN,
+            )
+            if response.status_code == 404:
+                return None
+            response.raise_for_status()
+
+            job = Job(**response.json())
+            if job.status.is_finished or wait == 0:
+                return job
+
+    async def wait_for_result(
+        self, job_id: int, timeout: Optional[float] = None
+    ) -> Optional[bytes]:
+        """Waits until the job is finished and returns its output.
+
+        Returns:
+            Job's output, or None if it failed, doesn't exist or the timeout
+            passed.
+        """
+        job = await self.wait_for_job(job_id, timeout)
+        if not job or not job.status.is_finished:
+            return None
+
+        return await self.get_job_output(job_id)
+
+    async def download_job_output(
+        self, job_id: int, path: Union[str, os.PathLike]
+    ) -> bool:
+        """Streams job's output into a file.
+
+        Returns:
+            True if the output was written, False if it isn't available.
+        """
+        async with self._http_client.stream(
+            "GET", self._build_url(f"/api/v1/jobs/{job_id}/result")
+        ) as response:
+            response.raise_for_status()
+
+            if response.status_code != 200:
+                return False
+
+            with open(path, "wb") as f:
+                async for chunk in response.aiter_bytes():
+                    f.write(chunk)
+
+        return True
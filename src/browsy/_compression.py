@@ -0,0 +1,112 @@
+import gzip
+import logging
+import zlib
+from typing import Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover - optional dependency
+    zstandard = None
+
+GZIP = "gzip"
+ZSTD = "zstd"
+
+_zstd_fallback_logged = False
+
+# Formats that are compressed already and wouldn't get any smaller
+_COMPRESSED_SIGNATURES = (
+    b"\x89PNG\r\n\x1a\n",
+    b"\xff\xd8\xff",  # JPEG
+    b"GIF8",
+    b"\x1f\x8b",  # gzip
+    b"\x28\xb5\x2f\xfd",  # zstd
+    b"PK\x03\x04",  # zip
+)
+
+
+def is_supported(encoding: str) -> bool:
+    return encoding == GZIP or (encoding == ZSTD and zstandard is not None)
+
+
+def compress(
+    data: bytes, encoding: Optional[str]
+) -> Tuple[bytes, Optional[str]]:
+    """Compresses the data, unless it's pointless.
+
+    Returns:
+        The data to store and its content encoding (None if uncompressed).
+    """
+    if not encoding or not data or _is_compressed(data):
+        return data, None
+
+    if encoding == ZSTD and zstandard is None:
+        global _zstd_fallback_logged
+        if not _zstd_fallback_logged:
+            logger.warning(
+                "zstandard package isn't installed, falling back to gzip"
+            )
+            _zstd_fallback_logged = True
+        encoding = GZIP
+
+    if encoding == ZSTD:
+        compressed = zstandard.ZstdCompressor().compress(data)
+    elif encoding == GZIP:
+        compressed = gzip.compress(data, compresslevel=6)
+    else:
+        raise ValueError(f"Unsupported output compression {encoding!r}")
+
+    if len(compressed) >= len(data):
+        return data, None
+
+    return compressed, encoding
+
+
+class Decompressor:
+    """Incrementally decompresses a stream of chunks."""
+
+    def __init__(self, encoding: str) -> None:
+        if encoding == GZIP:
+            self._decompressor = zlib.decompressobj(wbits=16 + zlib.MAX_WBITS)
+        elif encoding == ZSTD and zstandard is not None:
+            self._decompressor = zstandard.ZstdDecompressor().decompressobj()
+        else:
+            raise ValueError(f"Unsupported content encoding {encoding!r}")
+
+    def decompress(self, chunk: bytes) -> bytes:
+        return self._decompressor.decompress(chunk)
+
+    def flush(self) -> bytes:
+        return self._decompressor.flush()
+
+
+def accepts_encoding(accept_encoding: Optional[str], encoding: str) -> bool:
+    """Checks if the `Accept-Encoding` header value allows the encoding."""
+    if not accept_encoding:
+        return False
+
+    for item in accept_encoding.split(","):
+        token, *params = item.split(";")
+        if token.strip().lower() not in (encoding, "*"):
+            continue
+
+        quality = 1.0
+        for param in params:
+            key, _, value = param.strip().partition("=")
+            if key == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+
+        return quality > 0
+
+    return False
+
+
+def _is_compressed(data: bytes) -> bool:
+    if data.startswith(_COMPRESSED_SIGNATURES):
+        return True
+    # WEBP is a RIFF container
+    return data[:4] == b"RIFF" and data[8:12] == b"WEBP"
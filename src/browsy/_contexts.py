@@ -0,0 +1,326 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import (
+    Any,
+    Deque,
+    Dict,
+    FrozenSet,
+    Iterable,
+    Literal,
+    Optional,
+    Tuple,
+    TYPE_CHECKING,
+)
+
+from playwright.async_api import (
+    Browser,
+    BrowserContext,
+    Page,
+    Route,
+    Error as PlaywrightError,
+)
+from pydantic import BaseModel, ConfigDict
+
+if TYPE_CHECKING:
+    # Requires the worker's dependencies, while profiles are public
+    from browsy._assets import AssetCache
+
+logger = logging.getLogger(__name__)
+
+# Recycled contexts slowly accumulate state that can't be reset (caches,
+# storage of visited origins), so they're replaced after this many jobs.
+_MAX_CONTEXT_USES = 100
+
+ResourceType = Literal[
+    "document",
+    "stylesheet",
+    "image",
+    "media",
+    "font",
+    "script",
+    "texttrack",
+    "xhr",
+    "fetch",
+    "eventsource",
+    "websocket",
+    "manifest",
+    "other",
+]
+
+# Stops CSS animations and transitions at their end state, so pages render
+# the same way every time without waiting for them
+_DISABLE_ANIMATIONS_SCRIPT = """
+(() => {
+    const style = document.createElement("style");
+    style.textContent = `*, *::before, *::after {
+        animation-delay: 0s !important;
+        animation-duration: 0s !important;
+        animation-iteration-count: 1 !important;
+        transition-delay: 0s !important;
+        transition-duration: 0s !important;
+        caret-color: transparent !important;
+    }`;
+    const inject = () => (document.head || document.documentElement)
+        .appendChild(style);
+    if (document.documentElement) {
+        inject();
+    } else {
+        document.addEventListener("DOMContentLoaded", inject);
+    }
+})();
+"""
+
+
+class ContextProfile(BaseModel):
+    """Settings of browser contexts a job runs in.
+
+    Jobs that only need the text or the layout of a page don't have to wait
+    for images, fonts or trackers, e.g. `ContextProfile(
+    blocked_resource_types={"image", "media", "font"},
+    blocked_urls=["**/analytics/**"])`. Profiles are compared by value, so
+    jobs with equal profiles share pooled contexts.
+    """
+
+    model_config = ConfigDict(frozen=True)
+
+    # Requests of these types are aborted before they're sent
+    blocked_resource_types: FrozenSet[ResourceType] = frozenset()
+    # Requests to URLs matching these glob patterns (e.g. "**/*.mp4") are
+    # aborted before they're sent
+    blocked_urls: Tuple[str, ...] = ()
+    javascript: bool = True
+    # Width and height of the page, in pixels. Playwright's default if None.
+    viewport: Optional[Tuple[int, int]] = None
+    # Disables CSS animations and transitions, and makes pages prefer
+    # reduced motion
+    disable_animations: bool = False
+
+    def context_options(self) -> Dict[str, Any]:
+        """Returns options of `Browser.new_context` for the profile."""
+        options: Dict[str, Any] = {}
+        if not self.javascript:
+            options["java_script_enabled"] = False
+        if self.viewport:
+            width, height = self.viewport
+            options["viewport"] = {"width": width, "height": height}
+        if self.disable_animations:
+            options["reduced_motion"] = "reduce"
+        return options
+
+    async def apply(self, context: BrowserContext) -> None:
+        """Sets up parts of the profile that aren't options of the context.
+
+        Routes are removed when a context is reset for another job, so they
+        have to be set up again then.
+        """
+        for pattern in self.blocked_urls:
+            await context.route(pattern, _abort)
+        if self.blocked_resource_types:
+            # The type isn't a part of the URL, so every request is checked
+            await context.route("**/*", self._block_resource_types)
+
+    async def _block_resource_types(self, route: Route) -> None:
+        if route.request.resource_type in self.blocked_resource_types:
+            await route.abort("blockedbyclient")
+        else:
+            await route.fallback()
+
+
+DEFAULT_PROFILE = ContextProfile()
+
+
+class PooledContext:
+    def __init__(
+        self, context: BrowserContext, page: Page, profile: ContextProfile
+    ) -> None:
+        self.context = context
+        self.page = page
+        self.profile = profile
+        self.uses = 0
+
+    async def close(self) -> None:
+        try:
+            await self.context.close()
+        except PlaywrightError:
+            # The browser might be gone already
+            logger.debug("Failed to close browser context", exc_info=True)
+
+
+class ContextPool:
+    """Keeps browser contexts with an open page ready for jobs.
+
+    Creating a context and a page takes a noticeable part of short jobs, so
+    the pool creates them ahead of time, in the background. Contexts that
+    were never used are handed out to jobs requiring isolation. Jobs that
+    allow it get a context recycled after a previous job instead, which
+    skips the setup altogether.
+
+    Contexts of different profiles can't be swapped, so up to `size` of them
+    are kept for each profile.
+    """
+
+    def __init__(
+        self,
+        browser: Browser,
+        size: int,
+        profiles: Iterable[ContextProfile] = (DEFAULT_PROFILE,),
+        asset_cache: Optional["AssetCache"] = None,
+    ) -> None:
+        self._browser = browser
+        self._size = size
+        self._asset_cache = asset_cache
+        self._fresh: Dict[ContextProfile, Deque[PooledContext]] = {
+            profile: deque() for profile in profiles
+        }
+        self._recycled: Dict[ContextProfile, Deque[PooledContext]] = {}
+        self._refill_task: Optional[asyncio.Task] = None
+
+    async def start(self) -> None:
+        """Fills the pool before the first job arrives."""
+        await self._refill()
+
+    async def acquire(
+        self,
+        profile: ContextProfile = DEFAULT_PROFILE,
+        reuse: bool = False,
+        timings: Optional[Dict[str, float]] = None,
+    ) -> PooledContext:
+        """Takes a context out of the pool.
+
+        Args:
+            profile: Profile the context has to be set up with.
+            reuse: Whether a context used by a previous job is acceptable.
+            timings: If given, milliseconds spent creating the context and
+                its page are saved there as "context" and "page" (zero if
+                the pool had one ready).
+        """
+        if timings is not None:
+            timings["context"] = timings["page"] = 0
+
+        recycled = self._recycled.get(profile)
+        if reuse and recycled:
+            return recycled.pop()
+
+        fresh = self._fresh.setdefault(profile, deque())
+        if fresh:
+            entry = fresh.popleft()
+        else:
+            entry = await self._create(profile, timings)
+
+        self._schedule_refill()
+        return entry
+
+    async def release(self, entry: PooledContext, reuse: bool) -> None:
+        """Returns the context to the pool, or closes it.
+
+        Args:
+            entry: Context taken out of the pool with `acquire`.
+            reuse: Whether the context can be handed out to another job.
+        """
+        entry.uses += 1
+        recycled = self._recycled.setdefault(entry.profile, deque())
+        if (
+            reuse
+            and entry.uses < _MAX_CONTEXT_USES
+            and len(recycled) < self._size
+            and not entry.page.is_closed()
+        ):
+            try:
+                await self._reset(entry)
+            except PlaywrightError:
+                logger.debug("Failed to reset browser context", exc_info=True)
+            else:
+                recycled.append(entry)
+                return
+
+        await entry.close()
+
+    async def resize(self, size: int) -> None:
+        """Changes the number of contexts kept ready, closing extra ones."""
+        self._size = size
+        for fresh in self._fresh.values():
+            while len(fresh) > size:
+                await fresh.pop().close()
+        for recycled in self._recycled.values():
+            while len(recycled) > size:
+                await recycled.popleft().close()
+        self._schedule_refill()
+
+    async def close(self) -> None:
+        if self._refill_task:
+            self._refill_task.cancel()
+            await asyncio.gather(self._refill_task, return_exceptions=True)
+            self._refill_task = None
+
+        for entries in (*self._fresh.values(), *self._recycled.values()):
+            while entries:
+                await entries.pop().close()
+
+    def _schedule_refill(self) -> None:
+        if self._refill_task is None or self._refill_task.done():
+            self._refill_task = asyncio.create_task(self._refill())
+
+    async def _refill(self) -> None:
+        try:
+            for profile, fresh in list(self._fresh.items()):
+                while len(fresh) < self._size:
+                    fresh.append(await self._create(profile))
+        except PlaywrightError:
+            # Jobs create their contexts on demand until the next refill
+            logger.warning(
+                "Failed to pre-create browser context", exc_info=True
+            )
+
+    async def _create(
+        self,
+        profile: ContextProfile,
+        timings: Optional[Dict[str, float]] = None,
+    ) -> PooledContext:
+        start = time.perf_counter()
+        context = await self._browser.new_context(**profile.context_options())
+        try:
+            if profile.disable_animations:
+                await context.add_init_script(_DISABLE_ANIMATIONS_SCRIPT)
+            await self._set_up_routes(context, profile)
+            context_created = time.perf_counter()
+            page = await context.new_page()
+        except BaseException:
+            await context.close()
+            raise
+        if timings is not None:
+            timings["context"] = _ms(context_created - start)
+            timings["page"] = _ms(time.perf_counter() - context_created)
+        return PooledContext(context, page, profile)
+
+    async def _set_up_routes(
+        self, context: BrowserContext, profile: ContextProfile
+    ) -> None:
+        # Routes of the profile are set up last, so blocked requests aren't
+        # fetched by the cache
+        if self._asset_cache:
+            await self._asset_cache.attach(context)
+        await profile.apply(context)
+
+    async def _reset(self, entry: PooledContext) -> None:
+        # Pages opened by the job (e.g. popups) are closed, only the main one
+        # stays
+        for page in entry.context.pages:
+            if page is not entry.page:
+                await page.close()
+
+        await entry.context.clear_cookies()
+        await entry.context.clear_permissions()
+        await entry.context.unroute_all(behavior="ignoreErrors")
+        await entry.page.unroute_all(behavior="ignoreErrors")
+        await self._set_up_routes(entry.context, entry.profile)
+        await entry.page.goto("about:blank")
+
+
+async def _abort(route: Route) -> None:
+    await route.abort("blockedbyclient")
+
+
+def _ms(seconds: float) -> float:
+    return round(seconds * 1000, 2)
@@ -1,10 +1,32 @@
+import asyncio
+import json
+from contextlib import asynccontextmanager
 from datetime import datetime
-from typing import Literal, Optional, List, Tuple
+from pathlib import Path
+from typing import (
+    AsyncIterator,
+    Collection,
+    Dict,
+    Iterable,
+    Literal,
+    Optional,
+    List,
+    Tuple,
+    Union,
+)
 
 import aiosqlite
 from pydantic import BaseModel
 
-from browsy import _models
+from browsy import _backend, _models, _storage
+from browsy._backend import (
+    DEFAULT_LEASE_DURATION,
+    HISTOGRAM_BUCKETS,
+    DBOutputInfo,
+    DBWorker,
+    QueueStats,
+    WorkerEventType,
+)
 
 AsyncConnection = aiosqlite.Connection
 
@@ -17,9 +39,48 @@ CREATE TABLE IF NOT EXISTS jobs (
     created_at DATETIME NOT NULL DEFAULT (strftime('%Y-%m-%d %H:%M:%f', 'now')),
     updated_at DATETIME,
     worker TEXT,
-    processing_time INTEGER
+    processing_time INTEGER,
+    cache_key TEXT,
+    timeout REAL,
+    lease_expires_at DATETIME,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    priority INTEGER NOT NULL DEFAULT 0,
+    timings TEXT,
+    output_size INTEGER
 );
 CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs(status);
+CREATE INDEX IF NOT EXISTS idx_jobs_created_at ON jobs(created_at, id);
+CREATE INDEX IF NOT EXISTS idx_jobs_status_created_at ON jobs(status, created_at, id);
+
+-- Number of jobs by name and status, kept up to date by the triggers below,
+-- so that totals don't require counting all rows
+CREATE TABLE IF NOT EXISTS job_counts (
+    name TEXT NOT NULL,
+    status TEXT NOT NULL,
+    count INTEGER NOT NULL,
+    PRIMARY KEY (name, status)
+);
+
+CREATE TRIGGER IF NOT EXISTS jobs_count_insert AFTER INSERT ON jobs
+BEGIN
+    INSERT INTO job_counts (name, status, count) VALUES (NEW.name, NEW.status, 1)
+    ON CONFLICT (name, status) DO UPDATE SET count = count + 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS jobs_count_delete AFTER DELETE ON jobs
+BEGIN
+    UPDATE job_counts SET count = count - 1
+    WHERE name = OLD.name AND status = OLD.status;
+END;
+
+CREATE TRIGGER IF NOT EXISTS jobs_count_update AFTER UPDATE OF status ON jobs
+WHEN OLD.status != NEW.status
+BEGIN
+    UPDATE job_counts SET count = count - 1
+    WHERE name = OLD.name AND status = OLD.status;
+    INSERT INTO job_counts (name, status, count) VALUES (NEW.name, NEW.status, 1)
+    ON CONFLICT (name, status) DO UPDATE SET count = count + 1;
+END;
 
 CREATE TABLE IF NOT EXISTS workers (
     id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -33,11 +94,137 @@ CREATE TABLE IF NOT EXISTS outputs (
     id INTEGER PRIMARY KEY AUTOINCREMENT,
     job_id INTEGER NOT NULL,
     output BLOB,
+    path TEXT,
+    hash TEXT,
+    size INTEGER,
+    encoding TEXT,
     FOREIGN KEY (job_id) REFERENCES jobs (id)
 );
 CREATE INDEX IF NOT EXISTS idx_outputs_job_id ON outputs(job_id);
+
+CREATE TABLE IF NOT EXISTS cache_entries (
+    key TEXT PRIMARY KEY,
+    job_id INTEGER NOT NULL,
+    expires_at DATETIME NOT NULL,
+    FOREIGN KEY (job_id) REFERENCES jobs (id)
+);
+CREATE INDEX IF NOT EXISTS idx_cache_entries_expires_at ON cache_entries(expires_at);
+
+CREATE TABLE IF NOT EXISTS worker_events (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    worker TEXT NOT NULL,
+    event TEXT NOT NULL,
+    created_at DATETIME NOT NULL DEFAULT (strftime('%Y-%m-%d %H:%M:%f', 'now')),
+    browser_memory INTEGER,
+    browser_jobs INTEGER,
+    browser_age REAL,
+    reason TEXT,
+    slots INTEGER
+);
+CREATE INDEX IF NOT EXISTS idx_worker_events_worker ON worker_events(worker, event);
 """
 
+# Columns added after the tables were first released. They're added to
+# databases created by older versions when the server starts.
+_COLUMN_MIGRATIONS = (
+    ("jobs", "cache_key", "TEXT"),
+    ("jobs", "timeout", "REAL"),
+    ("jobs", "lease_expires_at", "DATETIME"),
+    ("jobs", "attempts", "INTEGER NOT NULL DEFAULT 0"),
+    ("jobs", "priority", "INTEGER NOT NULL DEFAULT 0"),
+    ("jobs", "timings", "TEXT"),
+    ("jobs", "output_size", "INTEGER"),
+    ("outputs", "path", "TEXT"),
+    ("outputs", "hash", "TEXT"),
+    ("outputs", "size", "INTEGER"),
+    ("outputs", "encoding", "TEXT"),
+    ("worker_events", "slots", "INTEGER"),
+)
+
+# Indexes on migrated columns, created once the columns exist
+_MIGRATED_INDEXES_SQL = """
+CREATE INDEX IF NOT EXISTS idx_jobs_lease ON jobs(status, lease_expires_at);
+-- Pending jobs in the order they're claimed, by all workers and by workers
+-- serving only some job types
+CREATE INDEX IF NOT EXISTS idx_jobs_queue ON jobs(status, priority DESC, created_at, id);
+CREATE INDEX IF NOT EXISTS idx_jobs_queue_by_name ON jobs(status, name, priority DESC, created_at, id);
+CREATE INDEX IF NOT EXISTS idx_outputs_path ON outputs(path);
+"""
+
+
+def _bucket_of(value: str) -> str:
+    cases = " ".join(
+        f"WHEN {value} <= {b} THEN {b}" for b in HISTOGRAM_BUCKETS
+    )
+    return f"CASE {cases} ELSE 9e999 END"  # 9e999 is infinity
+
+
+# Cumulative counters and histograms of job events by job name, kept by the
+# triggers below, so metrics never have to read the jobs themselves. Unlike
+# `job_counts`, they aren't decreased when jobs are deleted. Counters are
+# stored with bucket 0 and named after the event ('submitted', or the status
+# the job got), histograms have a row for each (non-cumulative) bucket.
+_METRICS_SQL = f"""
+CREATE TABLE IF NOT EXISTS job_metrics (
+    name TEXT NOT NULL,
+    metric TEXT NOT NULL,
+    bucket REAL NOT NULL DEFAULT 0,
+    count INTEGER NOT NULL,
+    sum REAL NOT NULL DEFAULT 0,
+    PRIMARY KEY (name, metric, bucket)
+);
+
+CREATE TRIGGER IF NOT EXISTS jobs_metrics_insert AFTER INSERT ON jobs
+BEGIN
+    INSERT INTO job_metrics (name, metric, count) VALUES (NEW.name, 'submitted', 1)
+    ON CONFLICT (name, metric, bucket) DO UPDATE SET count = count + 1;
+    -- Cache hits are finished as soon as they're submitted
+    INSERT INTO job_metrics (name, metric, count)
+    SELECT NEW.name, NEW.status, 1 WHERE NEW.status != '{_models.JobStatus.PENDING.value}'
+    ON CONFLICT (name, metric, bucket) DO UPDATE SET count = count + 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS jobs_metrics_update AFTER UPDATE OF status ON jobs
+WHEN OLD.status != NEW.status
+BEGIN
+    INSERT INTO job_metrics (name, metric, count) VALUES (NEW.name, NEW.status, 1)
+    ON CONFLICT (name, metric, bucket) DO UPDATE SET count = count + 1;
+
+    INSERT INTO job_metrics (name, metric, bucket, count, sum)
+    SELECT NEW.name, 'queue_wait', {_bucket_of("v")}, 1, v
+    FROM (SELECT (julianday(NEW.updated_at) - julianday(NEW.created_at)) * 86400 AS v)
+    WHERE NEW.status = '{_models.JobStatus.IN_PROGRESS.value}'
+    ON CONFLICT (name, metric, bucket) DO UPDATE SET count = count + 1, sum = sum + excluded.sum;
+
+    INSERT INTO job_metrics (name, metric, bucket, count, sum)
+    SELECT NEW.name, 'processing_time', {_bucket_of("v")}, 1, v
+    FROM (SELECT NEW.processing_time / 1000.0 AS v)
+    WHERE NEW.status IN (
+        '{_models.JobStatus.DONE.value}', '{_models.JobStatus.FAILED.value}', '{_models.JobStatus.TIMED_OUT.value}'
+    ) AND v IS NOT NULL
+    ON CONFLICT (name, metric, bucket) DO UPDATE SET count = count + 1, sum = sum + excluded.sum;
+END;
+"""
+
+# Columns of `_models.Job`
+_JOB_COLUMNS = (
+    "id, name, input, status, created_at, updated_at, worker, processing_time,"
+    " timeout, attempts, priority, timings, output_size"
+)
+
+# SQLite has a limit of variables in a single statement
+_MAX_QUERY_VARIABLES = 500
+
+# Applied to every connection. NORMAL synchronous mode is safe with WAL
+# (a power loss may drop the last transactions, but never corrupts the file)
+# and avoids an fsync on every commit.
+_CONNECTION_PRAGMAS = (
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA busy_timeout = 5000",
+    "PRAGMA cache_size = -16384",  # KiB
+    "PRAGMA mmap_size = 268435456",  # bytes
+)
+
 
 class DBOutput(BaseModel):
     id: int
@@ -45,28 +232,106 @@ class DBOutput(BaseModel):
     output: Optional[bytes]
 
 
-class DBWorker(BaseModel):
-    id: int
-    name: str
-    last_check_in_time: datetime
-    last_activity_time: datetime
-
-    @property
-    def uptime(self) -> datetime:
-        return datetime.now()
+async def create_connection(
+    db_path: str, read_only: bool = False
+) -> AsyncConnection:
+    if read_only:
+        uri = f"{Path(db_path).absolute().as_uri()}?mode=ro"
+        conn = await aiosqlite.connect(uri, uri=True)
+    else:
+        conn = await aiosqlite.connect(db_path)
+    conn.row_factory = aiosqlite.Row
 
+    for pragma in _CONNECTION_PRAGMAS:
+        await conn.execute(pragma)
 
-async def create_connection(db_path: str) -> AsyncConnection:
-    conn = await aiosqlite.connect(db_path)
-    conn.row_factory = aiosqlite.Row
     return conn
 
 
+class ConnectionPool:
+    """Fixed-size pool of long-lived connections to the database.
+
+    Connections are opened once by `open` and handed out by `connection`,
+    which waits if all of them are in use.
+    """
+
+    def __init__(self, db_path: str, size: int, read_only: bool = False):
+        if size < 1:
+            raise ValueError("Connection pool size must be at least 1")
+
+        self._db_path = db_path
+        self._size = size
+        self._read_only = read_only
+        self._connections: List[AsyncConnection] = []
+        self._idle: "asyncio.Queue[AsyncConnection]" = asyncio.Queue()
+
+    async def open(self) -> None:
+        for _ in range(self._size):
+            conn = await create_connection(self._db_path, self._read_only)
+            self._connections.append(conn)
+            self._idle.put_nowait(conn)
+
+    async def close(self) -> None:
+        for conn in self._connections:
+            await conn.close()
+        self._connections.clear()
+
+    @asynccontextmanager
+    async def connection(self) -> AsyncIterator[AsyncConnection]:
+        conn = await self._idle.get()
+        try:
+            yield conn
+        finally:
+            # Don't leak a transaction left open by an interrupted request
+            if conn.in_transaction:
+                await conn.rollback()
+            self._idle.put_nowait(conn)
+
+
 async def init_db(conn: AsyncConnection) -> None:
+    # Lets the space of deleted rows be returned to the filesystem. It only
+    # takes effect for new databases, existing ones have to be vacuumed once.
+    await conn.execute("PRAGMA auto_vacuum = INCREMENTAL;")
     await conn.execute("PRAGMA journal_mode = WAL;")
     await conn.commit()
 
     await conn.executescript(_INIT_SQL)
+    await conn.executescript(_METRICS_SQL)
+    await conn.commit()
+
+    await _migrate_columns(conn)
+
+    await conn.executescript(_MIGRATED_INDEXES_SQL)
+    await conn.commit()
+
+    await _init_job_counts(conn)
+
+
+async def _init_job_counts(conn: AsyncConnection) -> None:
+    # Jobs created before the counters existed are counted once
+    await conn.execute("BEGIN IMMEDIATE")
+    async with conn.execute("SELECT EXISTS (SELECT 1 FROM job_counts)") as c:
+        initialized = (await c.fetchone())[0]
+    if not initialized:
+        await conn.execute(
+            """
+            INSERT INTO job_counts (name, status, count)
+            SELECT name, status, COUNT(*) FROM jobs GROUP BY name, status
+            """
+        )
+    await conn.commit()
+
+
+async def _migrate_columns(conn: AsyncConnection) -> None:
+    for table, column, definition in _COLUMN_MIGRATIONS:
+        async with conn.execute(f"PRAGMA table_info({table})") as cursor:
+            columns = {r["name"] for r in await cursor.fetchall()}
+
+        if column not in columns:
+            await conn.execute(
+                f"ALTER TABLE {table} ADD COLUMN {column} {definition}"
+            )
+
     await conn.commit()
 
 
@@ -74,14 +339,32 @@ async def create_job(
     conn: AsyncConnection,
     name: str,
     input_json: str,
+    cache_key: Optional[str] = None,
+    timeout: Optional[float] = None,
+    priority: int = 0,
 ) -> _models.Job:
+    """Queues a new job.
+
+    If the cache key matches a fresh cache entry, the job is finished right
+    away instead, and reuses the output of the cached job. `timeout`
+    (seconds) overrides the default timeout of the job type. Pending jobs
+    with higher `priority` are claimed first.
+    """
+    if cache_key:
+        # Cache lookup and insert have to happen in the same transaction
+        jobs = await create_jobs(
+            conn,
+            [_backend.NewJob(name, input_json, cache_key, timeout, priority)],
+        )
+        return jobs[0]
+
     async with conn.execute(
         """
-        INSERT INTO jobs (name, input, status)
-        VALUES (?, ?, ?)
-        RETURNING id, created_at, updated_at, worker, processing_time
+        INSERT INTO jobs (name, input, status, timeout, priority)
+        VALUES (?, ?, ?, ?, ?)
+        RETURNING id, created_at, updated_at, worker, processing_time, timeout, priority
         """,
-        (name, input_json, _models.JobStatus.PENDING),
+        (name, input_json, _models.JobStatus.PENDING, timeout, priority),
     ) as cursor:
         result = await cursor.fetchone()
 
@@ -95,13 +378,344 @@ async def create_job(
     )
 
 
+async def create_jobs(
+    conn: AsyncConnection,
+    jobs: List[_backend.NewJob],
+) -> List[_models.Job]:
+    """Inserts many jobs.
+
+    All jobs are inserted in a single transaction with one commit. Cache
+    hits are handled the same way as in `create_job`. Jobs are returned in
+    the same order as they were given.
+    """
+    if not jobs:
+        return []
+
+    # The reserved lock guarantees no other inserts interleave, so the
+    # AUTOINCREMENT ids of the inserted rows are consecutive.
+    await conn.execute("BEGIN IMMEDIATE")
+
+    cached = await _get_cached_job_ids(
+        conn, {cache_key for _, _, cache_key, _, _ in jobs if cache_key}
+    )
+    queued = [j for j in jobs if j[2] not in cached]
+
+    queued_ids = iter([])
+    if queued:
+        await conn.executemany(
+            """
+            INSERT INTO jobs (name, input, status, cache_key, timeout, priority)
+            VALUES (?, ?, ?, ?, ?, ?)
+            """,
+            [
+                (
+                    name,
+                    input_json,
+                    _models.JobStatus.PENDING,
+                    cache_key,
+                    timeout,
+                    priority,
+                )
+                for name, input_json, cache_key, timeout, priority in queued
+            ],
+        )
+
+        async with conn.execute("SELECT last_insert_rowid()") as cursor:
+            last_id = (await cursor.fetchone())[0]
+        queued_ids = iter(range(last_id - len(queued) + 1, last_id + 1))
+
+    ids = []
+    for name, input_json, cache_key, _, priority in jobs:
+        if cache_key in cached:
+            ids.append(
+                await _insert_cached_job(
+                    conn,
+                    name,
+                    input_json,
+                    cache_key,
+                    priority,
+                    cached[cache_key],
+                )
+            )
+        else:
+            ids.append(next(queued_ids))
+
+    async with conn.execute(
+        f"""
+        SELECT {_JOB_COLUMNS}
+        FROM jobs
+        WHERE id BETWEEN ? AND ?
+        """,
+        (min(ids), max(ids)),
+    ) as cursor:
+        result = await cursor.fetchall()
+
+    await conn.commit()
+
+    db_jobs = {r["id"]: _models.Job(**r) for r in result}
+    return [db_jobs[id_] for id_ in ids]
+
+
+async def _get_cached_job_ids(
+    conn: AsyncConnection, cache_keys: Iterable[str]
+) -> Dict[str, int]:
+    cache_keys = list(cache_keys)
+    cached = {}
+
+    for i in range(0, len(cache_keys), _MAX_QUERY_VARIABLES):
+        chunk = cache_keys[i : i + _MAX_QUERY_VARIABLES]
+        async with conn.execute(
+            f"""
+            SELECT key, job_id
+            FROM cache_entries
+            WHERE key IN ({", ".join("?" * len(chunk))})
+                AND expires_at > strftime('%Y-%m-%d %H:%M:%f', 'now')
+            """,
+            chunk,
+        ) as cursor:
+            cached.update(
+                {r["key"]: r["job_id"] for r in await cursor.fetchall()}
+            )
+
+    return cached
+
+
+async def _insert_cached_job(
+    conn: AsyncConnection,
+    name: str,
+    input_json: str,
+    cache_key: str,
+    priority: int,
+    cached_job_id: int,
+) -> int:
+    async with conn.execute(
+        f"""
+        INSERT INTO jobs (name, input, status, updated_at, processing_time, cache_key, priority)
+        VALUES (?, ?, '{_models.JobStatus.DONE.value}', strftime('%Y-%m-%d %H:%M:%f', 'now'), 0, ?, ?)
+        RETURNING id
+        """,
+        (name, input_json, cache_key, priority),
+    ) as cursor:
+        job_id = (await cursor.fetchone())[0]
+
+    # Outputs in the output store are shared by reference, BLOBs are copied
+    await conn.execute(
+        """
+        INSERT INTO outputs (job_id, output, path, hash, size, encoding)
+        SELECT ?, output, path, hash, size, encoding
+        FROM outputs
+        WHERE job_id = ?
+        """,
+        (job_id, cached_job_id),
+    )
+
+    return job_id
+
+
+async def evict_cache_entries(conn: AsyncConnection) -> int:
+    """Removes expired cache entries. Returns the number of removed ones."""
+    async with conn.execute(
+        """
+        DELETE FROM cache_entries
+        WHERE expires_at <= strftime('%Y-%m-%d %H:%M:%f', 'now')
+        """
+    ) as cursor:
+        evicted = cursor.rowcount
+
+    await conn.commit()
+
+    return evicted
+
+
+def _finished_jobs_filter(
+    name: Optional[str], status: Optional[_models.JobStatus]
+) -> Tuple[str, list]:
+    statuses = (
+        [status]
+        if status
+        else [s.value for s in _models.JobStatus if s.is_finished]
+    )
+    where = f"status IN ({', '.join('?' * len(statuses))})"
+    args = list(statuses)
+    if name:
+        where += " AND name = ?"
+        args.append(name)
+    return where, args
+
+
+async def get_expired_job_ids(
+    conn: AsyncConnection,
+    max_age: float,
+    limit: int,
+    name: Optional[str] = None,
+    status: Optional[_models.JobStatus] = None,
+) -> List[int]:
+    """Returns IDs of finished jobs created more than `max_age` seconds ago.
+
+    Jobs can be narrowed down to the ones with the given name and status.
+    """
+    where, args = _finished_jobs_filter(name, status)
+    async with conn.execute(
+        f"""
+        SELECT id FROM jobs
+        WHERE {where} AND created_at < strftime('%Y-%m-%d %H:%M:%f', 'now', ?)
+        ORDER BY id ASC
+        LIMIT ?
+        """,
+        (*args, f"-{max_age} seconds", limit),
+    ) as cursor:
+        return [r[0] for r in await cursor.fetchall()]
+
+
+async def get_excess_job_ids(
+    conn: AsyncConnection,
+    max_count: int,
+    limit: int,
+    name: Optional[str] = None,
+    status: Optional[_models.JobStatus] = None,
+) -> List[int]:
+    """Returns IDs of finished jobs beyond the `max_count` newest ones.
+
+    Jobs can be narrowed down to the ones with the given name and status.
+    """
+    where, args = _finished_jobs_filter(name, status)
+    async with conn.execute(
+        f"""
+        SELECT id FROM jobs
+        WHERE {where}
+        ORDER BY id DESC
+        LIMIT ? OFFSET ?
+        """,
+        (*args, limit, max_count),
+    ) as cursor:
+        return [r[0] for r in await cursor.fetchall()]
+
+
+async def delete_jobs(conn: AsyncConnection, ids: List[int]) -> List[str]:
+    """Deletes finished jobs along with their outputs and cache entries.
+
+    Returns:
+        Paths of the deleted outputs in the output store. The files might
+        still be used by other jobs, see `is_output_path_used`.
+    """
+    if not ids:
+        return []
+
+    await conn.execute("BEGIN IMMEDIATE")
+
+    paths = []
+    for i in range(0, len(ids), _MAX_QUERY_VARIABLES):
+        chunk = ids[i : i + _MAX_QUERY_VARIABLES]
+        placeholders = ", ".join("?" * len(chunk))
+        # Jobs that are not finished (anymore) are left alone
+        async with conn.execute(
+            f"""
+            DELETE FROM jobs
+            WHERE id IN ({placeholders})
+                AND status NOT IN ('{_models.JobStatus.PENDING.value}', '{_models.JobStatus.IN_PROGRESS.value}')
+            RETURNING id
+            """,
+            chunk,
+        ) as cursor:
+            deleted = [r[0] for r in await cursor.fetchall()]
+        if not deleted:
+            continue
+
+        placeholders = ", ".join("?" * len(deleted))
+        await conn.execute(
+            f"DELETE FROM cache_entries WHERE job_id IN ({placeholders})",
+            deleted,
+        )
+        async with conn.execute(
+            f"""
+            DELETE FROM outputs
+            WHERE job_id IN ({placeholders})
+            RETURNING path
+            """,
+            deleted,
+        ) as cursor:
+            paths.extend(r[0] for r in await cursor.fetchall() if r[0])
+
+    await conn.commit()
+
+    return paths
+
+
+async def is_output_path_used(conn: AsyncConnection, path: str) -> bool:
+    async with conn.execute(
+        "SELECT 1 FROM outputs WHERE path = ? LIMIT 1", (path,)
+    ) as cursor:
+        return await cursor.fetchone() is not None
+
+
+async def delete_worker_events(
+    conn: AsyncConnection, max_age: float, limit: int
+) -> int:
+    """Deletes a batch of worker events older than `max_age` seconds.
+
+    Returns:
+        Number of deleted events.
+    """
+    async with conn.execute(
+        """
+        DELETE FROM worker_events
+        WHERE id IN (
+            SELECT id FROM worker_events
+            WHERE created_at < strftime('%Y-%m-%d %H:%M:%f', 'now', ?)
+            ORDER BY id ASC
+            LIMIT ?
+        )
+        """,
+        (f"-{max_age} seconds", limit),
+    ) as cursor:
+        deleted = cursor.rowcount
+
+    await conn.commit()
+
+    return deleted
+
+
+async def reclaim_free_pages(conn: AsyncConnection, max_pages: int) -> int:
+    """Returns up to `max_pages` unused pages of the file to the filesystem.
+
+    Only works with incremental auto-vacuum.
+
+    Returns:
+        Number of unused pages left.
+    """
+    async with conn.execute("PRAGMA auto_vacuum") as cursor:
+        if (await cursor.fetchone())[0] != 2:  # INCREMENTAL
+            return 0
+
+    # Each step of the statement frees a single page
+    async with conn.execute(
+        f"PRAGMA incremental_vacuum({int(max_pages)})"
+    ) as cursor:
+        await cursor.fetchall()
+    await conn.commit()
+
+    async with conn.execute("PRAGMA freelist_count") as cursor:
+        return (await cursor.fetchone())[0]
+
+
+async def checkpoint_wal(conn: AsyncConnection) -> bool:
+    """Copies the WAL into the database and truncates it.
+
+    Returns:
+        False if the checkpoint couldn't finish because of other connections.
+    """
+    async with conn.execute("PRAGMA wal_checkpoint(TRUNCATE)") as cursor:
+        busy, _, _ = await cursor.fetchone()
+    return not busy
+
+
 async def get_job_by_id(
     conn: AsyncConnection,
     id_: int,
 ) -> Optional[_models.Job]:
     async with conn.execute(
-        """
-        SELECT id, name, input, status, created_at, updated_at, worker, processing_time
+        f"""
+        SELECT {_JOB_COLUMNS}
         FROM jobs
         WHERE id = ?
         """,
@@ -112,95 +726,430 @@ async def get_job_by_id(
     return _models.Job(**result) if result else None
 
 
-async def get_job_result_by_job_id(
+async def get_jobs_by_ids(
+    conn: AsyncConnection,
+    ids: Iterable[int],
+) -> List[_models.Job]:
+    ids = list(ids)
+    jobs = []
+
+    for i in range(0, len(ids), _MAX_QUERY_VARIABLES):
+        chunk = ids[i : i + _MAX_QUERY_VARIABLES]
+        async with conn.execute(
+            f"""
+            SELECT {_JOB_COLUMNS}
+            FROM jobs
+            WHERE id IN ({", ".join("?" * len(chunk))})
+            """,
+            chunk,
+        ) as cursor:
+            jobs.extend(_models.Job(**r) for r in await cursor.fetchall())
+
+    return jobs
+
+
+async def get_job_output_info(
     conn: AsyncConnection,
     job_id: int,
-) -> Optional[bytes]:
+) -> Optional[DBOutputInfo]:
+    """Returns job's output metadata without reading the output itself."""
     async with conn.execute(
         """
-        SELECT id, job_id, output
+        SELECT id, job_id, COALESCE(size, length(output)) AS size, path, hash, encoding
         FROM outputs
-        WHERE job_id = ?
+        WHERE job_id = ? AND (output IS NOT NULL OR path IS NOT NULL)
         """,
         (job_id,),
     ) as cursor:
         result = await cursor.fetchone()
 
-    return result["output"] if result else None
+    return DBOutputInfo(**result) if result else None
 
 
-async def get_next_job(
-    conn: AsyncConnection, worker: str
-) -> Optional[_models.Job]:
-    # Acquires a reserved lock, blocking other write transactions
-    await conn.execute("BEGIN IMMEDIATE")
+async def read_output_chunk(
+    conn: AsyncConnection,
+    output_id: int,
+    offset: int,
+    size: int,
+) -> bytes:
+    """Reads a part of the output, so it's never loaded into Python whole."""
+    async with conn.execute(
+        """
+        SELECT substr(output, ?, ?)
+        FROM outputs
+        WHERE id = ?
+        """,
+        (offset + 1, size, output_id),
+    ) as cursor:
+        result = await cursor.fetchone()
+
+    return result[0] if result else b""
+
+
+async def has_pending_jobs(
+    conn: AsyncConnection, names: Optional[Collection[str]] = None
+) -> bool:
+    """Checks for pending jobs without taking any write lock.
+
+    Args:
+        names: If given, only jobs of these types are considered.
+    """
+    params = []
+    name_filter = ""
+    if names:
+        params = list(names)
+        name_filter = f"AND name IN ({', '.join('?' * len(params))})"
 
     async with conn.execute(
         f"""
-        SELECT id, name, input, status, created_at, updated_at, worker, processing_time
-        FROM jobs
-        WHERE status = '{_models.JobStatus.PENDING.value}'
-        ORDER BY created_at ASC
-        LIMIT 1
-        """
+        SELECT EXISTS(
+            SELECT 1 FROM jobs WHERE status = '{_models.JobStatus.PENDING.value}' {name_filter}
+        )
+        """,
+        params,
     ) as cursor:
         result = await cursor.fetchone()
 
-    if not result:
-        # Releases the lock
-        await conn.rollback()
-        return None
+    return bool(result[0])
 
-    db_job = _models.Job(**result)
 
-    await conn.execute(
+async def get_queue_stats(
+    conn: AsyncConnection, names: Optional[Collection[str]] = None
+) -> QueueStats:
+    """Returns the number of pending jobs and how long the oldest waits.
+
+    The number comes from `job_counts` and the oldest job from the index on
+    status and creation time, so neither scans the queue.
+
+    Args:
+        names: If given, only jobs of these types are considered.
+    """
+    params = []
+    name_filter = ""
+    if names:
+        params = list(names)
+        name_filter = f"AND name IN ({', '.join('?' * len(params))})"
+    pending = _models.JobStatus.PENDING.value
+
+    async with conn.execute(
         f"""
-        UPDATE jobs
-        SET status = '{_models.JobStatus.IN_PROGRESS.value}', updated_at = strftime('%Y-%m-%d %H:%M:%f', 'now'), worker = ?
-        WHERE id = ?
+        SELECT
+            (
+                SELECT COALESCE(SUM(count), 0) FROM job_counts
+                WHERE status = '{pending}' {name_filter}
+            ),
+            (
+                SELECT (julianday('now') - julianday(created_at)) * 86400
+                FROM jobs
+                WHERE status = '{pending}' {name_filter}
+                ORDER BY created_at
+                LIMIT 1
+            )
         """,
-        (worker, db_job.id),
+        params * 2,
+    ) as cursor:
+        count, oldest_age = await cursor.fetchone()
+
+    return QueueStats(count, oldest_age)
+
+
+def _next_pending_jobs_query(
+    names: Optional[Collection[str]], limit: int
+) -> Tuple[str, list]:
+    order = "ORDER BY priority DESC, created_at ASC, id ASC"
+    pending = f"status = '{_models.JobStatus.PENDING.value}'"
+    if not names:
+        return f"SELECT id FROM jobs WHERE {pending} {order} LIMIT ?", [limit]
+
+    # Every job type is read from its own range of the index and only the
+    # heads of these ranges are merged, so the query never scans all pending
+    # jobs of the types the worker doesn't serve (unlike `name IN (...)`,
+    # which would have to sort them).
+    by_name = " UNION ALL ".join(
+        f"""
+        SELECT * FROM (
+            SELECT id, priority, created_at FROM jobs
+            WHERE {pending} AND name = ? {order} LIMIT ?
+        )
+        """
+        for _ in names
     )
+    params = []
+    for name in names:
+        params.extend((name, limit))
+    params.append(limit)
+    return f"SELECT id FROM ({by_name}) {order} LIMIT ?", params
+
+
+async def claim_jobs(
+    conn: AsyncConnection,
+    worker: str,
+    limit: int,
+    lease_duration: float = DEFAULT_LEASE_DURATION,
+    names: Optional[Collection[str]] = None,
+) -> List[_models.Job]:
+    """Atomically assigns up to `limit` next pending jobs to the worker.
+
+    Jobs with the highest priority are claimed first, oldest first among
+    jobs with the same priority. If `names` are given, only jobs of these
+    types are claimed.
+
+    Jobs are selected and marked as in progress by a single statement, so
+    the write lock is held only as long as it takes to claim the whole batch.
+    The worker holds a lease on the claimed jobs for `lease_duration`
+    seconds, and has to extend it with `extend_leases` while it works on
+    them. Jobs with expired leases are taken back by `requeue_expired_jobs`.
+    """
+    next_jobs, next_jobs_params = _next_pending_jobs_query(names, limit)
+
+    # Acquires a reserved lock upfront. A deferred transaction could fail
+    # with SQLITE_BUSY_SNAPSHOT without waiting for the busy timeout.
+    await conn.execute("BEGIN IMMEDIATE")
+
+    async with conn.execute(
+        f"""
+        UPDATE jobs
+        SET status = '{_models.JobStatus.IN_PROGRESS.value}', updated_at = strftime('%Y-%m-%d %H:%M:%f', 'now'), worker = ?,
+            lease_expires_at = strftime('%Y-%m-%d %H:%M:%f', 'now', ?), attempts = attempts + 1
+        WHERE id IN ({next_jobs})
+        RETURNING {_JOB_COLUMNS}
+        """,
+        (worker, f"+{lease_duration} seconds", *next_jobs_params),
+    ) as cursor:
+        result = await cursor.fetchall()
+
+    if not result:
+        # Releases the lock
+        await conn.rollback()
+        return []
 
     await update_worker_activity(conn, worker, commit=False)
 
     await conn.commit()
-    db_job.status = _models.JobStatus.IN_PROGRESS
-    db_job.worker = worker
 
-    return db_job
+    # RETURNING doesn't guarantee any order of rows
+    jobs = [_models.Job(**r) for r in result]
+    jobs.sort(key=lambda j: (-j.priority, j.created_at, j.id))
+
+    return jobs
 
 
 async def update_job_status(
     conn: AsyncConnection,
     worker: str,
     job_id: int,
-    status: Literal[_models.JobStatus.DONE, _models.JobStatus.FAILED],
+    status: Literal[
+        _models.JobStatus.DONE,
+        _models.JobStatus.FAILED,
+        _models.JobStatus.TIMED_OUT,
+    ],
     processing_time: int,
-    output: Optional[bytes],
+    output: Union[bytes, _storage.StoredOutput, None],
+    output_encoding: Optional[str] = None,
+    cache_ttl: Optional[int] = None,
+    timings: Optional[Dict[str, float]] = None,
+    output_size: Optional[int] = None,
+) -> bool:
+    """Finishes the job and saves its output.
+
+    The output is either the content, stored as a BLOB, or a reference to
+    a file already saved in the output store. `output_encoding` tells how
+    the content was compressed, if it was, and `output_size` is its size
+    before compression. If `cache_ttl` (seconds) is given, a done job
+    becomes a cache entry for jobs with the same cache key. `timings` are
+    milliseconds spent in each phase of processing.
+
+    Returns:
+        False if the job isn't in progress by the worker anymore (e.g. it was
+        cancelled), in which case nothing is saved.
+    """
+    async with conn.execute(
+        f"""
+        UPDATE jobs
+        SET status = ?, updated_at = strftime('%Y-%m-%d %H:%M:%f', 'now'), processing_time = ?,
+            timings = ?, output_size = ?
+        WHERE id = ? AND status = '{_models.JobStatus.IN_PROGRESS.value}' AND worker = ?
+        """,
+        (
+            status,
+            processing_time,
+            json.dumps(timings) if timings else None,
+            output_size,
+            job_id,
+            worker,
+        ),
+    ) as cursor:
+        updated = cursor.rowcount > 0
+
+    if not updated:
+        await update_worker_activity(conn, worker, commit=False)
+        await conn.commit()
+        return False
+
+    if isinstance(output, _storage.StoredOutput):
+        await conn.execute(
+            """
+            INSERT INTO outputs (job_id, path, hash, size, encoding)
+            VALUES (?, ?, ?, ?, ?)
+            """,
+            (job_id, output.path, output.hash, output.size, output_encoding),
+        )
+    elif output:
+        await conn.execute(
+            """
+            INSERT INTO outputs (job_id, output, size, encoding)
+            VALUES (?, ?, ?, ?)
+            """,
+            (job_id, output, len(output), output_encoding),
+        )
+
+    if cache_ttl and status == _models.JobStatus.DONE:
+        await conn.execute(
+            """
+            INSERT OR REPLACE INTO cache_entries (key, job_id, expires_at)
+            SELECT cache_key, id, strftime('%Y-%m-%d %H:%M:%f', 'now', ?)
+            FROM jobs
+            WHERE id = ? AND cache_key IS NOT NULL
+            """,
+            (f"+{cache_ttl} seconds", job_id),
+        )
+
+    await update_worker_activity(conn, worker, commit=False)
+
+    await conn.commit()
+
+    return True
+
+
+async def add_job_timings(
+    conn: AsyncConnection,
+    timings: Dict[int, Dict[str, float]],
+    commit: bool = True,
 ) -> None:
-    await conn.execute(
+    """Adds timings of phases measured after the jobs were finished."""
+    await conn.executemany(
         """
         UPDATE jobs
-        SET status = ?, updated_at = strftime('%Y-%m-%d %H:%M:%f', 'now'), processing_time = ?
+        SET timings = json_patch(COALESCE(timings, '{}'), ?)
         WHERE id = ?
         """,
-        (status, processing_time, job_id),
+        [(json.dumps(t), job_id) for job_id, t in timings.items()],
     )
 
-    if output:
+    if commit:
+        await conn.commit()
+
+
+async def cancel_job(
+    conn: AsyncConnection, job_id: int
+) -> _backend.CancelResult:
+    """Cancels the job unless it's finished already.
+
+    Pending jobs are never picked up. Jobs in progress are interrupted by
+    their worker once it notices the status change.
+
+    Returns:
+        The job after the change, and whether it was cancelled by this call.
+    """
+    async with conn.execute(
+        f"""
+        UPDATE jobs
+        SET status = '{_models.JobStatus.CANCELLED.value}', updated_at = strftime('%Y-%m-%d %H:%M:%f', 'now')
+        WHERE id = ? AND status IN ('{_models.JobStatus.PENDING.value}', '{_models.JobStatus.IN_PROGRESS.value}')
+        RETURNING {_JOB_COLUMNS}
+        """,
+        (job_id,),
+    ) as cursor:
+        result = await cursor.fetchone()
+
+    await conn.commit()
+
+    if result:
+        return _backend.CancelResult(_models.Job(**result), True)
+
+    return _backend.CancelResult(await get_job_by_id(conn, job_id), False)
+
+
+async def requeue_job(conn: AsyncConnection, job_id: int) -> None:
+    """Puts a claimed job that hasn't been started back to the queue."""
+    # The claim doesn't count as an attempt, since the job wasn't started
+    await conn.execute(
+        f"""
+        UPDATE jobs
+        SET status = '{_models.JobStatus.PENDING.value}', updated_at = NULL, worker = NULL,
+            lease_expires_at = NULL, attempts = attempts - 1
+        WHERE id = ? AND status = '{_models.JobStatus.IN_PROGRESS.value}'
+        """,
+        (job_id,),
+    )
+    await conn.commit()
+
+
+async def extend_leases(
+    conn: AsyncConnection,
+    worker: str,
+    job_ids: Iterable[int],
+    lease_duration: float = DEFAULT_LEASE_DURATION,
+    commit: bool = True,
+) -> None:
+    """Extends worker's leases on jobs it's working on."""
+    job_ids = list(job_ids)
+    for i in range(0, len(job_ids), _MAX_QUERY_VARIABLES):
+        chunk = job_ids[i : i + _MAX_QUERY_VARIABLES]
         await conn.execute(
-            """
-            INSERT INTO outputs (job_id, output)
-            VALUES (?, ?)
+            f"""
+            UPDATE jobs
+            SET lease_expires_at = strftime('%Y-%m-%d %H:%M:%f', 'now', ?)
+            WHERE id IN ({", ".join("?" * len(chunk))})
+                AND status = '{_models.JobStatus.IN_PROGRESS.value}' AND worker = ?
             """,
-            (job_id, output),
+            (f"+{lease_duration} seconds", *chunk, worker),
         )
 
-    await update_worker_activity(conn, worker, commit=False)
+    if commit:
+        await conn.commit()
+
+
+async def requeue_expired_jobs(
+    conn: AsyncConnection, max_attempts: int
+) -> Tuple[int, int]:
+    """Takes back jobs whose workers stopped extending their leases.
+
+    Such workers are most likely dead (e.g. killed or their host is gone).
+    Jobs are queued again, unless they were attempted `max_attempts` times
+    already - then they're marked as failed.
+
+    Returns:
+        Number of requeued jobs and number of failed jobs.
+    """
+    await conn.execute("BEGIN IMMEDIATE")
+
+    async with conn.execute(
+        f"""
+        UPDATE jobs
+        SET status = '{_models.JobStatus.PENDING.value}', updated_at = NULL, worker = NULL, lease_expires_at = NULL
+        WHERE status = '{_models.JobStatus.IN_PROGRESS.value}'
+            AND lease_expires_at < strftime('%Y-%m-%d %H:%M:%f', 'now')
+            AND attempts < ?
+        """,
+        (max_attempts,),
+    ) as cursor:
+        requeued = cursor.rowcount
+
+    async with conn.execute(
+        f"""
+        UPDATE jobs
+        SET status = '{_models.JobStatus.FAILED.value}', updated_at = strftime('%Y-%m-%d %H:%M:%f', 'now'), lease_expires_at = NULL
+        WHERE status = '{_models.JobStatus.IN_PROGRESS.value}'
+            AND lease_expires_at < strftime('%Y-%m-%d %H:%M:%f', 'now')
+        """
+    ) as cursor:
+        failed = cursor.rowcount
 
     await conn.commit()
 
+    return requeued, failed
+
 
 async def check_in_worker(
     conn: AsyncConnection,
@@ -235,11 +1184,76 @@ async def update_worker_activity(
         await conn.commit()
 
 
+async def add_worker_event(
+    conn: AsyncConnection,
+    worker: str,
+    event: WorkerEventType,
+    browser_memory: Optional[int] = None,
+    browser_jobs: Optional[int] = None,
+    browser_age: Optional[float] = None,
+    reason: Optional[str] = None,
+    slots: Optional[int] = None,
+) -> None:
+    """Records an event in worker's browser lifecycle or scaling.
+
+    Args:
+        worker: Name of the worker.
+        event: Type of the event.
+        browser_memory: Memory used by the browser, in bytes.
+        browser_jobs: Number of jobs processed by the browser.
+        browser_age: Number of seconds since the browser was launched.
+        reason: Why the event happened (e.g. why the browser was recycled).
+        slots: Number of job slots the worker scaled to.
+    """
+    await conn.execute(
+        """
+        INSERT INTO worker_events
+            (
+                worker,
+                event,
+                browser_memory,
+                browser_jobs,
+                browser_age,
+                reason,
+                slots
+            )
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+        """,
+        (
+            worker,
+            event,
+            browser_memory,
+            browser_jobs,
+            browser_age,
+            reason,
+            slots,
+        ),
+    )
+    await conn.commit()
+
+
 async def get_workers(
     conn: AsyncConnection, last_activity_time_ge: Optional[datetime] = None
 ) -> List[DBWorker]:
     args = []
-    query = """SELECT id, name, last_check_in_time, last_activity_time
+    query = """SELECT id, name, last_check_in_time, last_activity_time,
+                    (
+                        SELECT browser_memory FROM worker_events e
+                        WHERE e.worker = workers.name
+                            AND e.event = 'memory_sample'
+                        ORDER BY e.id DESC LIMIT 1
+                    ) AS browser_memory,
+                    (
+                        SELECT COUNT(*) FROM worker_events e
+                        WHERE e.worker = workers.name
+                            AND e.event = 'browser_recycle'
+                    ) AS browser_recycles,
+                    (
+                        SELECT slots FROM worker_events e
+                        WHERE e.worker = workers.name
+                            AND e.event = 'scale'
+                        ORDER BY e.id DESC LIMIT 1
+                    ) AS slots
                     FROM workers"""
     if last_activity_time_ge:
         query += " WHERE last_activity_time >= ?"
@@ -259,33 +1273,147 @@ async def get_workers(
 async def get_jobs(
     conn: AsyncConnection,
     status: Optional[_models.JobStatus] = None,
+    name: Optional[str] = None,
     limit: Optional[int] = None,
-    offset: Optional[int] = None,
-) -> Tuple[List[_models.JobBase], int]:
+    cursor: Optional[str] = None,
+) -> _models.JobsPage:
+    """Returns a page of jobs, from the newest ones.
+
+    Pages are selected by the position of their first or last job, rather
+    than an offset, so any page is found with a single index lookup.
+
+    Args:
+        cursor: `next_cursor` or `prev_cursor` of another page, None for the
+            first page.
+
+    Raises:
+        ValueError: If the cursor is invalid.
+    """
     limit = limit or 50
-    offset = offset or 0
 
-    args = []
-    where_clause = ""
+    conditions = []
+    args: list = []
     if status:
-        where_clause = " WHERE status = ? "
+        conditions.append("status = ?")
         args.append(status)
+    if name:
+        conditions.append("name = ?")
+        args.append(name)
 
-    count_query = f"SELECT COUNT(*) FROM jobs{where_clause}"
-    async with conn.execute(count_query, args) as cursor:
-        total_count = (await cursor.fetchone())[0]
+    # Newer jobs are selected in reverse order, from the cursor upwards
+    direction = "<"
+    if cursor:
+        direction, created_at, id_ = _backend.decode_cursor(cursor)
+        conditions.append(f"(created_at, id) {direction} (?, ?)")
+        args.extend([created_at, id_])
+    order = "DESC" if direction == "<" else "ASC"
 
+    where_clause = f"WHERE {' AND '.join(conditions)}" if conditions else ""
     query = f"""
-        SELECT id, name, status, created_at, updated_at, worker, processing_time
-        FROM jobs{where_clause}
-        ORDER BY created_at DESC
-        LIMIT ? OFFSET ?
+        SELECT id, name, status, created_at AS created_at_key, created_at, updated_at, worker, processing_time,
+            timings, output_size
+        FROM jobs
+        {where_clause}
+        ORDER BY created_at {order}, id {order}
+        LIMIT ?
     """
-    args.extend([limit, offset])
+    # An extra row tells if there's another page
+    args.append(limit + 1)
+
+    async with conn.execute(query, args) as cur:
+        rows = await cur.fetchall()
+
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    if direction == ">":
+        rows.reverse()
+
+    counts = await get_job_counts(conn, name)
+    total = counts.get(status, 0) if status else sum(counts.values())
+
+    jobs = [_models.JobBase(**r) for r in rows]
+    if not rows:
+        return _models.JobsPage(
+            jobs=jobs, total=total, next_cursor=None, prev_cursor=None
+        )
+
+    has_older = has_more if direction == "<" else True
+    has_newer = has_more if direction == ">" else cursor is not None
+    first, last = rows[0], rows[-1]
+    return _models.JobsPage(
+        jobs=jobs,
+        total=total,
+        next_cursor=(
+            _backend.encode_cursor("<", last["created_at_key"], last["id"])
+            if has_older
+            else None
+        ),
+        prev_cursor=(
+            _backend.encode_cursor(">", first["created_at_key"], first["id"])
+            if has_newer
+            else None
+        ),
+    )
+
+
+async def get_job_counts(
+    conn: AsyncConnection, name: Optional[str] = None
+) -> Dict[_models.JobStatus, int]:
+    """Returns the number of jobs by status, optionally of a single name."""
+    query = "SELECT status, SUM(count) FROM job_counts"
+    args = []
+    if name:
+        query += " WHERE name = ?"
+        args.append(name)
+    query += " GROUP BY status"
 
     async with conn.execute(query, args) as cursor:
         rows = await cursor.fetchall()
 
-    jobs = [_models.JobBase(**r) for r in rows]
+    return {_models.JobStatus(r[0]): r[1] for r in rows if r[1]}
+
+
+async def get_job_counts_by_name(
+    conn: AsyncConnection,
+) -> Dict[Tuple[str, _models.JobStatus], int]:
+    """Returns the number of jobs by name and status."""
+    async with conn.execute(
+        "SELECT name, status, count FROM job_counts"
+    ) as cursor:
+        rows = await cursor.fetchall()
+
+    return {(r[0], _models.JobStatus(r[1])): r[2] for r in rows}
+
+
+async def get_job_metrics(
+    conn: AsyncConnection,
+) -> List[Tuple[str, str, float, int, float]]:
+    """Returns all job counters and histogram buckets.
+
+    Rows are (name, metric, bucket, count, sum), ordered by name, metric
+    and bucket. See `_METRICS_SQL` for their meaning.
+    """
+    async with conn.execute(
+        """
+        SELECT name, metric, bucket, count, sum
+        FROM job_metrics
+        ORDER BY name, metric, bucket
+        """
+    ) as cursor:
+        rows = await cursor.fetchall()
+
+    return [tuple(r) for r in rows]
+
+
+async def count_live_workers(conn: AsyncConnection, max_idle: float) -> int:
+    """Counts workers active within the last `max_idle` seconds."""
+    async with conn.execute(
+        """
+        SELECT COUNT(*) FROM workers
+        WHERE last_activity_time >= strftime('%Y-%m-%d %H:%M:%f', 'now', ?)
+        """,
+        (f"-{max_idle} seconds",),
+    ) as cursor:
+        result = await cursor.fetchone()
 
-    return jobs, total_count
+    return result[0]
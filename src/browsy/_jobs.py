@@ -1,13 +1,31 @@
 import logging
+import time
 from abc import ABC, abstractmethod
-from typing import ClassVar, Union, Type
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import (
+    ClassVar,
+    Dict,
+    Iterator,
+    Literal,
+    Optional,
+    Union,
+    Type,
+)
 from pathlib import Path
 
 from playwright.async_api import Page
 from pydantic import BaseModel, ConfigDict
 
+from browsy._contexts import ContextProfile
+
 logger = logging.getLogger(__name__)
 
+# Timings of the job being executed, set by the worker for the job's task
+current_timings: ContextVar[Optional[Dict[str, float]]] = ContextVar(
+    "current_timings", default=None
+)
+
 
 def collect_jobs_defs(path: Union[str, Path]) -> dict[str, Type["BaseJob"]]:
     """Collect job class definitions from Python files in the specified path.
@@ -40,7 +58,9 @@ def collect_jobs_defs(path: Union[str, Path]) -> dict[str, Type["BaseJob"]]:
         if not file_path.suffix == ".py":
             return
 
-        spec = importlib.util.spec_from_file_location(file_path.stem, file_path)
+        spec = importlib.util.spec_from_file_location(
+            file_path.stem, file_path
+        )
         if not spec or not spec.loader:
             return
 
@@ -90,6 +110,41 @@ class BaseJob(ABC, BaseModel):
     # For example: NAME = "screenshot" or NAME = "pdf_export"
     NAME: ClassVar[str]
 
+    # Optional number of seconds for which the job's result is cached. A job
+    # submitted with the same parameters within this time isn't executed
+    # again - it's finished right away with the cached output.
+    # Disabled by default, since not every job is deterministic.
+    CACHE_TTL: ClassVar[Optional[int]] = None
+
+    # Optional compression of the job's output in storage ("gzip" or "zstd").
+    # Outputs that are compressed already (e.g. PNG or JPEG screenshots) are
+    # stored as they are. Decompression is transparent for the clients.
+    OUTPUT_COMPRESSION: ClassVar[Optional[Literal["gzip", "zstd"]]] = None
+
+    # Whether the job can run in a browser context recycled after another job,
+    # which saves the time needed to set up a new one. Cookies, permissions,
+    # routes and extra pages are reset between jobs, but other state (e.g.
+    # local storage, cache or changes made to the page like its viewport)
+    # is carried over. Disabled by default, so every job runs in isolation.
+    REUSE_CONTEXT: ClassVar[bool] = False
+
+    # Optional number of seconds after which the job is interrupted and marked
+    # as timed out, so that a hanging page doesn't block the worker forever.
+    # Can be overridden for a single job when it's submitted.
+    TIMEOUT: ClassVar[Optional[float]] = None
+
+    # Priority of the job in the queue. Pending jobs with higher priority are
+    # picked up first, regardless of how long other jobs have been waiting,
+    # e.g. interactive requests can be given precedence over bulk exports.
+    # Can be overridden for a single job when it's submitted.
+    PRIORITY: ClassVar[int] = 0
+
+    # Settings of the browser context the job runs in: resource types and
+    # URL patterns to block, JavaScript, viewport and animations. Blocking
+    # images, fonts or trackers makes jobs that don't need them faster.
+    # Jobs with equal profiles share the worker's pool of ready contexts.
+    CONTEXT_PROFILE: ClassVar[ContextProfile] = ContextProfile()
+
     @abstractmethod
     async def execute(self, page: Page) -> bytes:
         """Execute the job using the provided Playwright page.
@@ -108,6 +163,25 @@ class BaseJob(ABC, BaseModel):
             bytes: The job's output data in binary format
         """
 
+    @contextmanager
+    def span(self, name: str) -> Iterator[None]:
+        """Measures a part of `execute`.
+
+        Time spent within the block is saved with the job's timings as
+        `execute.<name>`, e.g. `with self.span("goto"): await page.goto(url)`
+        is saved as `execute.goto`. Time of spans with the same name adds up.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            timings = current_timings.get()
+            if timings is not None:
+                key = f"execute.{name}"
+                timings[key] = round(
+                    timings.get(key, 0) + _elapsed_ms(start), 2
+                )
+
     async def validate_logic(self) -> bool:
         """Validate job parameters before queueing.
 
@@ -127,3 +201,7 @@ class BaseJob(ABC, BaseModel):
             bool: True if logical validation passes, False otherwise
         """
         return True
+
+
+def _elapsed_ms(start: float) -> float:
+    return round((time.perf_counter() - start) * 1000, 2)
@@ -0,0 +1,677 @@
+"""Backend keeping everything in memory of a single process.
+
+It's meant for running the server and workers within one process, e.g. on
+a single node or in benchmarks of the queue itself, and nothing survives
+a restart. Every method runs without yielding to the event loop, which makes
+it atomic.
+"""
+
+import heapq
+import itertools
+import math
+import time
+from datetime import datetime, timedelta, timezone
+from typing import (
+    Collection,
+    Dict,
+    Iterable,
+    List,
+    NamedTuple,
+    Optional,
+    Tuple,
+    Union,
+)
+
+from browsy import _backend, _models, _storage
+
+
+class _Output(NamedTuple):
+    id: int
+    job_id: int
+    content: Optional[bytes]
+    path: Optional[str]  # relative to the output store, if stored there
+    hash: Optional[str]
+    size: int
+    encoding: Optional[str]
+
+
+class MemoryBackend(_backend.Backend):
+    """Keeps jobs, outputs and workers in dictionaries.
+
+    Pending jobs of every type are kept in a heap in the order they're
+    claimed. Jobs that stop being pending stay in the heap until they get to
+    its top, where they're skipped.
+    """
+
+    def __init__(self) -> None:
+        self._jobs: Dict[int, _models.Job] = {}
+        self._cache_keys: Dict[int, str] = {}
+        # Monotonic time the lease on a job in progress expires, by job ID
+        self._leases: Dict[int, float] = {}
+        # Heaps of (-priority, created_at, id) by job name
+        self._pending: Dict[str, List[Tuple[int, datetime, int]]] = {}
+        self._counts: Dict[Tuple[str, _models.JobStatus], int] = {}
+        # [count, sum] by (name, metric, bucket)
+        self._metrics: Dict[Tuple[str, str, float], List[float]] = {}
+        self._outputs: Dict[int, _Output] = {}
+        self._job_outputs: Dict[int, int] = {}
+        # Cached job ID and the time the entry expires, by cache key
+        self._cache: Dict[str, Tuple[int, float]] = {}
+        self._workers: Dict[str, _backend.DBWorker] = {}
+        self._memory_samples: Dict[str, int] = {}
+        self._recycles: Dict[str, int] = {}
+        self._slots: Dict[str, int] = {}
+
+        self._job_ids = itertools.count(1)
+        self._output_ids = itertools.count(1)
+        self._worker_ids = itertools.count(1)
+
+    # Jobs
+
+    async def create_jobs(
+        self, jobs: List[_backend.NewJob]
+    ) -> List[_models.Job]:
+        now = _now()
+        wall_time = time.time()
+        cached = {
+            job.cache_key: self._cache[job.cache_key][0]
+            for job in jobs
+            if job.cache_key in self._cache
+            and self._cache[job.cache_key][1] > wall_time
+        }
+
+        # Jobs are validated before any of them is stored
+        new_jobs = []
+        for job in jobs:
+            cache_hit = job.cache_key in cached
+            new_jobs.append(
+                _models.Job(
+                    id=next(self._job_ids),
+                    name=job.name,
+                    input=job.input_json,
+                    status=(
+                        _models.JobStatus.DONE
+                        if cache_hit
+                        else _models.JobStatus.PENDING
+                    ),
+                    created_at=now,
+                    updated_at=now if cache_hit else None,
+                    worker=None,
+                    processing_time=0 if cache_hit else None,
+                    timeout=None if cache_hit else job.timeout,
+                    priority=job.priority,
+                )
+            )
+
+        for job, new_job in zip(jobs, new_jobs):
+            self._jobs[new_job.id] = new_job
+            if job.cache_key:
+                self._cache_keys[new_job.id] = job.cache_key
+            self._count(new_job.name, new_job.status, 1)
+            self._observe(new_job.name, "submitted")
+
+            if new_job.status == _models.JobStatus.PENDING:
+                self._push_pending(new_job)
+            else:
+                self._observe(new_job.name, new_job.status.value)
+                # Outputs in the output store are shared by reference
+                output_id = self._job_outputs.get(cached[job.cache_key])
+                if output_id is not None:
+                    output = self._outputs[output_id]
+                    self._add_output(
+                        new_job.id,
+                        content=output.content,
+                        path=output.path,
+                        hash=output.hash,
+                        size=output.size,
+                        encoding=output.encoding,
+                    )
+
+        return [j.model_copy(deep=True) for j in new_jobs]
+
+    async def get_job(self, job_id: int) -> Optional[_models.Job]:
+        job = self._jobs.get(job_id)
+        return job.model_copy(deep=True) if job else None
+
+    async def get_jobs_by_ids(self, ids: Iterable[int]) -> List[_models.Job]:
+        return [
+            self._jobs[i].model_copy(deep=True)
+            for i in set(ids)
+            if i in self._jobs
+        ]
+
+    async def list_jobs(
+        self,
+        status: Optional[_models.JobStatus] = None,
+        name: Optional[str] = None,
+        limit: Optional[int] = None,
+        cursor: Optional[str] = None,
+    ) -> _models.JobsPage:
+        limit = limit or 50
+
+        # Newer jobs are selected in reverse order, from the cursor upwards
+        direction = "<"
+        key = None
+        if cursor:
+            direction, created_at, id_ = _backend.decode_cursor(cursor)
+            try:
+                key = (datetime.fromisoformat(created_at), id_)
+            except ValueError as e:
+                raise ValueError("Invalid cursor") from e
+
+        jobs = [
+            j
+            for j in self._jobs.values()
+            if (not status or j.status == status)
+            and (not name or j.name == name)
+            and (
+                key is None
+                or (
+                    (j.created_at, j.id) < key
+                    if direction == "<"
+                    else (j.created_at, j.id) > key
+                )
+            )
+        ]
+        jobs.sort(key=lambda j: (j.created_at, j.id), reverse=direction == "<")
+
+        has_more = len(jobs) > limit
+        jobs = jobs[:limit]
+        if direction == ">":
+            jobs.reverse()
+
+        counts = await self.get_job_counts(name)
+        total = counts.get(status, 0) if status else sum(counts.values())
+
+        page = [_models.JobBase.model_validate(j.model_dump()) for j in jobs]
+        if not jobs:
+            return _models.JobsPage(
+                jobs=page, total=total, next_cursor=None, prev_cursor=None
+            )
+
+        has_older = has_more if direction == "<" else True
+        has_newer = has_more if direction == ">" else cursor is not None
+        first, last = jobs[0], jobs[-1]
+        return _models.JobsPage(
+            jobs=page,
+            total=total,
+            next_cursor=(
+                _backend.encode_cursor(
+                    "<", last.created_at.isoformat(), last.id
+                )
+                if has_older
+                else None
+            ),
+            prev_cursor=(
+                _backend.encode_cursor(
+                    ">", first.created_at.isoformat(), first.id
+                )
+                if has_newer
+                else None
+            ),
+        )
+
+    async def get_job_counts(
+        self, name: Optional[str] = None
+    ) -> Dict[_models.JobStatus, int]:
+        counts: Dict[_models.JobStatus, int] = {}
+        for (job_name, status), count in self._counts.items():
+            if count and (not name or job_name == name):
+                counts[status] = counts.get(status, 0) + count
+        return counts
+
+    async def cancel_job(self, job_id: int) -> _backend.CancelResult:
+        job = self._jobs.get(job_id)
+        if not job:
+            return _backend.CancelResult(None, False)
+
+        cancelled = not job.status.is_finished
+        if cancelled:
+            job.updated_at = _now()
+            self._leases.pop(job.id, None)
+            self._set_status(job, _models.JobStatus.CANCELLED)
+
+        return _backend.CancelResult(job.model_copy(deep=True), cancelled)
+
+    # Queue
+
+    async def has_pending_jobs(
+        self, names: Optional[Collection[str]] = None
+    ) -> bool:
+        return any(
+            count
+            for (name, status), count in self._counts.items()
+            if status == _models.JobStatus.PENDING
+            and (not names or name in names)
+        )
+
+    async def get_queue_stats(
+        self, names: Optional[Collection[str]] = None
+    ) -> _backend.QueueStats:
+        pending = sum(
+            count
+            for (name, status), count in self._counts.items()
+            if status == _models.JobStatus.PENDING
+            and (not names or name in names)
+        )
+        # Heaps are ordered by priority first, so all entries are looked at
+        oldest = min(
+            (
+                created_at
+                for name, heap in self._pending.items()
+                if not names or name in names
+                for _, created_at, job_id in heap
+                if self._is_pending(job_id)
+            ),
+            default=None,
+        )
+        return _backend.QueueStats(
+            pending,
+            (_now() - oldest).total_seconds() if oldest else None,
+        )
+
+    async def claim_jobs(
+        self,
+        worker: str,
+        limit: int,
+        lease_duration: float = _backend.DEFAULT_LEASE_DURATION,
+        names: Optional[Collection[str]] = None,
+    ) -> List[_models.Job]:
+        heaps = [
+            self._pending[n]
+            for n in (names or list(self._pending))
+            if n in self._pending
+        ]
+        now = _now()
+        lease_expires_at = time.monotonic() + lease_duration
+
+        claimed = []
+        while len(claimed) < limit:
+            # Only the heads of the heaps are compared
+            next_heap = None
+            for heap in heaps:
+                while heap and not self._is_pending(heap[0][2]):
+                    heapq.heappop(heap)
+                if heap and (next_heap is None or heap[0] < next_heap[0]):
+                    next_heap = heap
+            if next_heap is None:
+                break
+
+            job = self._jobs[heapq.heappop(next_heap)[2]]
+            job.updated_at = now
+            job.worker = worker
+            job.attempts += 1
+            self._leases[job.id] = lease_expires_at
+            self._set_status(job, _models.JobStatus.IN_PROGRESS)
+            claimed.append(job.model_copy(deep=True))
+
+        if claimed:
+            self._update_worker_activity(worker)
+
+        return claimed
+
+    async def complete_job(
+        self,
+        worker: str,
+        job_id: int,
+        status: _backend.FinalStatus,
+        processing_time: int,
+        output: Union[bytes, _storage.StoredOutput, None],
+        output_encoding: Optional[str] = None,
+        cache_ttl: Optional[int] = None,
+        timings: Optional[Dict[str, float]] = None,
+        output_size: Optional[int] = None,
+    ) -> bool:
+        self._update_worker_activity(worker)
+
+        job = self._jobs.get(job_id)
+        if not (
+            job
+            and job.status == _models.JobStatus.IN_PROGRESS
+            and job.worker == worker
+        ):
+            return False
+
+        job.updated_at = _now()
+        job.processing_time = processing_time
+        job.timings = dict(timings) if timings else None
+        job.output_size = output_size
+        self._leases.pop(job.id, None)
+        self._set_status(job, status)
+
+        if isinstance(output, _storage.StoredOutput):
+            self._add_output(
+                job.id,
+                content=None,
+                path=output.path,
+                hash=output.hash,
+                size=output.size,
+                encoding=output_encoding,
+            )
+        elif output:
+            self._add_output(
+                job.id,
+                content=bytes(output),
+                path=None,
+                hash=None,
+                size=len(output),
+                encoding=output_encoding,
+            )
+
+        cache_key = self._cache_keys.get(job.id)
+        if cache_ttl and status == _models.JobStatus.DONE and cache_key:
+            self._cache[cache_key] = (job.id, time.time() + cache_ttl)
+
+        return True
+
+    async def add_job_timings(
+        self, timings: Dict[int, Dict[str, float]]
+    ) -> None:
+        for job_id, job_timings in timings.items():
+            job = self._jobs.get(job_id)
+            if job:
+                job.timings = {**(job.timings or {}), **job_timings}
+
+    async def requeue_job(self, job_id: int) -> None:
+        job = self._jobs.get(job_id)
+        if job and job.status == _models.JobStatus.IN_PROGRESS:
+            # The claim doesn't count as an attempt, since the job wasn't
+            # started
+            job.attempts -= 1
+            self._requeue(job)
+
+    async def requeue_expired_jobs(self, max_attempts: int) -> Tuple[int, int]:
+        now = time.monotonic()
+        requeued = failed = 0
+
+        for job_id, lease_expires_at in list(self._leases.items()):
+            if lease_expires_at >= now:
+                continue
+
+            job = self._jobs[job_id]
+            if job.attempts < max_attempts:
+                self._requeue(job)
+                requeued += 1
+            else:
+                job.updated_at = _now()
+                del self._leases[job.id]
+                self._set_status(job, _models.JobStatus.FAILED)
+                failed += 1
+
+        return requeued, failed
+
+    async def evict_cache_entries(self) -> int:
+        now = time.time()
+        expired = [k for k, (_, t) in self._cache.items() if t <= now]
+        for key in expired:
+            del self._cache[key]
+        return len(expired)
+
+    # Outputs
+
+    async def get_job_output_info(
+        self, job_id: int
+    ) -> Optional[_backend.DBOutputInfo]:
+        output_id = self._job_outputs.get(job_id)
+        if output_id is None:
+            return None
+
+        output = self._outputs[output_id]
+        return _backend.DBOutputInfo(
+            id=output.id,
+            job_id=output.job_id,
+            size=output.size,
+            path=output.path,
+            hash=output.hash,
+            encoding=output.encoding,
+        )
+
+    async def read_output_chunk(
+        self, output_id: int, offset: int, size: int
+    ) -> bytes:
+        output = self._outputs.get(output_id)
+        if not output or output.content is None:
+            return b""
+        return output.content[offset : offset + size]
+
+    # Workers
+
+    async def check_in_worker(self, worker: str) -> None:
+        now = _now()
+        if worker in self._workers:
+            self._workers[worker].last_check_in_time = now
+        else:
+            self._workers[worker] = _backend.DBWorker(
+                id=next(self._worker_ids),
+                name=worker,
+                last_check_in_time=now,
+                last_activity_time=now,
+            )
+
+    async def heartbeat(
+        self,
+        worker: str,
+        job_ids: Iterable[int],
+        lease_duration: float = _backend.DEFAULT_LEASE_DURATION,
+        timings: Optional[Dict[int, Dict[str, float]]] = None,
+    ) -> None:
+        self._update_worker_activity(worker)
+
+        lease_expires_at = time.monotonic() + lease_duration
+        for job_id in job_ids:
+            job = self._jobs.get(job_id)
+            if (
+                job
+                and job.status == _models.JobStatus.IN_PROGRESS
+                and job.worker == worker
+            ):
+                self._leases[job_id] = lease_expires_at
+
+        if timings:
+            await self.add_job_timings(timings)
+
+    async def add_worker_event(
+        self,
+        worker: str,
+        event: _backend.WorkerEventType,
+        browser_memory: Optional[int] = None,
+        browser_jobs: Optional[int] = None,
+        browser_age: Optional[float] = None,
+        reason: Optional[str] = None,
+        slots: Optional[int] = None,
+    ) -> None:
+        # Only what's shown about workers is kept, not the events themselves
+        if event == "memory_sample":
+            self._memory_samples[worker] = browser_memory
+        elif event == "browser_recycle":
+            self._recycles[worker] = self._recycles.get(worker, 0) + 1
+        elif event == "scale":
+            self._slots[worker] = slots
+
+    async def get_workers(
+        self, last_activity_time_ge: Optional[datetime] = None
+    ) -> List[_backend.DBWorker]:
+        if last_activity_time_ge and last_activity_time_ge.tzinfo:
+            last_activity_time_ge = last_activity_time_ge.astimezone(
+                timezone.utc
+            ).replace(tzinfo=None)
+
+        workers = [
+            w.model_copy(
+                update={
+                    "browser_memory": self._memory_samples.get(w.name),
+                    "browser_recycles": self._recycles.get(w.name, 0),
+                    "slots": self._slots.get(w.name),
+                }
+            )
+            for w in self._workers.values()
+            if not last_activity_time_ge
+            or w.last_activity_time >= last_activity_time_ge
+        ]
+        workers.sort(key=lambda w: w.last_activity_time, reverse=True)
+        return workers
+
+    async def count_live_workers(self, max_idle: float) -> int:
+        since = _now() - timedelta(seconds=max_idle)
+        return sum(
+            w.last_activity_time >= since for w in self._workers.values()
+        )
+
+    # Metrics
+
+    async def get_job_counts_by_name(
+        self,
+    ) -> Dict[Tuple[str, _models.JobStatus], int]:
+        return dict(self._counts)
+
+    async def get_job_metrics(
+        self,
+    ) -> List[Tuple[str, str, float, int, float]]:
+        return [
+            (name, metric, bucket, int(count), total)
+            for (name, metric, bucket), (count, total) in sorted(
+                self._metrics.items()
+            )
+        ]
+
+    # Retention
+
+    async def get_expired_job_ids(
+        self,
+        max_age: float,
+        limit: int,
+        name: Optional[str] = None,
+        status: Optional[_models.JobStatus] = None,
+    ) -> List[int]:
+        created_before = _now() - timedelta(seconds=max_age)
+        ids = [
+            j.id
+            for j in self._finished_jobs(name, status)
+            if j.created_at < created_before
+        ]
+        return sorted(ids)[:limit]
+
+    async def get_excess_job_ids(
+        self,
+        max_count: int,
+        limit: int,
+        name: Optional[str] = None,
+        status: Optional[_models.JobStatus] = None,
+    ) -> List[int]:
+        ids = sorted(
+            (j.id for j in self._finished_jobs(name, status)), reverse=True
+        )
+        return ids[max_count : max_count + limit]
+
+    async def delete_jobs(self, ids: List[int]) -> List[str]:
+        paths = []
+        for job_id in ids:
+            job = self._jobs.get(job_id)
+            # Jobs that are not finished (anymore) are left alone
+            if not job or not job.status.is_finished:
+                continue
+
+            del self._jobs[job_id]
+            self._count(job.name, job.status, -1)
+
+            cache_key = self._cache_keys.pop(job_id, None)
+            if cache_key and self._cache.get(cache_key, (None,))[0] == job_id:
+                del self._cache[cache_key]
+
+            output_id = self._job_outputs.pop(job_id, None)
+            if output_id is not None:
+                output = self._outputs.pop(output_id)
+                if output.path:
+                    paths.append(output.path)
+
+        return paths
+
+    async def is_output_path_used(self, path: str) -> bool:
+        return any(o.path == path for o in self._outputs.values())
+
+    def _finished_jobs(
+        self, name: Optional[str], status: Optional[_models.JobStatus]
+    ) -> Iterable[_models.Job]:
+        return (
+            j
+            for j in self._jobs.values()
+            if (j.status == status if status else j.status.is_finished)
+            and (not name or j.name == name)
+        )
+
+    def _is_pending(self, job_id: int) -> bool:
+        job = self._jobs.get(job_id)
+        return job is not None and job.status == _models.JobStatus.PENDING
+
+    def _push_pending(self, job: _models.Job) -> None:
+        heapq.heappush(
+            self._pending.setdefault(job.name, []),
+            (-job.priority, job.created_at, job.id),
+        )
+
+    def _requeue(self, job: _models.Job) -> None:
+        job.updated_at = None
+        job.worker = None
+        self._leases.pop(job.id, None)
+        self._set_status(job, _models.JobStatus.PENDING)
+        self._push_pending(job)
+
+    def _set_status(self, job: _models.Job, status: _models.JobStatus) -> None:
+        self._count(job.name, job.status, -1)
+        job.status = status
+        self._count(job.name, status, 1)
+
+        self._observe(job.name, status.value)
+        if status == _models.JobStatus.IN_PROGRESS:
+            wait = (job.updated_at - job.created_at).total_seconds()
+            self._observe(job.name, "queue_wait", wait)
+        elif status.is_finished and status != _models.JobStatus.CANCELLED:
+            if job.processing_time is not None:
+                self._observe(
+                    job.name, "processing_time", job.processing_time / 1000
+                )
+
+    def _count(self, name: str, status: _models.JobStatus, delta: int) -> None:
+        key = (name, status)
+        self._counts[key] = self._counts.get(key, 0) + delta
+
+    def _observe(
+        self, name: str, metric: str, value: Optional[float] = None
+    ) -> None:
+        """Increases a counter, or a histogram if a value is given."""
+        bucket = 0 if value is None else _bucket_of(value)
+        entry = self._metrics.setdefault((name, metric, bucket), [0, 0.0])
+        entry[0] += 1
+        if value is not None:
+            entry[1] += value
+
+    def _add_output(
+        self,
+        job_id: int,
+        content: Optional[bytes],
+        path: Optional[str],
+        hash: Optional[str],
+        size: int,
+        encoding: Optional[str],
+    ) -> None:
+        output_id = next(self._output_ids)
+        self._outputs[output_id] = _Output(
+            output_id, job_id, content, path, hash, size, encoding
+        )
+        self._job_outputs[job_id] = output_id
+
+    def _update_worker_activity(self, worker: str) -> None:
+        if worker in self._workers:
+            self._workers[worker].last_activity_time = _now()
+
+
+def _bucket_of(value: float) -> float:
+    for bucket in _backend.HISTOGRAM_BUCKETS:
+        if value <= bucket:
+            return bucket
+    return math.inf
+
+
+def _now() -> datetime:
+    # Naive UTC, like the timestamps SQLite produces
+    return datetime.now(timezone.utc).replace(tzinfo=None)
@@ -0,0 +1,233 @@
+"""Metrics in the Prometheus text exposition format.
+
+Job metrics are shared by all processes, so they're read from aggregates
+kept up to date by the database itself. HTTP metrics are kept in memory of
+each server process, so every process has to be scraped separately.
+"""
+
+import bisect
+import math
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Iterable, List, Sequence, Tuple
+
+from browsy import _backend, _models
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Workers extend leases of their jobs much more often, so a worker silent
+# for this long is most likely gone
+_LIVE_WORKER_MAX_IDLE = _backend.DEFAULT_LEASE_DURATION
+
+_HTTP_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# Job counters by the event they count, see `Backend.get_job_metrics`
+_JOB_COUNTERS = {
+    "submitted": ("browsy_jobs_submitted_total", "Jobs submitted"),
+    _models.JobStatus.IN_PROGRESS.value: (
+        "browsy_jobs_claimed_total",
+        "Jobs claimed by workers",
+    ),
+    _models.JobStatus.PENDING.value: (
+        "browsy_jobs_requeued_total",
+        "Claimed jobs put back to the queue",
+    ),
+}
+_JOB_HISTOGRAMS = {
+    "queue_wait": (
+        "browsy_job_queue_wait_seconds",
+        "Time from submitting a job to a worker claiming it",
+    ),
+    "processing_time": (
+        "browsy_job_processing_seconds",
+        "Time a worker spent executing a job",
+    ),
+}
+_FINISHED_COUNTER = "browsy_jobs_finished_total"
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+class Histogram:
+    """In-memory histogram with labels."""
+
+    def __init__(
+        self, name: str, documentation: str, buckets: Sequence[float]
+    ) -> None:
+        self.name = name
+        self.documentation = documentation
+        self._buckets = tuple(buckets) + (math.inf,)
+        # Non-cumulative bucket counts, by labels
+        self._counts: Dict[Labels, List[int]] = {}
+        self._sums: Dict[Labels, float] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = tuple(sorted(labels.items()))
+        counts = self._counts.setdefault(key, [0] * len(self._buckets))
+        counts[bisect.bisect_left(self._buckets, value)] += 1
+        self._sums[key] = self._sums.get(key, 0.0) + value
+
+    def collect(self) -> List[str]:
+        lines = _header(self.name, "histogram", self.documentation)
+        for key, counts in sorted(self._counts.items()):
+            lines.extend(
+                _histogram_lines(
+                    self.name,
+                    dict(key),
+                    zip(self._buckets, counts),
+                    self._sums[key],
+                )
+            )
+        return lines
+
+
+def create_http_histogram() -> Histogram:
+    return Histogram(
+        "browsy_http_request_duration_seconds",
+        "Time until the response to an HTTP request started",
+        _HTTP_BUCKETS,
+    )
+
+
+async def render(
+    backend: _backend.Backend,
+    histograms: Iterable[Histogram] = (),
+) -> str:
+    """Renders all metrics of the server."""
+    lines = []
+
+    lines.extend(
+        _header("browsy_jobs", "gauge", "Current number of jobs by status")
+    )
+    counts = await backend.get_job_counts_by_name()
+    for (name, status), count in sorted(counts.items()):
+        lines.append(
+            _sample(
+                "browsy_jobs", {"name": name, "status": status.value}, count
+            )
+        )
+
+    lines.extend(_job_metrics_lines(await backend.get_job_metrics()))
+
+    lines.extend(_header("browsy_workers", "gauge", "Workers that are alive"))
+    live_workers = await backend.count_live_workers(_LIVE_WORKER_MAX_IDLE)
+    lines.append(_sample("browsy_workers", {}, live_workers))
+
+    lines.extend(
+        _header(
+            "browsy_worker_slots", "gauge", "Job slots of autoscaling workers"
+        )
+    )
+    workers = await backend.get_workers(
+        last_activity_time_ge=datetime.now(timezone.utc)
+        - timedelta(seconds=_LIVE_WORKER_MAX_IDLE)
+    )
+    for worker in workers:
+        if worker.slots is not None:
+            lines.append(
+                _sample(
+                    "browsy_worker_slots",
+                    {"worker": worker.name},
+                    worker.slots,
+                )
+            )
+
+    for name, documentation, value in await backend.get_storage_metrics():
+        lines.extend(_header(name, "gauge", documentation))
+        lines.append(_sample(name, {}, value))
+
+    for histogram in histograms:
+        lines.extend(histogram.collect())
+
+    return "\n".join(lines) + "\n"
+
+
+def _job_metrics_lines(
+    rows: List[Tuple[str, str, float, int, float]],
+) -> List[str]:
+    counters: Dict[str, List[str]] = {}
+    histograms: Dict[Tuple[str, str], Dict[float, int]] = {}
+    sums: Dict[Tuple[str, str], float] = {}
+
+    for name, metric, bucket, count, total in rows:
+        if metric in _JOB_HISTOGRAMS:
+            histograms.setdefault((metric, name), {})[bucket] = count
+            sums[(metric, name)] = sums.get((metric, name), 0) + total
+        elif metric in _JOB_COUNTERS:
+            counter_name = _JOB_COUNTERS[metric][0]
+            counters.setdefault(counter_name, []).append(
+                _sample(counter_name, {"name": name}, count)
+            )
+        else:
+            # Any other metric counts jobs that got a final status
+            counters.setdefault(_FINISHED_COUNTER, []).append(
+                _sample(
+                    _FINISHED_COUNTER, {"name": name, "status": metric}, count
+                )
+            )
+
+    lines = []
+    for counter_name, documentation in [
+        *_JOB_COUNTERS.values(),
+        (_FINISHED_COUNTER, "Jobs that got a final status"),
+    ]:
+        lines.extend(_header(counter_name, "counter", documentation))
+        lines.extend(counters.get(counter_name, []))
+
+    bounds = _backend.HISTOGRAM_BUCKETS + (math.inf,)
+    for metric, (histogram_name, documentation) in _JOB_HISTOGRAMS.items():
+        lines.extend(_header(histogram_name, "histogram", documentation))
+        for (m, name), counts in sorted(histograms.items()):
+            if m != metric:
+                continue
+            # Buckets no job fell into have no rows, but are still reported
+            lines.extend(
+                _histogram_lines(
+                    histogram_name,
+                    {"name": name},
+                    [(b, counts.get(b, 0)) for b in bounds],
+                    sums[(m, name)],
+                )
+            )
+
+    return lines
+
+
+def _histogram_lines(
+    name: str,
+    labels: Dict[str, str],
+    buckets: Iterable[Tuple[float, int]],
+    total: float,
+) -> List[str]:
+    lines = []
+    cumulative = 0
+    for bound, count in buckets:
+        cumulative += count
+        lines.append(
+            _sample(
+                f"{name}_bucket",
+                {**labels, "le": _format_value(bound)},
+                cumulative,
+            )
+        )
+    lines.append(_sample(f"{name}_sum", labels, total))
+    lines.append(_sample(f"{name}_count", labels, cumulative))
+    return lines
+
+
+def _header(name: str, metric_type: str, documentation: str) -> List[str]:
+    return [f"# HELP {name} {documentation}", f"# TYPE {name} {metric_type}"]
+
+
+def _sample(name: str, labels: Dict[str, str], value: float) -> str:
+    if not labels:
+        return f"{name} {_format_value(value)}"
+    formatted = ",".join(f'{k}="{_escape(str(v))}"' for k, v in labels.items())
+    return f"{name}{{{formatted}}} {_format_value(value)}"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", r"\\").replace("\n", r"\n").replace('"', r"\"")
+
+
+def _format_value(value: float) -> str:
+    return "+Inf" if value == math.inf else str(value)
@@ -1,7 +1,7 @@
 import json
 from datetime import datetime
 from enum import Enum
-from typing import Optional, Union
+from typing import Dict, List, Optional, Union
 
 from pydantic import BaseModel, field_validator
 
@@ -11,6 +11,13 @@ class JobStatus(str, Enum):
     DONE = "done"
     IN_PROGRESS = "in_progress"
     FAILED = "failed"
+    TIMED_OUT = "timed_out"
+    CANCELLED = "cancelled"
+
+    @property
+    def is_finished(self) -> bool:
+        """Whether the job reached a final status and won't change anymore."""
+        return self not in (JobStatus.PENDING, JobStatus.IN_PROGRESS)
 
 
 class JobBase(BaseModel):
@@ -21,10 +28,26 @@ class JobBase(BaseModel):
     updated_at: Optional[datetime]
     worker: Optional[str]
     processing_time: Optional[int]  # milliseconds
+    # Milliseconds spent in each phase of processing (e.g. "context" or
+    # "execute") and in spans recorded by the job (e.g. "execute.goto")
+    timings: Optional[Dict[str, float]] = None
+    output_size: Optional[int] = None  # bytes, before compression
+
+    @field_validator("timings", mode="before")
+    @classmethod
+    def json_str_timings(
+        cls, v: Union[str, dict, None]
+    ) -> Optional[Dict[str, float]]:
+        if isinstance(v, str):
+            return json.loads(v)
+        return v
 
 
 class Job(JobBase):
     input: dict
+    timeout: Optional[float] = None  # seconds, overrides job type's timeout
+    attempts: int = 0  # number of times the job was claimed by a worker
+    priority: int = 0  # pending jobs with higher priority are claimed first
 
     @field_validator("input", mode="before")
     @classmethod
@@ -32,3 +55,10 @@ class Job(JobBase):
         if isinstance(v, str):
             return json.loads(v)
         return v
+
+
+class JobsPage(BaseModel):
+    jobs: List[JobBase]
+    total: int  # number of jobs matching the filters
+    next_cursor: Optional[str]  # points to the page of older jobs
+    prev_cursor: Optional[str]  # points to the page of newer jobs
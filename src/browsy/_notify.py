@@ -0,0 +1,142 @@
+"""Best-effort wakeup notifications between browsy processes.
+
+Processes sharing the database also share a directory of Unix datagram
+sockets (by default next to the database file). Every listener binds its own
+socket named after its channel, and a notification is an empty datagram sent
+to each socket of the channel. Notifications are only a latency optimization,
+so listeners still have to poll the database in case one gets lost.
+"""
+
+import asyncio
+import logging
+import os
+import re
+import socket
+from pathlib import Path
+from typing import Optional, Union
+
+logger = logging.getLogger(__name__)
+
+WORKERS_CHANNEL = "worker"
+SERVERS_CHANNEL = "server"
+CANCEL_CHANNEL = "cancel"
+
+_SOCKET_SUFFIX = ".sock"
+
+
+def get_notify_dir(db_path: str) -> Path:
+    """Returns the directory with notification sockets for the database."""
+    notify_path = os.environ.get("BROWSY_NOTIFY_PATH")
+    return Path(notify_path) if notify_path else Path(f"{db_path}.notify")
+
+
+def notify(directory: Union[str, Path], channel: str) -> int:
+    """Wakes up all listeners of the channel without blocking.
+
+    Returns:
+        Number of listeners the notification was delivered to.
+    """
+    try:
+        entries = list(os.scandir(directory))
+    except FileNotFoundError:
+        return 0
+
+    delivered = 0
+    prefix = f"{channel}-"
+    with socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM) as sock:
+        sock.setblocking(False)
+        for entry in entries:
+            if not (
+                entry.name.startswith(prefix)
+                and entry.name.endswith(_SOCKET_SUFFIX)
+            ):
+                continue
+            try:
+                sock.sendto(b"", entry.path)
+                delivered += 1
+            except BlockingIOError:
+                # Listener's buffer is full, so it has a wakeup pending anyway
+                delivered += 1
+            except ConnectionRefusedError:
+                # Nobody is bound to the socket - its owner is gone
+                _unlink(entry.path)
+            except OSError:
+                logger.debug("Failed to notify %s", entry.path, exc_info=True)
+
+    return delivered
+
+
+class Listener:
+    """Receives notifications sent to a channel.
+
+    The listener is meant to have a single consumer calling `wait`. If the
+    socket can't be bound, `wait` degrades to a plain sleep.
+    """
+
+    def __init__(
+        self, directory: Union[str, Path], channel: str, name: str
+    ) -> None:
+        safe_name = re.sub(r"[^A-Za-z0-9_.-]", "_", name)
+        self.path = Path(directory) / f"{channel}-{safe_name}{_SOCKET_SUFFIX}"
+        self._event = asyncio.Event()
+        self._transport: Optional[asyncio.DatagramTransport] = None
+
+    async def start(self) -> None:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            _unlink(str(self.path))
+            sock.bind(str(self.path))
+        except OSError:
+            sock.close()
+            logger.warning(
+                "Unable to listen for notifications on %s,"
+                " falling back to polling",
+                self.path,
+                exc_info=True,
+            )
+            return
+
+        loop = asyncio.get_running_loop()
+        self._transport, _ = await loop.create_datagram_endpoint(
+            lambda: _ListenerProtocol(self._event), sock=sock
+        )
+
+    async def wait(self, timeout: float) -> bool:
+        """Waits for a notification.
+
+        Returns:
+            True if a notification arrived, False if the timeout passed.
+        """
+        try:
+            await asyncio.wait_for(self._event.wait(), timeout)
+        except asyncio.TimeoutError:
+            return False
+
+        self._event.clear()
+        return True
+
+    def wake(self) -> None:
+        """Wakes up the consumer from within the process."""
+        self._event.set()
+
+    def close(self) -> None:
+        if self._transport:
+            self._transport.close()
+            self._transport = None
+            _unlink(str(self.path))
+
+
+class _ListenerProtocol(asyncio.DatagramProtocol):
+    def __init__(self, event: asyncio.Event) -> None:
+        self._event = event
+
+    def datagram_received(self, data: bytes, addr) -> None:
+        self._event.set()
+
+
+def _unlink(path: str) -> None:
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
@@ -0,0 +1,113 @@
+import asyncio
+import json
+import os
+from typing import List, Optional
+
+from pydantic import BaseModel, TypeAdapter, field_validator, model_validator
+
+from browsy import _backend, _models, _storage
+
+# Jobs are deleted in small batches, so the queue is never locked for long,
+# with a pause between them to let other writers in
+_DELETE_BATCH_SIZE = 500
+_DELETE_BATCH_PAUSE = 0.05
+
+# Files younger than this aren't deleted even if no job references them,
+# since a worker might be about to save a reference to them
+_UNUSED_FILE_MIN_AGE = 600
+
+
+class RetentionRule(BaseModel):
+    """Limits how long finished jobs are kept.
+
+    A rule applies to jobs with the given name and status, or all finished
+    jobs if they're not set. A job is deleted once any rule that applies to
+    it allows that. Pending jobs and jobs in progress are never deleted.
+    """
+
+    name: Optional[str] = None
+    status: Optional[_models.JobStatus] = None
+    max_age: Optional[float] = None  # seconds since the job was created
+    max_count: Optional[int] = None  # number of newest jobs kept
+
+    @field_validator("status")
+    @classmethod
+    def finished_status(
+        cls, v: Optional[_models.JobStatus]
+    ) -> Optional[_models.JobStatus]:
+        if v and not v.is_finished:
+            raise ValueError("Only finished jobs can be deleted")
+        return v
+
+    @model_validator(mode="after")
+    def has_limit(self) -> "RetentionRule":
+        if self.max_age is None and self.max_count is None:
+            raise ValueError("Either max_age or max_count has to be set")
+        return self
+
+
+def get_retention_rules() -> List[RetentionRule]:
+    """Returns the rules configured with BROWSY_RETENTION, if any.
+
+    The variable holds a JSON list of rules, e.g.
+    `[{"status": "done", "max_age": 86400}, {"max_count": 100000}]`.
+    """
+    rules = os.environ.get("BROWSY_RETENTION")
+    if not rules:
+        return []
+    return TypeAdapter(List[RetentionRule]).validate_python(json.loads(rules))
+
+
+async def enforce_retention(
+    backend: _backend.Backend,
+    rules: List[RetentionRule],
+    output_store: Optional[_storage.OutputStore],
+) -> int:
+    """Deletes jobs that are past their retention.
+
+    Returns:
+        Number of deleted jobs.
+    """
+    deleted = 0
+    for rule in rules:
+        while True:
+            if rule.max_age is not None:
+                ids = await backend.get_expired_job_ids(
+                    rule.max_age,
+                    _DELETE_BATCH_SIZE,
+                    name=rule.name,
+                    status=rule.status,
+                )
+            else:
+                ids = []
+            if not ids and rule.max_count is not None:
+                ids = await backend.get_excess_job_ids(
+                    rule.max_count,
+                    _DELETE_BATCH_SIZE,
+                    name=rule.name,
+                    status=rule.status,
+                )
+            if not ids:
+                break
+
+            paths = await backend.delete_jobs(ids)
+            if output_store:
+                await _delete_unused_files(backend, output_store, paths)
+
+            deleted += len(ids)
+            await asyncio.sleep(_DELETE_BATCH_PAUSE)
+
+    return deleted
+
+
+async def _delete_unused_files(
+    backend: _backend.Backend,
+    output_store: _storage.OutputStore,
+    paths: List[str],
+) -> None:
+    # Identical outputs share a single file
+    for path in set(paths):
+        if not await backend.is_output_path_used(path):
+            await asyncio.to_thread(
+                output_store.delete, path, _UNUSED_FILE_MIN_AGE
+            )
@@ -0,0 +1,89 @@
+from typing import NamedTuple, Optional
+
+from pydantic import BaseModel
+
+from browsy import _backend
+
+
+class ScalingLimits(BaseModel):
+    """Bounds and thresholds of worker autoscaling."""
+
+    min_slots: int = 0
+    max_slots: int
+    # Slots are added once the oldest pending job waits this long
+    scale_up_age: float = 1  # seconds
+    # Slots are removed once they're idle for this long
+    scale_down_delay: float = 60  # seconds
+
+
+class ScalingDecision(NamedTuple):
+    slots: int
+    reason: str
+
+
+class Autoscaler:
+    """Decides how many job slots the worker should have.
+
+    Slots are added as soon as there are more pending jobs than idle slots
+    and the oldest of them waits for `scale_up_age`, enough to take all of
+    them at once. Slots are removed only after the queue has been empty and
+    some slots idle for `scale_down_delay`, down to the busy ones. The gap
+    between the two keeps the worker from flapping between sizes in bursty
+    traffic.
+
+    The queue is shared with other workers, so busy workers might all add
+    slots for the same jobs. The ones left idle give them back later.
+    """
+
+    def __init__(self, limits: ScalingLimits) -> None:
+        self.limits = limits
+        self.slots = limits.min_slots
+        self._idle_since: Optional[float] = None
+
+    def decide(
+        self, stats: _backend.QueueStats, busy: int, now: float
+    ) -> Optional[ScalingDecision]:
+        """Returns a new number of slots, if it should change.
+
+        Args:
+            stats: Queue of jobs the worker takes.
+            busy: Number of slots with a job.
+            now: Current monotonic time.
+        """
+        limits = self.limits
+        idle = max(self.slots - busy, 0)
+        oldest_age = stats.oldest_age or 0
+
+        if stats.pending > idle and (
+            # Without any slots, jobs would wait for nothing
+            self.slots == 0
+            or oldest_age >= limits.scale_up_age
+        ):
+            self._idle_since = None
+            slots = min(busy + stats.pending, limits.max_slots)
+            if slots <= self.slots:
+                return None
+            return self._scale(
+                slots,
+                f"pending jobs: {stats.pending},"
+                f" oldest waiting {oldest_age:.1f}s",
+            )
+
+        if stats.pending or not idle or self.slots <= limits.min_slots:
+            self._idle_since = None
+            return None
+        if self._idle_since is None:
+            self._idle_since = now
+        if now - self._idle_since < limits.scale_down_delay:
+            return None
+
+        idle_time = now - self._idle_since
+        self._idle_since = None
+        return self._scale(
+            max(busy, limits.min_slots),
+            f"idle slots: {idle} for {idle_time:.0f}s",
+        )
+
+    def _scale(self, slots: int, reason: str) -> ScalingDecision:
+        self.slots = slots
+        return ScalingDecision(slots, reason)
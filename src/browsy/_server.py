@@ -1,23 +1,61 @@
+import asyncio
+import hashlib
+import logging
 import os
+import re
+import secrets
+import time
 import importlib.resources as resources
 from contextlib import asynccontextmanager
-from typing import Annotated, Optional
+from typing import Annotated, AsyncIterator, List, Optional, Tuple
 from pathlib import Path
 from datetime import datetime, timezone
 
-from fastapi import FastAPI, Depends, HTTPException, Request, Response
-from fastapi.responses import RedirectResponse
+from fastapi import FastAPI, Depends, HTTPException, Query, Request, Response
+from fastapi.responses import (
+    FileResponse,
+    RedirectResponse,
+    StreamingResponse,
+)
 from fastapi.templating import Jinja2Templates
 from fastapi.openapi.utils import get_openapi
-from pydantic import BaseModel
-
-from browsy import _database, _jobs, _models, __version__
+from pydantic import BaseModel, Field
+
+from browsy import (
+    _backend,
+    _compression,
+    _jobs,
+    _metrics,
+    _models,
+    _notify,
+    _retention,
+    _sqlite,
+    _storage,
+    _watcher,
+    __version__,
+)
 from browsy import __name__ as pkg_name
 
+logger = logging.getLogger(__name__)
+
 _JOBS_DEFS = _jobs.collect_jobs_defs(
     os.environ.get("BROWSY_JOBS_PATH", str(Path().absolute()))
 )
 
+_DEFAULT_DB_POOL_SIZE = 4
+_DEFAULT_DB_READ_POOL_SIZE = 8
+_MAX_BATCH_SIZE = 10000
+_OUTPUT_CHUNK_SIZE = 256 * 1024
+_CACHE_EVICTION_INTERVAL = 60
+_LEASE_CHECK_INTERVAL = 10
+_MAINTENANCE_INTERVAL = 300
+_DEFAULT_MAX_ATTEMPTS = 3
+_MAX_WAIT = 60
+_MAX_PAGE_SIZE = 1000
+_MAX_WATCHED_JOBS = 1000
+_EVENTS_KEEPALIVE_INTERVAL = 15
+_RANGE_HEADER_RE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
 
 def custom_openapi():
     """Custom OpenAPI to include jobs in schema that are dynamically loaded."""
@@ -45,16 +83,138 @@ async def lifespan(app: FastAPI):
         raise ValueError("BROWSY_DB_PATH not set")
 
     app.state.DB_PATH = db_path
+    app.state.NOTIFY_DIR = _notify.get_notify_dir(db_path)
+    app.state.output_store = _storage.get_output_store()
     app.state.startup_time = datetime.now(timezone.utc)
 
-    conn = await _database.create_connection(db_path)
+    # Read-only requests get a larger pool, since they never wait for the
+    # single writer SQLite allows
+    backend = _sqlite.SQLiteBackend(
+        db_path,
+        pool_size=int(
+            os.environ.get("BROWSY_DB_POOL_SIZE", _DEFAULT_DB_POOL_SIZE)
+        ),
+        read_pool_size=int(
+            os.environ.get(
+                "BROWSY_DB_READ_POOL_SIZE", _DEFAULT_DB_READ_POOL_SIZE
+            )
+        ),
+    )
+    await backend.init()
+    app.state.backend = backend
+
+    retention_rules = _retention.get_retention_rules()
+
+    # Every server process (there might be many of them, even in different
+    # containers) gets its own socket for notifications from the workers.
+    listener = _notify.Listener(
+        app.state.NOTIFY_DIR,
+        _notify.SERVERS_CHANNEL,
+        f"{os.getpid()}-{secrets.token_hex(4)}",
+    )
+    job_watcher = _watcher.JobWatcher(backend, listener)
+    app.state.job_watcher = job_watcher
+
+    background_tasks = []
 
     try:
-        await _database.init_db(conn)
+        await backend.open()
+        await listener.start()
+
+        background_tasks.append(asyncio.create_task(job_watcher.run()))
+        background_tasks.append(
+            asyncio.create_task(
+                _requeue_expired_jobs_periodically(
+                    backend,
+                    app.state.NOTIFY_DIR,
+                    int(
+                        os.environ.get(
+                            "BROWSY_MAX_ATTEMPTS", _DEFAULT_MAX_ATTEMPTS
+                        )
+                    ),
+                )
+            )
+        )
+
+        background_tasks.append(
+            asyncio.create_task(
+                _maintain_db_periodically(
+                    backend, retention_rules, app.state.output_store
+                )
+            )
+        )
+
+        if any(job_cls.CACHE_TTL for job_cls in _JOBS_DEFS.values()):
+            background_tasks.append(
+                asyncio.create_task(_evict_cache_periodically(backend))
+            )
+
+        yield
     finally:
-        await conn.close()
+        for task in background_tasks:
+            task.cancel()
+        await asyncio.gather(*background_tasks, return_exceptions=True)
 
-    yield
+        listener.close()
+        await backend.close()
+
+
+async def _requeue_expired_jobs_periodically(
+    backend: _backend.Backend, notify_dir: Path, max_attempts: int
+):
+    while True:
+        await asyncio.sleep(_LEASE_CHECK_INTERVAL)
+        try:
+            requeued, failed = await backend.requeue_expired_jobs(max_attempts)
+        except Exception:
+            logger.exception("Failed to requeue jobs with expired leases")
+            continue
+
+        if requeued:
+            logger.warning(
+                "Requeued %d jobs abandoned by their workers", requeued
+            )
+            _notify.notify(notify_dir, _notify.WORKERS_CHANNEL)
+        if failed:
+            logger.warning(
+                "Marked %d abandoned jobs as failed after %d attempts",
+                failed,
+                max_attempts,
+            )
+        if requeued or failed:
+            _notify.notify(notify_dir, _notify.SERVERS_CHANNEL)
+
+
+async def _maintain_db_periodically(
+    backend: _backend.Backend,
+    retention_rules: List[_retention.RetentionRule],
+    output_store: Optional[_storage.OutputStore],
+):
+    while True:
+        await asyncio.sleep(_MAINTENANCE_INTERVAL)
+        try:
+            deleted = await _retention.enforce_retention(
+                backend, retention_rules, output_store
+            )
+            if deleted:
+                logger.info("Deleted %d jobs past their retention", deleted)
+
+            await backend.compact()
+        except Exception:
+            logger.exception("Failed to maintain the database")
+
+
+async def _evict_cache_periodically(backend: _backend.Backend):
+    while True:
+        await asyncio.sleep(_CACHE_EVICTION_INTERVAL)
+        try:
+            evicted = await backend.evict_cache_entries()
+        except Exception:
+            logger.exception("Failed to evict expired cache entries")
+            continue
+
+        if evicted:
+            logger.info("Evicted %d expired cache entries", evicted)
 
 
 app = FastAPI(
@@ -74,29 +234,44 @@ app = FastAPI(
 )
 app.openapi = custom_openapi
 
+# Latency of requests to this process, exposed by `/metrics`
+_http_latency = _metrics.create_http_histogram()
+
+
+@app.middleware("http")
+async def measure_latency(request: Request, call_next):
+    start_time = time.perf_counter()
+    response = await call_next(request)
+    # Requests are labeled with their route, e.g. /api/v1/jobs/{job_id},
+    # so that every job doesn't get its own series
+    route = request.scope.get("route")
+    _http_latency.observe(
+        time.perf_counter() - start_time,
+        method=request.method,
+        route=route.path if route else "unmatched",
+        status=str(response.status_code),
+    )
+    return response
+
+
 template_dir = resources.files(pkg_name) / "templates"
 templates = Jinja2Templates(directory=template_dir)
 
 
-async def get_db(request: Request):
-    conn = await _database.create_connection(request.app.state.DB_PATH)
-
-    try:
-        yield conn
-    finally:
-        await conn.close()
+def get_backend(request: Request) -> _backend.Backend:
+    return request.app.state.backend
 
 
 class JobRequest(BaseModel):
     name: str
     parameters: dict
+    # Overrides the timeout defined by the job type
+    timeout: Annotated[Optional[float], Field(gt=0)] = None
+    # Overrides the priority defined by the job type, higher goes first
+    priority: Annotated[Optional[int], Field(ge=-(2**31), lt=2**31)] = None
 
 
-@app.post("/api/v1/jobs", response_model=_models.Job, tags=["jobs"])
-async def submit_job(
-    r: JobRequest,
-    db_conn: Annotated[_database.AsyncConnection, Depends(get_db)],
-):
+async def _validate_job_request(r: JobRequest) -> _jobs.BaseJob:
     if r.name not in _JOBS_DEFS:
         raise HTTPException(400, "Job with that name is not defined.")
 
@@ -105,56 +280,373 @@ async def submit_job(
     if not is_valid:
         raise HTTPException(400, "Job validation failed")
 
-    return await _database.create_job(db_conn, r.name, job.model_dump_json())
+    return job
+
+
+def _get_cache_key(name: str, input_json: str) -> Optional[str]:
+    if not _JOBS_DEFS[name].CACHE_TTL:
+        return None
+
+    # Serialized job model is canonical - fields are always in the same order
+    # and defaults are filled in.
+    return hashlib.sha256(f"{name}\0{input_json}".encode()).hexdigest()
+
+
+def _get_priority(r: JobRequest) -> int:
+    if r.priority is None:
+        return _JOBS_DEFS[r.name].PRIORITY
+    return r.priority
+
+
+@app.post("/api/v1/jobs", response_model=_models.Job, tags=["jobs"])
+async def submit_job(
+    r: JobRequest,
+    backend: Annotated[_backend.Backend, Depends(get_backend)],
+):
+    job = await _validate_job_request(r)
+    input_json = job.model_dump_json()
+
+    db_job = await backend.create_job(
+        _backend.NewJob(
+            r.name,
+            input_json,
+            _get_cache_key(r.name, input_json),
+            r.timeout,
+            _get_priority(r),
+        )
+    )
+    if db_job.status == _models.JobStatus.PENDING:
+        _notify.notify(app.state.NOTIFY_DIR, _notify.WORKERS_CHANNEL)
+
+    return db_job
+
+
+@app.post(
+    "/api/v1/jobs/batch", response_model=List[_models.Job], tags=["jobs"]
+)
+async def submit_jobs(
+    rs: List[JobRequest],
+    backend: Annotated[_backend.Backend, Depends(get_backend)],
+):
+    if len(rs) > _MAX_BATCH_SIZE:
+        raise HTTPException(
+            400, f"Batch can't contain more than {_MAX_BATCH_SIZE} jobs."
+        )
+
+    # Either all jobs are queued or none of them
+    jobs = []
+    for i, r in enumerate(rs):
+        try:
+            job = await _validate_job_request(r)
+        except HTTPException as e:
+            raise HTTPException(
+                e.status_code, f"Job at index {i}: {e.detail}"
+            ) from e
+        input_json = job.model_dump_json()
+        jobs.append(
+            _backend.NewJob(
+                r.name,
+                input_json,
+                _get_cache_key(r.name, input_json),
+                r.timeout,
+                _get_priority(r),
+            )
+        )
+
+    db_jobs = await backend.create_jobs(jobs)
+    if any(j.status == _models.JobStatus.PENDING for j in db_jobs):
+        _notify.notify(app.state.NOTIFY_DIR, _notify.WORKERS_CHANNEL)
+
+    return db_jobs
+
+
+@app.get("/api/v1/jobs", response_model=_models.JobsPage, tags=["jobs"])
+async def list_jobs(
+    backend: Annotated[_backend.Backend, Depends(get_backend)],
+    status: Optional[_models.JobStatus] = None,
+    name: Optional[str] = None,
+    limit: Annotated[int, Query(ge=1, le=_MAX_PAGE_SIZE)] = 50,
+    cursor: Annotated[
+        Optional[str],
+        Query(description="`next_cursor` or `prev_cursor` of another page"),
+    ] = None,
+):
+    """Lists jobs from the newest ones, a page at a time."""
+    try:
+        return await backend.list_jobs(
+            status=status, name=name, limit=limit, cursor=cursor
+        )
+    except ValueError as e:
+        raise HTTPException(400, str(e)) from e
+
+
+@app.get("/api/v1/jobs/events", tags=["jobs"])
+async def stream_job_events(
+    request: Request,
+    backend: Annotated[_backend.Backend, Depends(get_backend)],
+    ids: Annotated[List[int], Query(description="IDs of watched jobs")],
+):
+    """Streams status changes of the jobs as server-sent events.
+
+    The current status of every job is sent first, followed by an event for
+    each change. The stream ends once all jobs are finished.
+    """
+    if len(ids) > _MAX_WATCHED_JOBS:
+        raise HTTPException(
+            400, f"Can't watch more than {_MAX_WATCHED_JOBS} jobs at once."
+        )
+
+    jobs = await backend.get_jobs_by_ids(set(ids))
+    if not jobs:
+        raise HTTPException(404, "Jobs not found")
+
+    return StreamingResponse(
+        _job_events(request.app.state.job_watcher, jobs),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+async def _job_events(
+    job_watcher: _watcher.JobWatcher, jobs: List[_models.Job]
+) -> AsyncIterator[str]:
+    statuses = {}
+    for job in jobs:
+        yield _format_job_event(job)
+        if not job.status.is_finished:
+            statuses[job.id] = job.status
+
+    while statuses:
+        changed = await job_watcher.wait_for_changes(
+            dict(statuses), _EVENTS_KEEPALIVE_INTERVAL
+        )
+        if not changed:
+            # Comment lines keep idle connections from being dropped by proxies
+            yield ": keepalive\n\n"
+            continue
+
+        for job in changed:
+            yield _format_job_event(job)
+            if job.status.is_finished:
+                del statuses[job.id]
+            else:
+                statuses[job.id] = job.status
+
+
+def _format_job_event(job: _models.Job) -> str:
+    return f"event: status\ndata: {job.model_dump_json()}\n\n"
 
 
 @app.get("/api/v1/jobs/{job_id}", response_model=_models.Job, tags=["jobs"])
 async def get_job_by_id(
-    job_id: int, db_conn: Annotated[_database.AsyncConnection, Depends(get_db)]
+    job_id: int,
+    request: Request,
+    backend: Annotated[_backend.Backend, Depends(get_backend)],
+    wait: Annotated[
+        Optional[float],
+        Query(
+            ge=0,
+            le=_MAX_WAIT,
+            description=(
+                "Number of seconds to wait for a status change of an"
+                " unfinished job before responding"
+            ),
+        ),
+    ] = None,
 ):
-    job = await _database.get_job_by_id(db_conn, job_id)
+    job = await backend.get_job(job_id)
     if not job:
         raise HTTPException(404, "Job not found")
 
+    if wait and not job.status.is_finished:
+        changed = await request.app.state.job_watcher.wait_for_changes(
+            {job.id: job.status}, wait
+        )
+        if changed:
+            job = changed[0]
+
     return job
 
 
-@app.get("/api/v1/jobs/{job_id}/result", tags=["jobs"])
-async def get_job_result_by_job_id(
-    job_id: int, db_conn: Annotated[_database.AsyncConnection, Depends(get_db)]
+@app.post(
+    "/api/v1/jobs/{job_id}/cancel", response_model=_models.Job, tags=["jobs"]
+)
+async def cancel_job(
+    job_id: int,
+    backend: Annotated[_backend.Backend, Depends(get_backend)],
 ):
-    job = await _database.get_job_by_id(db_conn, job_id)
+    """Cancels a pending job or interrupts a job in progress."""
+    job, cancelled = await backend.cancel_job(job_id)
     if not job:
-        raise HTTPException(404)
+        raise HTTPException(404, "Job not found")
+    if not cancelled:
+        raise HTTPException(409, f"Job is already {job.status.value}")
 
-    headers = {
-        "X-Job-Status": job.status,
-        "X-Job-Last-Updated": job.updated_at.isoformat(),
-    }
+    _notify.notify(app.state.NOTIFY_DIR, _notify.CANCEL_CHANNEL)
+    _notify.notify(app.state.NOTIFY_DIR, _notify.SERVERS_CHANNEL)
 
-    if job.status in (_models.JobStatus.IN_PROGRESS, _models.JobStatus.PENDING):
-        return Response(202, headers=headers)
+    return job
 
-    if job.status == _models.JobStatus.FAILED:
-        return Response(204, headers=headers)
 
-    job_result = await _database.get_job_result_by_job_id(db_conn, job_id)
-    if job_result is None:
-        return Response(204, headers=headers)
+@app.get("/api/v1/jobs/{job_id}/result", tags=["jobs"])
+async def get_job_result_by_job_id(
+    job_id: int,
+    request: Request,
+    backend: Annotated[_backend.Backend, Depends(get_backend)],
+):
+    job = await backend.get_job(job_id)
+    if not job:
+        raise HTTPException(404)
 
-    return Response(
-        content=job_result,
-        status_code=200,
+    headers = {"X-Job-Status": job.status}
+    if job.updated_at:
+        headers["X-Job-Last-Updated"] = job.updated_at.isoformat()
+
+    if job.status in (
+        _models.JobStatus.IN_PROGRESS,
+        _models.JobStatus.PENDING,
+    ):
+        return Response(status_code=202, headers=headers)
+
+    if job.status != _models.JobStatus.DONE:
+        return Response(status_code=204, headers=headers)
+
+    output = await backend.get_job_output_info(job_id)
+    if output is None:
+        return Response(status_code=204, headers=headers)
+
+    output_path = None
+    if output.path:
+        output_store = request.app.state.output_store
+        if not output_store:
+            raise HTTPException(
+                500, "Output is saved in the output store, but it's disabled"
+            )
+        output_path = output_store.resolve(output.path)
+
+    if output.encoding:
+        headers["Vary"] = "Accept-Encoding"
+
+        # Compressed outputs are passed through as they are stored, unless
+        # the client can't handle the encoding.
+        accept_encoding = request.headers.get("accept-encoding")
+        if not _compression.accepts_encoding(accept_encoding, output.encoding):
+            if not _compression.is_supported(output.encoding):
+                raise HTTPException(
+                    406, f"Output is only available as {output.encoding}"
+                )
+
+            chunks = (
+                _stream_file(output_path)
+                if output_path
+                else _stream_output(backend, output.id, 0, output.size)
+            )
+            return StreamingResponse(
+                _decompress(chunks, output.encoding),
+                status_code=200,
+                media_type="application/octet-stream",
+                headers=headers,
+            )
+
+        headers["Content-Encoding"] = output.encoding
+
+    if output_path:
+        # FileResponse handles range requests on its own
+        return FileResponse(
+            output_path,
+            media_type="application/octet-stream",
+            headers=headers,
+        )
+
+    headers["Accept-Ranges"] = "bytes"
+    status_code = 200
+    start, end = 0, output.size
+
+    range_header = request.headers.get("range")
+    byte_range = range_header and _parse_range(range_header, output.size)
+    if byte_range:
+        start, end = byte_range
+        status_code = 206
+        headers["Content-Range"] = f"bytes {start}-{end - 1}/{output.size}"
+
+    headers["Content-Length"] = str(end - start)
+
+    return StreamingResponse(
+        _stream_output(backend, output.id, start, end),
+        status_code=status_code,
         media_type="application/octet-stream",
         headers=headers,
     )
 
 
+def _parse_range(header: str, size: int) -> Optional[Tuple[int, int]]:
+    """Parses a single-range `Range` header into [start, end) offsets.
+
+    Returns None if the header should be ignored - malformed values and
+    multiple ranges are answered with the whole output.
+    """
+    match = _RANGE_HEADER_RE.match(header.strip())
+    if not match or match.groups() == ("", ""):
+        return None
+
+    first, last = match.groups()
+    if not first:
+        # Suffix range, e.g. "bytes=-500" means the last 500 bytes
+        start, end = max(size - int(last), 0), size
+    else:
+        start = int(first)
+        end = min(int(last) + 1, size) if last else size
+
+    if start >= end:
+        raise HTTPException(416, headers={"Content-Range": f"bytes */{size}"})
+
+    return start, end
+
+
+async def _stream_output(
+    backend: _backend.Backend, output_id: int, start: int, end: int
+) -> AsyncIterator[bytes]:
+    # Output is read a chunk at a time, so slow clients don't keep database
+    # connections away from other requests.
+    offset = start
+    while offset < end:
+        size = min(_OUTPUT_CHUNK_SIZE, end - offset)
+        chunk = await backend.read_output_chunk(output_id, offset, size)
+        if not chunk:
+            break
+        offset += len(chunk)
+        yield chunk
+
+
+async def _stream_file(path: Path) -> AsyncIterator[bytes]:
+    with open(path, "rb") as f:
+        while chunk := await asyncio.to_thread(f.read, _OUTPUT_CHUNK_SIZE):
+            yield chunk
+
+
+async def _decompress(
+    chunks: AsyncIterator[bytes], encoding: str
+) -> AsyncIterator[bytes]:
+    decompressor = _compression.Decompressor(encoding)
+    async for chunk in chunks:
+        yield decompressor.decompress(chunk)
+    yield decompressor.flush()
+
+
 @app.get("/health", include_in_schema=False)
-async def healthcheck(_: Annotated[_database.AsyncConnection, Depends(get_db)]):
+async def healthcheck():
     return {"status": "ok", "version": __version__}
 
 
+@app.get("/metrics", include_in_schema=False)
+async def get_metrics(
+    backend: Annotated[_backend.Backend, Depends(get_backend)],
+):
+    """Exposes metrics in the Prometheus text format."""
+    content = await _metrics.render(backend, [_http_latency])
+    return Response(content, media_type=_metrics.CONTENT_TYPE)
+
+
 @app.get("/internal", include_in_schema=False)
 async def get_monitoring():
     return RedirectResponse(url="/internal/workers")
@@ -163,10 +655,10 @@ async def get_monitoring():
 @app.get("/internal/workers", include_in_schema=False)
 async def get_workers_information(
     request: Request,
-    db_conn: Annotated[_database.AsyncConnection, Depends(get_db)],
+    backend: Annotated[_backend.Backend, Depends(get_backend)],
 ):
-    workers = await _database.get_workers(
-        db_conn, last_activity_time_ge=app.state.startup_time
+    workers = await backend.get_workers(
+        last_activity_time_ge=app.state.startup_time
     )
     return templates.TemplateResponse(
         request=request, name="workers.html", context={"workers": workers}
@@ -176,18 +668,33 @@ async def get_workers_information(
 @app.get("/internal/jobs", include_in_schema=False)
 async def get_jobs_information(
     request: Request,
-    db_conn: Annotated[_database.AsyncConnection, Depends(get_db)],
-    limit: Optional[int] = None,
-    offset: Optional[int] = None,
+    backend: Annotated[_backend.Backend, Depends(get_backend)],
+    status: Optional[_models.JobStatus] = None,
+    limit: Annotated[Optional[int], Query(ge=1, le=_MAX_PAGE_SIZE)] = None,
+    cursor: Optional[str] = None,
 ):
-    jobs, count = await _database.get_jobs(db_conn, limit=limit, offset=offset)
-    for j in jobs:
+    try:
+        page = await backend.list_jobs(
+            status=status, limit=limit, cursor=cursor
+        )
+    except ValueError as e:
+        raise HTTPException(400, str(e)) from e
+    counts = await backend.get_job_counts()
+
+    for j in page.jobs:
         j.status = j.status.value
     return templates.TemplateResponse(
         request=request,
         name="jobs.html",
         context={
-            "jobs": jobs,
-            "pagination": {"limit": limit, "offset": offset, "count": count},
+            "jobs": page.jobs,
+            "counts": {s.value: c for s, c in counts.items()},
+            "pagination": {
+                "limit": limit,
+                "status": status.value if status else None,
+                "total": page.total,
+                "next_cursor": page.next_cursor,
+                "prev_cursor": page.prev_cursor,
+            },
         },
     )
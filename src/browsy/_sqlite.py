@@ -0,0 +1,342 @@
+import asyncio
+import logging
+import os
+import sqlite3
+from datetime import datetime
+from typing import Collection, Dict, Iterable, List, Optional, Tuple, Union
+
+from browsy import _backend, _database, _models, _storage
+
+logger = logging.getLogger(__name__)
+
+# Worker events and free pages are deleted in small batches, so the database
+# is never locked for long, with a pause between them to let other writers in
+_COMPACT_BATCH_SIZE = 500
+_COMPACT_BATCH_PAUSE = 0.05
+_VACUUM_BATCH_PAGES = 1000
+
+# Memory samples and other worker events are only useful for a while
+_WORKER_EVENTS_MAX_AGE = 7 * 24 * 3600
+
+
+class SQLiteBackend(_backend.Backend):
+    """Keeps everything in an SQLite database file.
+
+    The database is shared by all processes using the same file. SQLite
+    allows a single writer at a time anyway, so reads get a separate pool of
+    connections and never queue behind writes. Every call holds a connection
+    only for its own statements, so concurrent calls never end up in each
+    other's transactions.
+    """
+
+    TRANSIENT_ERRORS = (sqlite3.OperationalError,)
+
+    def __init__(
+        self, db_path: str, pool_size: int = 4, read_pool_size: int = 8
+    ) -> None:
+        self.db_path = db_path
+        self._pool = _database.ConnectionPool(db_path, size=pool_size)
+        self._read_pool = _database.ConnectionPool(
+            db_path, size=read_pool_size, read_only=True
+        )
+
+    async def open(self) -> None:
+        await self._pool.open()
+        await self._read_pool.open()
+
+    async def close(self) -> None:
+        await self._read_pool.close()
+        await self._pool.close()
+
+    async def init(self) -> None:
+        conn = await _database.create_connection(self.db_path)
+        try:
+            await _database.init_db(conn)
+            async with conn.execute("PRAGMA auto_vacuum") as cursor:
+                auto_vacuum = (await cursor.fetchone())[0]
+        finally:
+            await conn.close()
+
+        if auto_vacuum != 2:  # INCREMENTAL
+            logger.warning(
+                "Space of deleted jobs can't be returned to the filesystem,"
+                " since the database was created without incremental"
+                " auto-vacuum. To enable it, stop browsy and run"
+                " `PRAGMA auto_vacuum = INCREMENTAL; VACUUM;` on the"
+                " database."
+            )
+
+    # Jobs
+
+    async def create_job(self, job: _backend.NewJob) -> _models.Job:
+        async with self._pool.connection() as conn:
+            return await _database.create_job(conn, *job)
+
+    async def create_jobs(
+        self, jobs: List[_backend.NewJob]
+    ) -> List[_models.Job]:
+        async with self._pool.connection() as conn:
+            return await _database.create_jobs(conn, jobs)
+
+    async def get_job(self, job_id: int) -> Optional[_models.Job]:
+        async with self._read_pool.connection() as conn:
+            return await _database.get_job_by_id(conn, job_id)
+
+    async def get_jobs_by_ids(self, ids: Iterable[int]) -> List[_models.Job]:
+        async with self._read_pool.connection() as conn:
+            return await _database.get_jobs_by_ids(conn, ids)
+
+    async def list_jobs(
+        self,
+        status: Optional[_models.JobStatus] = None,
+        name: Optional[str] = None,
+        limit: Optional[int] = None,
+        cursor: Optional[str] = None,
+    ) -> _models.JobsPage:
+        async with self._read_pool.connection() as conn:
+            return await _database.get_jobs(
+                conn, status=status, name=name, limit=limit, cursor=cursor
+            )
+
+    async def get_job_counts(
+        self, name: Optional[str] = None
+    ) -> Dict[_models.JobStatus, int]:
+        async with self._read_pool.connection() as conn:
+            return await _database.get_job_counts(conn, name)
+
+    async def cancel_job(self, job_id: int) -> _backend.CancelResult:
+        async with self._pool.connection() as conn:
+            return await _database.cancel_job(conn, job_id)
+
+    # Queue
+
+    async def has_pending_jobs(
+        self, names: Optional[Collection[str]] = None
+    ) -> bool:
+        async with self._read_pool.connection() as conn:
+            return await _database.has_pending_jobs(conn, names)
+
+    async def get_queue_stats(
+        self, names: Optional[Collection[str]] = None
+    ) -> _backend.QueueStats:
+        async with self._read_pool.connection() as conn:
+            return await _database.get_queue_stats(conn, names)
+
+    async def claim_jobs(
+        self,
+        worker: str,
+        limit: int,
+        lease_duration: float = _backend.DEFAULT_LEASE_DURATION,
+        names: Optional[Collection[str]] = None,
+    ) -> List[_models.Job]:
+        async with self._pool.connection() as conn:
+            return await _database.claim_jobs(
+                conn, worker, limit, lease_duration, names
+            )
+
+    async def complete_job(
+        self,
+        worker: str,
+        job_id: int,
+        status: _backend.FinalStatus,
+        processing_time: int,
+        output: Union[bytes, _storage.StoredOutput, None],
+        output_encoding: Optional[str] = None,
+        cache_ttl: Optional[int] = None,
+        timings: Optional[Dict[str, float]] = None,
+        output_size: Optional[int] = None,
+    ) -> bool:
+        async with self._pool.connection() as conn:
+            return await _database.update_job_status(
+                conn,
+                worker=worker,
+                job_id=job_id,
+                status=status,
+                processing_time=processing_time,
+                output=output,
+                output_encoding=output_encoding,
+                cache_ttl=cache_ttl,
+                timings=timings,
+                output_size=output_size,
+            )
+
+    async def add_job_timings(
+        self, timings: Dict[int, Dict[str, float]]
+    ) -> None:
+        async with self._pool.connection() as conn:
+            await _database.add_job_timings(conn, timings)
+
+    async def requeue_job(self, job_id: int) -> None:
+        async with self._pool.connection() as conn:
+            await _database.requeue_job(conn, job_id)
+
+    async def requeue_expired_jobs(self, max_attempts: int) -> Tuple[int, int]:
+        async with self._pool.connection() as conn:
+            return await _database.requeue_expired_jobs(conn, max_attempts)
+
+    async def evict_cache_entries(self) -> int:
+        async with self._pool.connection() as conn:
+            return await _database.evict_cache_entries(conn)
+
+    # Outputs
+
+    async def get_job_output_info(
+        self, job_id: int
+    ) -> Optional[_backend.DBOutputInfo]:
+        async with self._read_pool.connection() as conn:
+            return await _database.get_job_output_info(conn, job_id)
+
+    async def read_output_chunk(
+        self, output_id: int, offset: int, size: int
+    ) -> bytes:
+        async with self._read_pool.connection() as conn:
+            return await _database.read_output_chunk(
+                conn, output_id, offset, size
+            )
+
+    # Workers
+
+    async def check_in_worker(self, worker: str) -> None:
+        async with self._pool.connection() as conn:
+            await _database.check_in_worker(conn, worker)
+
+    async def heartbeat(
+        self,
+        worker: str,
+        job_ids: Iterable[int],
+        lease_duration: float = _backend.DEFAULT_LEASE_DURATION,
+        timings: Optional[Dict[int, Dict[str, float]]] = None,
+    ) -> None:
+        async with self._pool.connection() as conn:
+            await _database.update_worker_activity(conn, worker, commit=False)
+            await _database.extend_leases(
+                conn, worker, job_ids, lease_duration, commit=False
+            )
+            if timings:
+                await _database.add_job_timings(conn, timings, commit=False)
+            await conn.commit()
+
+    async def add_worker_event(
+        self,
+        worker: str,
+        event: _backend.WorkerEventType,
+        browser_memory: Optional[int] = None,
+        browser_jobs: Optional[int] = None,
+        browser_age: Optional[float] = None,
+        reason: Optional[str] = None,
+        slots: Optional[int] = None,
+    ) -> None:
+        async with self._pool.connection() as conn:
+            await _database.add_worker_event(
+                conn,
+                worker,
+                event,
+                browser_memory=browser_memory,
+                browser_jobs=browser_jobs,
+                browser_age=browser_age,
+                reason=reason,
+                slots=slots,
+            )
+
+    async def get_workers(
+        self, last_activity_time_ge: Optional[datetime] = None
+    ) -> List[_backend.DBWorker]:
+        async with self._read_pool.connection() as conn:
+            return await _database.get_workers(conn, last_activity_time_ge)
+
+    async def count_live_workers(self, max_idle: float) -> int:
+        async with self._read_pool.connection() as conn:
+            return await _database.count_live_workers(conn, max_idle)
+
+    # Metrics
+
+    async def get_job_counts_by_name(
+        self,
+    ) -> Dict[Tuple[str, _models.JobStatus], int]:
+        async with self._read_pool.connection() as conn:
+            return await _database.get_job_counts_by_name(conn)
+
+    async def get_job_metrics(
+        self,
+    ) -> List[Tuple[str, str, float, int, float]]:
+        async with self._read_pool.connection() as conn:
+            return await _database.get_job_metrics(conn)
+
+    async def get_storage_metrics(self) -> List[Tuple[str, str, float]]:
+        return [
+            (
+                "browsy_db_size_bytes",
+                "Size of the database file",
+                _get_file_size(self.db_path),
+            ),
+            (
+                "browsy_db_wal_size_bytes",
+                "Size of the WAL",
+                _get_file_size(f"{self.db_path}-wal"),
+            ),
+        ]
+
+    # Retention
+
+    async def get_expired_job_ids(
+        self,
+        max_age: float,
+        limit: int,
+        name: Optional[str] = None,
+        status: Optional[_models.JobStatus] = None,
+    ) -> List[int]:
+        async with self._read_pool.connection() as conn:
+            return await _database.get_expired_job_ids(
+                conn, max_age, limit, name=name, status=status
+            )
+
+    async def get_excess_job_ids(
+        self,
+        max_count: int,
+        limit: int,
+        name: Optional[str] = None,
+        status: Optional[_models.JobStatus] = None,
+    ) -> List[int]:
+        async with self._read_pool.connection() as conn:
+            return await _database.get_excess_job_ids(
+                conn, max_count, limit, name=name, status=status
+            )
+
+    async def delete_jobs(self, ids: List[int]) -> List[str]:
+        async with self._pool.connection() as conn:
+            return await _database.delete_jobs(conn, ids)
+
+    async def is_output_path_used(self, path: str) -> bool:
+        async with self._read_pool.connection() as conn:
+            return await _database.is_output_path_used(conn, path)
+
+    async def compact(self) -> None:
+        """Deletes old worker events and returns unused space to the system."""
+        while True:
+            async with self._pool.connection() as conn:
+                deleted = await _database.delete_worker_events(
+                    conn, _WORKER_EVENTS_MAX_AGE, _COMPACT_BATCH_SIZE
+                )
+            if deleted < _COMPACT_BATCH_SIZE:
+                break
+            await asyncio.sleep(_COMPACT_BATCH_PAUSE)
+
+        while True:
+            async with self._pool.connection() as conn:
+                free_pages = await _database.reclaim_free_pages(
+                    conn, _VACUUM_BATCH_PAGES
+                )
+            if not free_pages:
+                break
+            await asyncio.sleep(_COMPACT_BATCH_PAUSE)
+
+        async with self._pool.connection() as conn:
+            if not await _database.checkpoint_wal(conn):
+                logger.debug("WAL checkpoint was blocked by other connections")
+
+
+def _get_file_size(path: str) -> int:
+    try:
+        return os.path.getsize(path)
+    except FileNotFoundError:
+        return 0
@@ -0,0 +1,77 @@
+import hashlib
+import os
+import tempfile
+import time
+from pathlib import Path
+from typing import Optional, Union
+
+from pydantic import BaseModel
+
+
+class StoredOutput(BaseModel):
+    path: str  # relative to the store's root
+    hash: str  # SHA-256 of the content
+    size: int
+
+
+class OutputStore:
+    """Content-addressed store of job outputs on the filesystem.
+
+    Files are named after the SHA-256 of their content, so identical outputs
+    are stored only once. Paths saved in the database are relative to the
+    root, which lets the server and workers mount the store in different
+    places.
+    """
+
+    def __init__(self, root: Union[str, Path]) -> None:
+        self.root = Path(root)
+
+    def put(self, data: bytes) -> StoredOutput:
+        digest = hashlib.sha256(data).hexdigest()
+        rel_path = f"{digest[:2]}/{digest[2:4]}/{digest}"
+        path = self.root / rel_path
+
+        try:
+            # Marks the file as fresh, so it isn't deleted as unused before
+            # the new reference to it is saved
+            os.utime(path)
+        except FileNotFoundError:
+            path.parent.mkdir(parents=True, exist_ok=True)
+
+            # Written under a temporary name and renamed, so readers never
+            # see a partially written file
+            fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=".tmp-")
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    f.write(data)
+                os.chmod(tmp_path, 0o644)
+                os.replace(tmp_path, path)
+            except BaseException:
+                os.unlink(tmp_path)
+                raise
+
+        return StoredOutput(path=rel_path, hash=digest, size=len(data))
+
+    def resolve(self, rel_path: str) -> Path:
+        return self.root / rel_path
+
+    def delete(self, rel_path: str, min_age: float = 0) -> bool:
+        """Deletes the file, unless it was stored less than `min_age` ago.
+
+        Returns:
+            True if the file was deleted.
+        """
+        path = self.resolve(rel_path)
+        try:
+            if time.time() - path.stat().st_mtime < min_age:
+                return False
+            path.unlink()
+        except FileNotFoundError:
+            return False
+        return True
+
+
+def get_output_store() -> Optional[OutputStore]:
+    """Returns the store configured with BROWSY_OUTPUT_PATH, if any."""
+    output_path = os.environ.get("BROWSY_OUTPUT_PATH")
+    return OutputStore(output_path) if output_path else None
@@ -0,0 +1,198 @@
+import logging
+import math
+import multiprocessing
+import os
+import signal
+import time
+from multiprocessing.connection import wait
+from multiprocessing.context import SpawnProcess
+from typing import Any, Callable, Dict, List, Optional
+
+logger = logging.getLogger("supervisor")
+
+# A crashed worker is restarted after a delay that doubles with every crash
+# in a row, up to the maximum. Once it runs for a while, the delay is reset.
+_MIN_RESTART_DELAY = 1
+_MAX_RESTART_DELAY = 60
+_STABLE_UPTIME = 60
+_STATUS_INTERVAL = 300
+# Workers fail their jobs in progress and close their browsers on shutdown,
+# which doesn't take long. Workers still running after this are killed.
+_SHUTDOWN_TIMEOUT = 30
+# How often restarts and signals are checked while waiting for exits
+_WAIT_INTERVAL = 1
+
+
+class _Child:
+    """Worker process restarted by the supervisor whenever it exits."""
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.process: Optional[SpawnProcess] = None
+        self.started_at = 0.0
+        self.restarts = 0
+        self.crashes = 0  # in a row
+        self.restart_at: Optional[float] = None
+        self.exit_code: Optional[int] = None
+
+    @property
+    def is_running(self) -> bool:
+        return self.process is not None and self.process.exitcode is None
+
+    def start(
+        self,
+        ctx: multiprocessing.context.SpawnContext,
+        target: Callable[..., None],
+        kwargs: Dict[str, Any],
+    ) -> None:
+        self.process = ctx.Process(
+            target=_run_child,
+            args=(target, self.name, kwargs),
+            name=self.name,
+        )
+        self.process.start()
+        self.started_at = time.monotonic()
+        self.restart_at = None
+
+    def on_exit(self) -> float:
+        """Schedules a restart of the exited process, returns its delay."""
+        self.exit_code = self.process.exitcode
+        self.process.close()
+        self.process = None
+
+        now = time.monotonic()
+        if now - self.started_at >= _STABLE_UPTIME:
+            self.crashes = 0
+        delay = min(_MIN_RESTART_DELAY * 2**self.crashes, _MAX_RESTART_DELAY)
+        self.crashes += 1
+        self.restarts += 1
+        self.restart_at = now + delay
+        return delay
+
+    def status(self) -> str:
+        now = time.monotonic()
+        if self.is_running:
+            state = (
+                f"running (pid {self.process.pid},"
+                f" up {_format_duration(now - self.started_at)})"
+            )
+        elif self.restart_at is not None:
+            delay = math.ceil(max(self.restart_at - now, 0))
+            state = f"restarting in {_format_duration(delay)}"
+        else:
+            state = "stopped"
+        if self.exit_code is not None:
+            state += f", last exit code {self.exit_code}"
+        return f"{self.name}: {state}, restarts: {self.restarts}"
+
+
+def supervise(
+    names: List[str], target: Callable[..., None], **kwargs: Any
+) -> None:
+    """Runs `target(name, **kwargs)` in a process for each of the names.
+
+    Processes that exit are restarted with backoff. On SIGINT or SIGTERM,
+    all processes are sent SIGTERM and given some time to shut down.
+    """
+    # Children don't inherit the parent's state (e.g. its event loop)
+    ctx = multiprocessing.get_context("spawn")
+    children = [_Child(name) for name in names]
+    received: List[signal.Signals] = []
+
+    def handle_signal(signum: int, frame: Any) -> None:
+        received.append(signal.Signals(signum))
+
+    for s in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(s, handle_signal)
+
+    for child in children:
+        child.start(ctx, target, kwargs)
+    logger.info("Started %d worker processes", len(children))
+    _log_status(children)
+    next_status_at = time.monotonic() + _STATUS_INTERVAL
+
+    while not received:
+        wait(
+            [c.process.sentinel for c in children if c.process],
+            timeout=_WAIT_INTERVAL,
+        )
+        if received:
+            break
+
+        changed = False
+        for child in children:
+            if child.process and child.process.exitcode is not None:
+                delay = child.on_exit()
+                logger.warning(
+                    "Worker %s exited with code %s, restarting in %ds",
+                    child.name,
+                    child.exit_code,
+                    delay,
+                )
+                changed = True
+            elif child.restart_at and time.monotonic() >= child.restart_at:
+                child.start(ctx, target, kwargs)
+                logger.info("Worker %s restarted", child.name)
+                changed = True
+
+        if changed or time.monotonic() >= next_status_at:
+            _log_status(children)
+            next_status_at = time.monotonic() + _STATUS_INTERVAL
+
+    _stop(children, received[0])
+
+
+def _stop(children: List[_Child], s: signal.Signals) -> None:
+    logger.info(
+        f"Received shutdown signal {s.name!r}. Stopping worker processes..."
+    )
+    for child in children:
+        child.restart_at = None
+        if child.is_running:
+            try:
+                os.kill(child.process.pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass  # exited meanwhile
+
+    deadline = time.monotonic() + _SHUTDOWN_TIMEOUT
+    for child in children:
+        if child.process:
+            child.process.join(max(deadline - time.monotonic(), 0))
+
+    for child in children:
+        if child.is_running:
+            logger.warning(
+                "Worker %s didn't stop in time, killing it", child.name
+            )
+            child.process.kill()
+            child.process.join()
+        if child.process:
+            child.exit_code = child.process.exitcode
+    _log_status(children)
+
+
+def _run_child(
+    target: Callable[..., None], name: str, kwargs: Dict[str, Any]
+) -> None:
+    # Signals sent to the terminal's foreground process group (e.g. Ctrl+C)
+    # reach only the supervisor, so every child is asked to stop exactly
+    # once. A second signal would cut the child's graceful shutdown short.
+    os.setpgid(0, 0)
+    target(name, **kwargs)
+
+
+def _log_status(children: List[_Child]) -> None:
+    logger.info(
+        "Worker processes:\n%s",
+        "\n".join(f"  {child.status()}" for child in children),
+    )
+
+
+def _format_duration(seconds: float) -> str:
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    if hours:
+        return f"{hours}h {minutes}m"
+    if minutes:
+        return f"{minutes}m {seconds}s"
+    return f"{seconds}s"
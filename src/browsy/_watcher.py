@@ -0,0 +1,86 @@
+import asyncio
+import logging
+from typing import Dict, List, Tuple
+
+from browsy import _backend, _models, _notify
+
+logger = logging.getLogger(__name__)
+
+# Workers notify the server about every status change, polling only makes
+# up for notifications that got lost.
+_POLL_INTERVAL = 1
+
+
+class JobWatcher:
+    """Wakes up requests waiting for job status changes.
+
+    All waiting requests are served by a single loop. Whenever a worker
+    reports a change, it reads the statuses of all watched jobs at
+    once, instead of every request polling the database on its own.
+    """
+
+    def __init__(
+        self, backend: _backend.Backend, listener: _notify.Listener
+    ) -> None:
+        self._backend = backend
+        self._listener = listener
+        self._waiters: List[
+            Tuple[Dict[int, _models.JobStatus], asyncio.Future]
+        ] = []
+
+    async def wait_for_changes(
+        self, statuses: Dict[int, _models.JobStatus], timeout: float
+    ) -> List[_models.Job]:
+        """Waits until any of the jobs has a status different than given.
+
+        Args:
+            statuses: Last known status of each watched job, by job ID.
+            timeout: Maximum number of seconds to wait.
+
+        Returns:
+            Jobs whose status changed, or an empty list on timeout.
+        """
+        future = asyncio.get_running_loop().create_future()
+        waiter = (statuses, future)
+        self._waiters.append(waiter)
+
+        # The status might have changed before the waiter was registered
+        self._listener.wake()
+
+        try:
+            return await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            return []
+        finally:
+            self._waiters.remove(waiter)
+
+    async def run(self) -> None:
+        while True:
+            await self._listener.wait(_POLL_INTERVAL)
+            if not self._waiters:
+                continue
+
+            try:
+                await self._check_waiters()
+            except Exception:
+                logger.exception("Failed to check statuses of watched jobs")
+
+    async def _check_waiters(self) -> None:
+        waiters = list(self._waiters)
+        job_ids = set()
+        for statuses, _ in waiters:
+            job_ids.update(statuses)
+
+        jobs = {j.id: j for j in await self._backend.get_jobs_by_ids(job_ids)}
+
+        for statuses, future in waiters:
+            if future.done():
+                continue
+
+            changed = [
+                jobs[job_id]
+                for job_id, status in statuses.items()
+                if job_id in jobs and jobs[job_id].status != status
+            ]
+            if changed:
+                future.set_result(changed)
@@ -2,16 +2,24 @@ import asyncio
 import logging
 import signal
 import time
-from typing import Optional
+from pathlib import Path
+from typing import Dict, List, NamedTuple, Optional, Set, Type
 
-from playwright.async_api import (
-    PlaywrightContextManager,
-    Browser,
-    Error as PlaywrightError,
-)
+from playwright.async_api import Error as PlaywrightError
 from playwright._impl._errors import TargetClosedError
 
-from browsy import _database, _jobs, _models
+from browsy import (
+    _assets,
+    _backend,
+    _browser,
+    _compression,
+    _jobs,
+    _models,
+    _notify,
+    _scaling,
+    _sqlite,
+    _storage,
+)
 
 logging.basicConfig(
     level=logging.INFO,
@@ -19,111 +27,707 @@ logging.basicConfig(
 )
 logger = logging.getLogger("worker")
 
+# Idle workers are woken up by notifications from the server. Polling is only
+# a fallback, so its interval backs off from the minimum up to the maximum.
+_MIN_JOB_POLL_INTERVAL = 0.25
 _JOB_POLL_INTERVAL = 5
-_HEARTBEAT_LOG_INTERVAL = 60
+# Leases on claimed jobs are extended a few times before they'd expire, so
+# a single delayed heartbeat doesn't cost the worker its jobs
+_HEARTBEAT_INTERVAL = _backend.DEFAULT_LEASE_DURATION / 4
+_MEMORY_SAMPLE_INTERVAL = 30
+# Cancellations are announced with notifications, polling is a fallback
+_CANCEL_POLL_INTERVAL = 5
+# How often autoscaling workers look at the queue
+_AUTOSCALE_INTERVAL = 2
+
+
+class _ClaimedJob(NamedTuple):
+    job: _models.Job
+    claim_time: float  # milliseconds the claim took
+    claimed_at: float  # `time.perf_counter()` once claimed
+
+
+class _Capacity:
+    """Slots taking jobs, out of all slots of the worker.
+
+    Every slot owns one permit of `free_slots` while it's busy with a job,
+    and permits of inactive slots are held here, so no job is claimed for
+    them. Slots are removed only by the dispatcher, between claims, since
+    that waits for their jobs to finish. The lock keeps slots from being
+    added while the dispatcher waits for all jobs (e.g. to recycle the
+    browser).
+    """
 
+    def __init__(
+        self,
+        active: int,
+        browser: _browser.BrowserManager,
+        resize_context_pool: bool,
+    ) -> None:
+        self.active = active
+        self.target = active
+        self.free_slots = asyncio.Semaphore(active)
+        self.lock = asyncio.Lock()
+        self._browser = browser
+        self._resize_context_pool = resize_context_pool
+        self._grown = asyncio.Event()
 
-async def _worker_loop(name: str, db_path: str, jobs_path: str) -> None:
+    async def grow(self) -> None:
+        async with self.lock:
+            added = max(self.target - self.active, 0)
+            for _ in range(added):
+                self.free_slots.release()
+            self.active += added
+            await self._resize()
+        self._grown.set()
+
+    async def shrink(self) -> None:
+        async with self.lock:
+            while self.active > self.target:
+                await self.free_slots.acquire()
+                self.active -= 1
+            await self._resize()
+
+    async def wait_for_slots(self) -> None:
+        while not self.active:
+            self._grown.clear()
+            await self._grown.wait()
+
+    async def _resize(self) -> None:
+        # Contexts of inactive slots would only take memory
+        if self._resize_context_pool:
+            await self._browser.resize_context_pool(self.active)
+
+
+async def _worker_loop(
+    name: str,
+    backend: _backend.Backend,
+    notify_dir: Path,
+    jobs_path: str,
+    concurrency: int = 1,
+    context_pool_size: Optional[int] = None,
+    recycle_limits: Optional[_browser.RecycleLimits] = None,
+    job_names: Optional[List[str]] = None,
+    scaling: Optional[_scaling.ScalingLimits] = None,
+    asset_cache: Optional[_assets.AssetCacheSettings] = None,
+) -> None:
     worker_logger = logging.getLogger(name)
 
-    db = await _database.create_connection(db_path)
     jobs_defs = _jobs.collect_jobs_defs(jobs_path)
-    await _database.check_in_worker(db, name)
+    if job_names:
+        unknown = set(job_names) - jobs_defs.keys()
+        if unknown:
+            raise ValueError(
+                f"Jobs {', '.join(sorted(unknown))} are not defined"
+            )
+        # Jobs of other types are left for other workers
+        jobs_defs = {n: jobs_defs[n] for n in job_names}
+        worker_logger.info(
+            "Serving only jobs: %s", ", ".join(sorted(jobs_defs))
+        )
 
-    pw = await PlaywrightContextManager().start()
-    browser: Browser = await pw.chromium.launch(headless=True)
-    worker_logger.info("Browser launched and ready")
+    output_store = _storage.get_output_store()
+    cache = None
+    if asset_cache:
+        cache = _assets.AssetCache(asset_cache)
+        await cache.open()
+        worker_logger.info(
+            "Caching assets in %s (up to %d MiB)",
+            asset_cache.path,
+            asset_cache.max_size // 2**20,
+        )
+    await backend.check_in_worker(name)
 
-    worker_heartbeat = time.monotonic()
-    job: Optional[_database.DBJob] = None
-    start_time: Optional[float] = None
+    listener = _notify.Listener(notify_dir, _notify.WORKERS_CHANNEL, name)
+    await listener.start()
+    cancel_listener = _notify.Listener(
+        notify_dir, _notify.CANCEL_CHANNEL, name
+    )
+    await cancel_listener.start()
+
+    # Autoscaling workers start with the fewest slots and can grow up to
+    # the most of them
+    slots = scaling.max_slots if scaling else concurrency
+    active = scaling.min_slots if scaling else concurrency
+    # By default, every active slot has a context ready for its next job
+    pool_follows_slots = context_pool_size is None
+    browser = _browser.BrowserManager(
+        recycle_limits or _browser.RecycleLimits(),
+        active if pool_follows_slots else context_pool_size,
+        # Contexts are kept ready for every profile of the served jobs
+        {job_cls.CONTEXT_PROFILE for job_cls in jobs_defs.values()},
+        cache,
+    )
+    # Every active slot owns one permit while it's busy with a job. The
+    # dispatcher claims a job only after acquiring a permit, so claimed jobs
+    # never wait in the queue for longer than it takes an idle slot to pick
+    # them up.
+    capacity = _Capacity(active, browser, pool_follows_slots)
+
+    if scaling:
+        worker_logger.info(
+            "Autoscaling between %d and %d slots",
+            scaling.min_slots,
+            scaling.max_slots,
+        )
+    if active:
+        await browser.launch()
+        worker_logger.info(
+            "Browser launched and ready (concurrency: %d, context pool: %s)",
+            active,
+            active if pool_follows_slots else context_pool_size,
+        )
+
+    queue: "asyncio.Queue[_ClaimedJob]" = asyncio.Queue()
+    # Executions of jobs in progress, by job ID
+    running: Dict[int, asyncio.Task] = {}
+    # IDs of jobs leased by the worker, either queued or in progress
+    claimed: Set[int] = set()
+    # Timings measured after the jobs were saved, by job ID
+    late_timings: Dict[int, Dict[str, float]] = {}
+
+    tasks = [
+        asyncio.create_task(
+            _dispatch_loop(
+                name,
+                backend,
+                queue,
+                capacity,
+                browser,
+                listener,
+                notify_dir,
+                claimed,
+                job_names,
+            ),
+            name=f"{name}-dispatcher",
+        ),
+        asyncio.create_task(
+            _heartbeat_loop(name, backend, claimed, late_timings),
+            name=f"{name}-heartbeat",
+        ),
+        asyncio.create_task(
+            _cancel_loop(name, backend, running, cancel_listener),
+            name=f"{name}-canceller",
+        ),
+    ]
+    if _browser.can_measure_memory():
+        tasks.append(
+            asyncio.create_task(
+                _monitor_loop(name, backend, browser),
+                name=f"{name}-monitor",
+            )
+        )
+    elif browser.limits.max_memory:
+        worker_logger.warning(
+            "Memory of the browser can't be measured on this system,"
+            " its limit is ignored"
+        )
+    if scaling:
+        tasks.append(
+            asyncio.create_task(
+                _autoscale_loop(
+                    name,
+                    backend,
+                    _scaling.Autoscaler(scaling),
+                    capacity,
+                    claimed,
+                    job_names,
+                ),
+                name=f"{name}-autoscaler",
+            )
+        )
+    for slot in range(slots):
+        slot_name = name if slots == 1 else f"{name}/{slot}"
+        tasks.append(
+            asyncio.create_task(
+                _slot_loop(
+                    name,
+                    slot_name,
+                    backend,
+                    browser,
+                    jobs_defs,
+                    output_store,
+                    notify_dir,
+                    queue,
+                    capacity.free_slots,
+                    running,
+                    claimed,
+                    late_timings,
+                ),
+                name=slot_name,
+            )
+        )
 
     try:
-        while True:
-            job = await _database.get_next_job(db, name)
-            if not job:
-                if (
-                    time.monotonic() - worker_heartbeat
-                    >= _HEARTBEAT_LOG_INTERVAL
-                ):
-                    await _database.update_worker_activity(db, name)
-                    worker_heartbeat = time.monotonic()
-                worker_logger.debug(
-                    f"No jobs available, sleeping for {_JOB_POLL_INTERVAL}s"
-                )
-                await asyncio.sleep(_JOB_POLL_INTERVAL)
-                continue
+        # None of the tasks return on their own, so the first finished task
+        # is the one that crashed.
+        done, _ = await asyncio.wait(
+            tasks, return_when=asyncio.FIRST_COMPLETED
+        )
+        for task in done:
+            task.result()
 
-            worker_logger.info(f"Starting job {job.id} (type: {job.name})")
+    except asyncio.CancelledError:
+        # Don't propagate CancelledError since it's expected during shutdown
+        pass
+
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+        # Jobs claimed right before the shutdown that no slot has started yet
+        # can be safely picked up by another worker.
+        while not queue.empty():
+            job = queue.get_nowait().job
+            worker_logger.info(f"Job {job.id} was not started, requeueing")
+            await backend.requeue_job(job.id)
+            _notify.notify(notify_dir, _notify.WORKERS_CHANNEL)
+
+        listener.close()
+        cancel_listener.close()
+        await browser.close()
+        if cache:
+            await cache.close()
+
+
+async def _dispatch_loop(
+    name: str,
+    backend: _backend.Backend,
+    queue: "asyncio.Queue[_ClaimedJob]",
+    capacity: _Capacity,
+    browser: _browser.BrowserManager,
+    listener: _notify.Listener,
+    notify_dir: Path,
+    claimed: Set[int],
+    job_names: Optional[List[str]] = None,
+) -> None:
+    worker_logger = logging.getLogger(name)
+    poll_interval = _MIN_JOB_POLL_INTERVAL
+
+    free_slots = capacity.free_slots
+
+    while True:
+        if capacity.target < capacity.active:
+            await capacity.shrink()
+        if not capacity.active:
+            if browser.is_launched:
+                # An idle browser isn't worth its memory
+                await browser.close()
+                worker_logger.info("No slots left, browser closed")
+            await capacity.wait_for_slots()
+            continue
+        if not browser.is_launched:
+            await browser.launch()
+            worker_logger.info("Browser launched")
+
+        await free_slots.acquire()
+        if capacity.target < capacity.active:
+            # Slots are removed before any more jobs are claimed
+            free_slots.release()
+            continue
+
+        reason = browser.get_recycle_reason()
+        if reason:
+            async with capacity.lock:
+                # No new jobs are claimed, so once all permits are taken the
+                # jobs in progress are done and nothing uses the browser
+                for _ in range(capacity.active - 1):
+                    await free_slots.acquire()
+                # Jobs that finished in the meantime count in
+                reason = browser.get_recycle_reason() or reason
+                try:
+                    await _recycle_browser(name, backend, browser, reason)
+                finally:
+                    for _ in range(capacity.active):
+                        free_slots.release()
+            continue
+
+        # Claim a job for every idle slot in a single round trip
+        slots = 1 + await _acquire_available(free_slots)
+
+        jobs = await _claim_jobs(backend, name, slots, job_names)
+        while not jobs:
+            if (
+                browser.get_recycle_reason()
+                or capacity.target < capacity.active
+            ):
+                # Give up the permits, the browser is recycled or slots are
+                # removed right away
+                break
+
+            worker_logger.debug(
+                f"No jobs available, waiting up to {poll_interval}s"
+            )
+
+            # Claiming takes a write lock, so while idle it's attempted only
+            # after a notification or once a cheap read finds pending jobs.
+            woken = await listener.wait(poll_interval)
+            if woken or await backend.has_pending_jobs(job_names):
+                poll_interval = _MIN_JOB_POLL_INTERVAL
+                slots += await _acquire_available(free_slots)
+                jobs = await _claim_jobs(backend, name, slots, job_names)
+            else:
+                poll_interval = min(poll_interval * 2, _JOB_POLL_INTERVAL)
+
+        # Let clients waiting for these jobs know they've been started
+        if jobs:
+            _notify.notify(notify_dir, _notify.SERVERS_CHANNEL)
+
+        for claimed_job in jobs:
+            claimed.add(claimed_job.job.id)
+            queue.put_nowait(claimed_job)
+        for _ in range(slots - len(jobs)):
+            free_slots.release()
+
+
+async def _claim_jobs(
+    backend: _backend.Backend,
+    name: str,
+    limit: int,
+    job_names: Optional[List[str]],
+) -> List[_ClaimedJob]:
+    start = time.perf_counter()
+    jobs = await backend.claim_jobs(name, limit, names=job_names)
+    claim_time = _elapsed_ms(start)
+    claimed_at = time.perf_counter()
+    return [_ClaimedJob(job, claim_time, claimed_at) for job in jobs]
+
+
+async def _recycle_browser(
+    name: str,
+    backend: _backend.Backend,
+    browser: _browser.BrowserManager,
+    reason: str,
+) -> None:
+    worker_logger = logging.getLogger(name)
+    worker_logger.info(f"Recycling browser ({reason})")
+
+    await backend.add_worker_event(
+        name,
+        "browser_recycle",
+        browser_memory=browser.memory,
+        browser_jobs=browser.jobs,
+        browser_age=browser.age,
+        reason=reason,
+    )
+    await browser.recycle()
+    worker_logger.info("Browser relaunched")
 
-            start_time = time.monotonic()
-            worker_heartbeat = time.monotonic()
-            ctx = await browser.new_context()
-            page = await ctx.new_page()
 
+async def _monitor_loop(
+    name: str, backend: _backend.Backend, browser: _browser.BrowserManager
+) -> None:
+    """Periodically samples memory used by the browser."""
+    while True:
+        memory = await asyncio.to_thread(_browser.get_child_processes_memory)
+        # Autoscaling workers close the browser when they have no slots
+        if memory is not None and browser.is_launched:
+            browser.memory = memory
             try:
-                output = await asyncio.create_task(
-                    jobs_defs[job.name](**job.input).execute(page)
+                await backend.add_worker_event(
+                    name,
+                    "memory_sample",
+                    browser_memory=memory,
+                    browser_jobs=browser.jobs,
+                    browser_age=browser.age,
                 )
-                worker_logger.info(f"Job {job.id} completed successfully")
-                await _database.update_job_status(
-                    db,
-                    worker=name,
-                    job_id=job.id,
-                    status=_models.JobStatus.DONE,
-                    processing_time=_calc_processing_time(start_time),
-                    output=output,
+            except backend.TRANSIENT_ERRORS:
+                # A lost sample isn't worth stopping the worker
+                logging.getLogger(name).warning(
+                    "Failed to record memory sample", exc_info=True
                 )
-                job = None
-                start_time = None
-
-            except PlaywrightError:
-                # We only catch PlaywrightError since they are somewhat expected
-                # (e.g. network issues, invalid URLs). Other exceptions like
-                # bugs in job implementation should crash the worker to surface
-                # the issue.
-                worker_logger.exception(
-                    f"Playwright error occurred for job {job.id}."
-                    " Marking job as failed."
+        await asyncio.sleep(_MEMORY_SAMPLE_INTERVAL)
+
+
+async def _autoscale_loop(
+    name: str,
+    backend: _backend.Backend,
+    autoscaler: _scaling.Autoscaler,
+    capacity: _Capacity,
+    claimed: Set[int],
+    job_names: Optional[List[str]],
+) -> None:
+    """Adjusts the number of slots to the queue of jobs the worker takes."""
+    worker_logger = logging.getLogger(name)
+
+    while True:
+        await asyncio.sleep(_AUTOSCALE_INTERVAL)
+        try:
+            stats = await backend.get_queue_stats(job_names)
+        except backend.TRANSIENT_ERRORS:
+            worker_logger.warning("Failed to read the queue", exc_info=True)
+            continue
+
+        previous = autoscaler.slots
+        decision = autoscaler.decide(stats, len(claimed), time.monotonic())
+        if not decision:
+            continue
+
+        worker_logger.info(
+            "Scaling from %d to %d slots (%s)",
+            previous,
+            decision.slots,
+            decision.reason,
+        )
+        capacity.target = decision.slots
+        # Removing slots waits for their jobs, so it's left to the dispatcher
+        await capacity.grow()
+        try:
+            await backend.add_worker_event(
+                name, "scale", reason=decision.reason, slots=decision.slots
+            )
+        except backend.TRANSIENT_ERRORS:
+            worker_logger.warning(
+                "Failed to record scaling decision", exc_info=True
+            )
+
+
+async def _heartbeat_loop(
+    name: str,
+    backend: _backend.Backend,
+    claimed: Set[int],
+    late_timings: Dict[int, Dict[str, float]],
+) -> None:
+    """Reports that the worker is alive and extends leases on its jobs.
+
+    Timings measured after jobs were saved are written along the way, so
+    they don't cost another write per job.
+    """
+    try:
+        while True:
+            await asyncio.sleep(_HEARTBEAT_INTERVAL)
+            try:
+                await backend.heartbeat(
+                    name, list(claimed), timings=_take_all(late_timings)
                 )
-                await _database.update_job_status(
-                    db,
-                    worker=name,
-                    job_id=job.id,
-                    status=_models.JobStatus.FAILED,
-                    processing_time=_calc_processing_time(start_time),
-                    output=None,
+            except backend.TRANSIENT_ERRORS:
+                # Leases last long enough to survive a missed heartbeat
+                logging.getLogger(name).warning(
+                    "Failed to send heartbeat", exc_info=True
                 )
-                job = None
-                start_time = None
+    finally:
+        timings = _take_all(late_timings)
+        if timings:
+            try:
+                await backend.add_job_timings(timings)
+            except backend.TRANSIENT_ERRORS:
+                # These timings are informative only, they aren't worth a
+                # retry
+                pass
+
+
+def _take_all(
+    late_timings: Dict[int, Dict[str, float]],
+) -> Dict[int, Dict[str, float]]:
+    timings = dict(late_timings)
+    late_timings.clear()
+    return timings
+
+
+async def _cancel_loop(
+    name: str,
+    backend: _backend.Backend,
+    running: Dict[int, asyncio.Task],
+    listener: _notify.Listener,
+) -> None:
+    """Interrupts jobs in progress that were cancelled."""
+    while True:
+        await listener.wait(_CANCEL_POLL_INTERVAL)
+        if not running:
+            continue
+
+        try:
+            jobs = await backend.get_jobs_by_ids(list(running))
+        except backend.TRANSIENT_ERRORS:
+            # Cancelled jobs are checked again on the next notification or
+            # poll
+            logging.getLogger(name).warning(
+                "Failed to check for cancelled jobs", exc_info=True
+            )
+            continue
+        for job in jobs:
+            execution = running.get(job.id)
+            if job.status == _models.JobStatus.CANCELLED and execution:
+                execution.cancel()
+
+
+async def _acquire_available(free_slots: asyncio.Semaphore) -> int:
+    """Acquires all permits that are available without waiting."""
+    acquired = 0
+    while not free_slots.locked():
+        await free_slots.acquire()
+        acquired += 1
+    return acquired
+
+
+async def _slot_loop(
+    name: str,
+    slot_name: str,
+    backend: _backend.Backend,
+    browser: _browser.BrowserManager,
+    jobs_defs: Dict[str, Type[_jobs.BaseJob]],
+    output_store: Optional[_storage.OutputStore],
+    notify_dir: Path,
+    queue: "asyncio.Queue[_ClaimedJob]",
+    free_slots: asyncio.Semaphore,
+    running: Dict[int, asyncio.Task],
+    claimed: Set[int],
+    late_timings: Dict[int, Dict[str, float]],
+) -> None:
+    slot_logger = logging.getLogger(slot_name)
+
+    job: Optional[_models.Job] = None
+    start_time: Optional[float] = None
+
+    try:
+        while True:
+            job, claim_time, claimed_at = await queue.get()
+            slot_logger.info(f"Starting job {job.id} (type: {job.name})")
+
+            start_time = time.monotonic()
+            timings = {
+                "claim": claim_time,
+                "queue": _elapsed_ms(claimed_at),
+            }
+            job_cls = jobs_defs[job.name]
+            timeout = job.timeout or job_cls.TIMEOUT
+            contexts = browser.contexts
+            pooled = await contexts.acquire(
+                job_cls.CONTEXT_PROFILE,
+                reuse=job_cls.REUSE_CONTEXT,
+                timings=timings,
+            )
+            # The context is recycled only after a successful job, otherwise
+            # its state is unknown
+            reusable = False
+            status = None
+            output = None
+            output_size = None
+            output_encoding = None
+            # Phases after the job was saved, they're saved by the heartbeat
+            late = {}
+
+            try:
+                try:
+                    # The job's task inherits the timings, so its spans are
+                    # saved along with the phases
+                    token = _jobs.current_timings.set(timings)
+                    execute_start = time.perf_counter()
+                    try:
+                        execution = asyncio.create_task(
+                            job_cls(**job.input).execute(pooled.page)
+                        )
+                    finally:
+                        _jobs.current_timings.reset(token)
+                    running[job.id] = execution
+                    try:
+                        # Unlike awaiting the task, waiting doesn't raise when
+                        # the job is cancelled, which is how it's told apart
+                        # from cancelling the slot itself
+                        done, _ = await asyncio.wait(
+                            {execution}, timeout=timeout
+                        )
+                    finally:
+                        del running[job.id]
+                        if not execution.done():
+                            execution.cancel()
+                            await asyncio.gather(
+                                execution, return_exceptions=True
+                            )
+                    timings["execute"] = _elapsed_ms(execute_start)
+
+                    if not done:
+                        slot_logger.warning(
+                            f"Job {job.id} timed out after {timeout}s"
+                        )
+                        status = _models.JobStatus.TIMED_OUT
+
+                    elif execution.cancelled():
+                        # The status is set already by whoever cancelled the
+                        # job
+                        slot_logger.info(f"Job {job.id} was cancelled")
+
+                    else:
+                        output = execution.result()
+                        slot_logger.info(
+                            f"Job {job.id} completed successfully"
+                        )
+                        status = _models.JobStatus.DONE
+                        reusable = job_cls.REUSE_CONTEXT
+                        output_size = len(output) if output else 0
+                        if output and job_cls.OUTPUT_COMPRESSION:
+                            compress_start = time.perf_counter()
+                            output, output_encoding = await asyncio.to_thread(
+                                _compression.compress,
+                                output,
+                                job_cls.OUTPUT_COMPRESSION,
+                            )
+                            timings["compress"] = _elapsed_ms(compress_start)
+                        if output and output_store:
+                            store_start = time.perf_counter()
+                            output = await asyncio.to_thread(
+                                output_store.put, output
+                            )
+                            timings["store"] = _elapsed_ms(store_start)
+
+                except PlaywrightError:
+                    # We only catch PlaywrightError since they are somewhat
+                    # expected (e.g. network issues, invalid URLs). Other
+                    # exceptions like bugs in job implementation should crash
+                    # the worker to surface the issue.
+                    slot_logger.exception(
+                        f"Playwright error occurred for job {job.id}."
+                        " Marking job as failed."
+                    )
+                    status = _models.JobStatus.FAILED
+                    output = None
+
+                if status:
+                    db_write_start = time.perf_counter()
+                    await backend.complete_job(
+                        worker=name,
+                        job_id=job.id,
+                        status=status,
+                        processing_time=_calc_processing_time(start_time),
+                        output=output,
+                        output_encoding=output_encoding,
+                        cache_ttl=job_cls.CACHE_TTL,
+                        timings=timings,
+                        output_size=output_size,
+                    )
+                    late["db_write"] = _elapsed_ms(db_write_start)
+                    _notify.notify(notify_dir, _notify.SERVERS_CHANNEL)
 
             finally:
-                await page.close()
-                await ctx.close()
+                teardown_start = time.perf_counter()
+                await contexts.release(pooled, reuse=reusable)
+                browser.jobs += 1
+                if late:
+                    late["teardown"] = _elapsed_ms(teardown_start)
+                    late_timings[job.id] = late
+
+            claimed.discard(job.id)
+            job = None
+            start_time = None
+            free_slots.release()
 
-    except BaseException as e:
+    except BaseException:
         if job:
-            worker_logger.info(
+            slot_logger.info(
                 f"Job {job.id} was in progress, marking as failed"
             )
-            await _database.update_job_status(
-                db,
+            await backend.complete_job(
                 worker=name,
                 job_id=job.id,
-                status=_jobs.JobStatus.FAILED,
+                status=_models.JobStatus.FAILED,
                 processing_time=(
                     _calc_processing_time(start_time) if start_time else 0
                 ),
                 output=None,
             )
-
-        # Don't propagate CancelledError since it's expected during shutdown
-        if not isinstance(e, asyncio.CancelledError):
-            raise
-
-    finally:
-        await pw.stop()
-        await db.close()
+            _notify.notify(notify_dir, _notify.SERVERS_CHANNEL)
+        raise
 
 
 def _calc_processing_time(s: float) -> int:
@@ -131,14 +735,73 @@ def _calc_processing_time(s: float) -> int:
     return round((time.monotonic() - s) * 1000)
 
 
+def _elapsed_ms(start: float) -> float:
+    return round((time.perf_counter() - start) * 1000, 2)
+
+
 def _shutdown(main_task: asyncio.Task, s: signal.Signals) -> None:
     logger.info(f"Received shutdown signal {s.name!r}. Shutting down...")
     main_task.cancel()
 
 
-def start_worker(name: str, db_path: str, jobs_path: str) -> None:
+async def _run_sqlite_worker(
+    name: str,
+    db_path: str,
+    jobs_path: str,
+    concurrency: int,
+    context_pool_size: Optional[int],
+    recycle_limits: Optional[_browser.RecycleLimits],
+    job_names: Optional[List[str]],
+    scaling: Optional[_scaling.ScalingLimits],
+    asset_cache: Optional[_assets.AssetCacheSettings],
+) -> None:
+    # Every slot, the dispatcher, the heartbeat, the monitor and the
+    # autoscaler might write at the same time, and none of them should wait
+    # for a connection
+    slots = scaling.max_slots if scaling else concurrency
+    backend = _sqlite.SQLiteBackend(
+        db_path, pool_size=slots + 4, read_pool_size=2
+    )
+    async with backend:
+        await _worker_loop(
+            name,
+            backend,
+            _notify.get_notify_dir(db_path),
+            jobs_path,
+            concurrency,
+            context_pool_size,
+            recycle_limits,
+            job_names,
+            scaling,
+            asset_cache,
+        )
+
+
+def start_worker(
+    name: str,
+    db_path: str,
+    jobs_path: str,
+    concurrency: int = 1,
+    context_pool_size: Optional[int] = None,
+    recycle_limits: Optional[_browser.RecycleLimits] = None,
+    job_names: Optional[List[str]] = None,
+    scaling: Optional[_scaling.ScalingLimits] = None,
+    asset_cache: Optional[_assets.AssetCacheSettings] = None,
+) -> None:
     loop = asyncio.get_event_loop()
-    main_task = loop.create_task(_worker_loop(name, db_path, jobs_path))
+    main_task = loop.create_task(
+        _run_sqlite_worker(
+            name,
+            db_path,
+            jobs_path,
+            concurrency,
+            context_pool_size,
+            recycle_limits,
+            job_names,
+            scaling,
+            asset_cache,
+        )
+    )
 
     for s in (signal.SIGINT, signal.SIGTERM):
         loop.add_signal_handler(s, lambda sig=s: _shutdown(main_task, sig))